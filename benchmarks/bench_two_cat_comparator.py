@@ -0,0 +1,87 @@
+''' Benchmark for two_cat_comparator.
+
+    Times the grouped count engine behind two_cat_comparator on synthetic data, growing the
+    number of rows and the number of categories of both features, next to the old approach
+    (one boolean mask over the whole DataFrame per pair of categories) while that one is still
+    quick enough to run.
+
+    Usage
+    -----
+    python benchmarks/bench_two_cat_comparator.py
+    python benchmarks/bench_two_cat_comparator.py --rows 100000 2000000 --cardinality 20 500
+'''
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.data_preprocessing import category_pair_counts, two_cat_comparator
+from modules.dataset_profile import stamp_version
+
+
+def make_frame(rows, cardinality, seed = 0):
+    rng = np.random.default_rng(seed)
+    labels = np.array(["cat_" + str(i) for i in range(cardinality)], dtype = object)
+    return pd.DataFrame({
+        "first": labels[rng.integers(0, cardinality, rows)],
+        "second": labels[rng.integers(0, cardinality, rows)],
+    })
+
+
+def fresh_version(df):
+    # A new dataset version on every call, two_cat_comparator's figure cache would otherwise answer the repeats
+    stamp_version(df, uuid.uuid4().hex)
+    return df
+
+
+def mask_based_counts(df, type_1, type_2):
+    # The previous implementation, O(k1 * k2 * rows)
+    dic = {}
+    for cat_1 in df[type_1].value_counts().index:
+        sub_dict = {}
+        for cat_2 in df[type_2].value_counts().index:
+            sub_dict[cat_2] = len(df[(df[type_1] == cat_1) & (df[type_2] == cat_2)])
+        dic[cat_1] = sub_dict
+    return dic
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type = int, nargs = "+", default = [10000, 100000, 1000000])
+    parser.add_argument("--cardinality", type = int, nargs = "+", default = [5, 50, 500])
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--mask-budget", type = float, default = 2e8,
+                        help = "run the old mask based version only while rows * k1 * k2 stays below this")
+    args = parser.parse_args(argv)
+
+    print("%10s %12s %14s %14s %14s" % ("rows", "categories", "pair counts s", "comparator s", "old masks s"))
+    for rows in args.rows:
+        for cardinality in args.cardinality:
+            df = make_frame(rows, cardinality)
+            counts_time = best_of(lambda: category_pair_counts(df, "first", "second"), args.repeat)
+            comparator_time = best_of(lambda: two_cat_comparator(["first", "second"], fresh_version(df)), args.repeat)
+
+            if rows * cardinality * cardinality <= args.mask_budget:
+                mask_time = "%14.4f" % best_of(lambda: mask_based_counts(df, "first", "second"), 1)
+            else:
+                mask_time = "%14s" % "skipped"
+            print("%10d %12d %14.4f %14.4f %s" % (rows, cardinality, counts_time, comparator_time, mask_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+''' Benchmark suite for the preprocessing and modelling hot paths.
+
+    Times null_value, imbalanced_feature, useless_feat, two_cat_comparator, fill_feature, the encoding
+    and splitting of the Model Building step and Models.model_call for every estimator, on synthetic
+    datasets of growing size (rows x columns) and on the bundled Examplar-datasets files.
+    Results are written as json, and a run can be compared with a previous one to catch regressions.
+
+    Every timing is the best of --repeat runs. The dataset profile is cached per dataset version, so each
+    run gets a new version and pays for profiling like the first visit of a page does.
+    Synthetic grids bigger than --max-cells cells are skipped, and so are models over their row limit
+    (see model_row_limits), they are recorded as skipped in the json.
+
+    Usage
+    -----
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --rows 10000 100000 --columns 10 100 --cases null_value fill_feature
+    python benchmarks/run_benchmarks.py --rows 10000000 --columns 10 --max-cells 2e8 --no-models
+    python benchmarks/run_benchmarks.py --output new.json --compare bench.json          # exits with 1 on a regression
+    python benchmarks/run_benchmarks.py --load new.json --compare bench.json            # compares two saved runs
+'''
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+import pandas as pd
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from modules.dataset_profile import stamp_version
+from modules.data_preprocessing import null_value, imbalanced_feature, useless_feat, two_cat_comparator, fill_feature, drop_feat
+from modules.encoding import fit_encoding_schema, encode_with_schema
+from modules.splitting import make_split
+from modules.models import Models, models_mapper
+
+
+# Bundled datasets --> name : (file, target feature, problem)
+bundled_datasets = {
+    'titanic': ('titanic.csv', 'Survived', 'Classification'),
+    'house_prices': ('house_pric_predict.csv', 'SalePrice', 'Regression'),
+}
+
+regression_models = ['LinearRegression', 'RandomForestRegressor', 'SVR', 'MLPRegressor', 'DecisionTreeRegressor', 'XGBRegressor', 'SGDRegressor']
+classification_models = ['LogisticRegression', 'RandomForestClassifier', 'SVC', 'MLPClassifier', 'DecisionTreeClassifier', 'XGBClassifier',
+                         'SGDClassifier', 'MultinomialNB', 'GaussianNB']
+
+# Largest number of rows a model is timed on, kernel SVMs grow quadratically and would run for hours
+model_row_limits = {'SVR': 20000, 'SVC': 20000, 'MLPRegressor': 200000, 'MLPClassifier': 200000}
+
+preprocessing_cases = ['null_value', 'imbalanced_feature', 'useless_feat', 'two_cat_comparator', 'fill_feature', 'encode_split']
+
+
+def make_frame(rows, columns, seed = 0):
+    '''
+    Synthetic dataset with the kinds of features the Home page deals with : numerical features with nulls (60 %),
+    categorical features with a few categories (20 %), imbalanced ones (10 %) and id like ones with a category
+    every 10 rows (10 %, what useless_feat reports). Targets are returned apart, so every column is a feature.
+    Returns (df, classification target, regression target).
+    '''
+    rng = np.random.default_rng(seed)
+    n_categorical = max(1, columns // 5)
+    n_imbalanced = max(1, columns // 10)
+    n_id = max(1, columns // 10)
+    n_numerical = max(1, columns - n_categorical - n_imbalanced - n_id)
+
+    data = {}
+    for i in range(n_numerical):
+        values = rng.standard_normal(rows)
+        if i % 2 == 0:
+            values[rng.random(rows) < 0.1] = np.nan
+        data["num_" + str(i)] = values
+    labels = np.array(["cat_" + str(i) for i in range(12)], dtype = object)
+    for i in range(n_categorical):
+        values = labels[rng.integers(0, 3 + i % 10, rows)]
+        if i % 2 == 0:
+            values[rng.random(rows) < 0.05] = np.nan
+        data["cat_" + str(i)] = values
+    for i in range(n_imbalanced):
+        data["imbalanced_" + str(i)] = np.where(rng.random(rows) < 0.95, "common", labels[rng.integers(0, 12, rows)]).astype(object)
+    for i in range(n_id):
+        data["id_" + str(i)] = ("id_" + pd.Series(rng.integers(0, max(rows // 10, 1), rows)).astype(str)).to_numpy(dtype = object)
+    df = pd.DataFrame(data)
+
+    signal = np.nan_to_num(df["num_0"].to_numpy()) + (df["cat_0"] == "cat_1").to_numpy()
+    y_class = (signal > 0.5).astype(np.int64) + (signal > 1.5)
+    y_reg = 3 * signal + rng.standard_normal(rows)
+    return df, y_class, y_reg
+
+
+def fresh_version(df):
+    # A new dataset version, so the profile isn't taken from the cache of an earlier run
+    stamp_version(df, uuid.uuid4().hex)
+    return df
+
+
+def model_ready(df):
+    # The Home page flow before model building : useless features dropped, features mostly null dropped, the rest filled
+    df = fresh_version(df.copy())
+    df.drop(list(useless_feat(df)["Feature"]), axis = 1, inplace = True)
+    nulls = null_value(fresh_version(df))
+    drop_feat(df, [feature for feature, strategy in zip(nulls['Column/Feature'], nulls['Strategy_that_can_be_used']) if strategy == 'Drop it'])
+    nulls = nulls[nulls['Strategy_that_can_be_used'] != 'Drop it']
+    fill_feature(df, list(nulls['Column/Feature']), list(nulls['Strategy_that_can_be_used']))
+    return df
+
+
+def encode_split(df, target_feature, y, problem):
+    schema = fit_encoding_schema(df, target_feature)
+    X = encode_with_schema(df, schema)
+    train_index, test_index = make_split("Stratified" if problem == "Classification" else "Shuffled", X.shape[0], 0.82, y = y)
+    return X, (train_index, test_index)
+
+
+def time_case(prepare, run, repeat, memory = False):
+    '''
+    Best of repeat timings of run(*prepare()), prepare isn't timed.
+    Returns (best seconds, every timing, peak traced MB of the last run or None).
+    '''
+    timings = []
+    peak = None
+    for i in range(repeat):
+        args = prepare()
+        trace = memory and i == repeat - 1  # tracing slows the run down, only the last one is traced
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        run(*args)
+        timings.append(time.perf_counter() - start)
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            tracemalloc.stop()
+    return min(timings), timings, peak
+
+
+def dataset_cases(df, target_feature, y_class, y_reg, problem, args):
+    '''
+    Yields (case name, prepare, run, skip reason) for one dataset.
+    target_feature is None for synthetic datasets, whose targets are kept apart from df.
+    '''
+    categorical = [col for col in df.columns if df.dtypes[col] == object and not str(col).startswith("id_")]
+    nulls = [col for col in df.columns if df[col].isnull().any()]
+    fill_strategies = ['mode' if df.dtypes[col] == object else 'mean' for col in nulls]
+
+    yield 'null_value', lambda: (fresh_version(df),), null_value, None
+    yield 'imbalanced_feature', lambda: (fresh_version(df),), imbalanced_feature, None
+    yield 'useless_feat', lambda: (fresh_version(df),), useless_feat, None
+    yield ('two_cat_comparator', lambda: (categorical[:2], fresh_version(df)), two_cat_comparator,
+           None if len(categorical) >= 2 else "fewer than 2 categorical features")
+    yield 'fill_feature', lambda: (fresh_version(df.copy()), nulls, fill_strategies), fill_feature, None
+
+    if args.cases and not {'encode_split', 'model_call'} & set(args.cases):
+        return
+    ready = model_ready(df)
+    if target_feature is not None:
+        y_values = ready[target_feature].to_numpy()
+    else:
+        y_values = y_class if problem == "Classification" else y_reg
+    yield 'encode_split', lambda: (ready, target_feature, y_values, problem), encode_split, None
+
+    if args.no_models:
+        return
+    problems = [problem] if problem is not None else ["Classification", "Regression"]
+    for model_problem in problems:
+        if target_feature is None:
+            y_values = y_class if model_problem == "Classification" else y_reg
+        X, split = encode_split(ready, target_feature, y_values, model_problem)
+        model_names = classification_models if model_problem == "Classification" else regression_models
+        for model_name in model_names:
+            if args.models and model_name not in args.models:
+                continue
+            limit = min(model_row_limits.get(model_name, args.model_max_rows), args.model_max_rows)
+            skip = None if X.shape[0] <= limit else "more than " + str(limit) + " rows"
+            if model_name == 'MultinomialNB':
+                skip = skip or "needs non negative features"
+            prepare = (lambda model_name = model_name, X = X, y_values = y_values, split = split, model_problem = model_problem:
+                       (Models([X], [y_values], model_problem, [model_name], split = split),))
+            yield 'model_call:' + model_name, prepare, Models.model_call, skip
+
+
+def run_suite(args):
+    datasets = []
+    for rows in args.rows:
+        for columns in args.columns:
+            datasets.append(('synthetic', rows, columns))
+    if not args.no_bundled:
+        datasets.extend((name, None, None) for name in bundled_datasets)
+
+    results = []
+    for name, rows, columns in datasets:
+        if name == 'synthetic':
+            if rows * columns > args.max_cells:
+                results.append({'case': '*', 'dataset': name, 'rows': rows, 'columns': columns, 'status': 'skipped',
+                                'note': "more than --max-cells cells"})
+                print("%-36s %-14s %10d %6d %10s" % ('*', name, rows, columns, 'skipped'))
+                continue
+            df, y_class, y_reg = make_frame(rows, columns, args.seed)
+            target_feature, problem = None, None
+        else:
+            file_name, target_feature, problem = bundled_datasets[name]
+            df = pd.read_csv(os.path.join(root, "Examplar-datasets", file_name))
+            y_class = y_reg = None
+            rows, columns = df.shape
+
+        for case, prepare, run, skip in dataset_cases(df, target_feature, y_class, y_reg, problem, args):
+            if args.cases and case.split(":")[0] not in args.cases:
+                continue
+            result = {'case': case, 'dataset': name, 'rows': rows, 'columns': columns}
+            if skip is not None:
+                result.update(status = 'skipped', note = skip)
+                print("%-36s %-14s %10d %6d %10s" % (case, name, rows, columns, 'skipped'))
+            else:
+                try:
+                    seconds, timings, peak = time_case(prepare, run, args.repeat, args.memory)
+                    result.update(status = 'ok', seconds = seconds, timings = timings, peak_megabytes = peak)
+                    print("%-36s %-14s %10d %6d %10.4f" % (case, name, rows, columns, seconds))
+                except Exception as err:
+                    result.update(status = 'failed', note = repr(err))
+                    print("%-36s %-14s %10d %6d %10s  %r" % (case, name, rows, columns, 'failed', err))
+            results.append(result)
+    return results
+
+
+def environment():
+    versions = {}
+    for package in ('numpy', 'pandas', 'scipy', 'sklearn', 'xgboost'):
+        try:
+            versions[package] = importlib.import_module(package).__version__
+        except ImportError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd = root, stdout = subprocess.PIPE,
+                                stderr = subprocess.DEVNULL, universal_newlines = True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'versions': versions, 'commit': commit, 'time': time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def result_key(result):
+    return (result['case'], result['dataset'], result['rows'], result['columns'])
+
+
+def compare(current, baseline, threshold, min_seconds):
+    '''
+    Prints the timings of current next to the ones of baseline (both json reports) and returns the regressions :
+    cases at least threshold times slower and min_seconds slower than in baseline.
+    '''
+    old_results = {result_key(result): result for result in baseline['results'] if result['status'] == 'ok'}
+    regressions = []
+    print("\n%-36s %-14s %10s %6s %10s %10s %7s" % ("case", "dataset", "rows", "cols", "old s", "new s", "ratio"))
+    for result in current['results']:
+        old = old_results.get(result_key(result))
+        if result['status'] != 'ok' or old is None:
+            continue
+        ratio = result['seconds'] / old['seconds'] if old['seconds'] > 0 else float('inf')
+        slower = ratio >= threshold and result['seconds'] - old['seconds'] >= min_seconds
+        if slower:
+            regressions.append(result)
+        print("%-36s %-14s %10d %6d %10.4f %10.4f %6.2fx%s" % (result['case'], result['dataset'], result['rows'], result['columns'],
+                                                              old['seconds'], result['seconds'], ratio, "  <-- slower" if slower else ""))
+    return regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type = int, nargs = "+", default = [10000, 100000, 1000000, 10000000])
+    parser.add_argument("--columns", type = int, nargs = "+", default = [10, 100, 1000])
+    parser.add_argument("--max-cells", type = float, default = 5e7, help = "synthetic datasets with more rows * columns are skipped")
+    parser.add_argument("--cases", nargs = "+", choices = preprocessing_cases + ['model_call'], help = "only run these cases")
+    parser.add_argument("--models", nargs = "+", choices = sorted(models_mapper), help = "only time these estimators")
+    parser.add_argument("--model-max-rows", type = int, default = 1000000, help = "models aren't timed on more rows than this")
+    parser.add_argument("--no-models", action = "store_true", help = "skip the model_call cases")
+    parser.add_argument("--no-bundled", action = "store_true", help = "skip the Examplar-datasets files")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--memory", action = "store_true", help = "also record the peak memory allocated by the last run of every case")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--output", help = "json file the results are written to")
+    parser.add_argument("--load", help = "don't run anything, take the results from this json file (for --compare)")
+    parser.add_argument("--compare", help = "json file of a previous run, exits with 1 when a case got slower")
+    parser.add_argument("--threshold", type = float, default = 1.25, help = "ratio to the previous run counted as a regression")
+    parser.add_argument("--min-seconds", type = float, default = 0.01, help = "smaller slowdowns are treated as noise")
+    args = parser.parse_args(argv)
+
+    if args.load:
+        with open(args.load) as report_file:
+            report = json.load(report_file)
+    else:
+        report = {'environment': environment(), 'arguments': vars(args), 'results': run_suite(args)}
+        if args.output:
+            with open(args.output, "w") as report_file:
+                json.dump(report, report_file, indent = 2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(report, baseline, args.threshold, args.min_seconds)
+        if regressions != []:
+            print("\n" + str(len(regressions)) + " case(s) got slower than in " + args.compare)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
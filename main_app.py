@@ -3,10 +3,14 @@ from main_app_functions import *
 import base64
 import os
 from st_demo_settings import *
+from modules.dataset_store import spill_dataset, is_dataset, dataset_null_counts
+from modules.instrumentation import begin_rerun, end_rerun, stage, set_page
+from modules.figure_cache import figure_cache_stats
 
 
 df = ""
 session_state = get_state()
+begin_rerun(get_session_id())  # no-op unless ML_AUTOMATOR_INSTRUMENT=1
 
 
 link2 = "<link href='https://fonts.googleapis.com/css2?family=Lato:ital,wght@1,700&display=swap' rel='stylesheet'>"
@@ -25,6 +29,7 @@ sidebar.text("")
 sidebar.text("")
 
 choice = sidebar.selectbox("Select Option", activities)
+set_page(choice)
 
 
 def image_maker(image_name):
@@ -59,8 +64,18 @@ sidebar.markdown(
 )
 
 
+# Keeping the preprocessed dataset in a per session Feather file instead of RAM, pages then read back only the columns they use
+spill_to_disk = sidebar.checkbox("Keep dataset on disk between pages", value=os.environ.get("ML_AUTOMATOR_SPILL", "0") == "1")
+
+
 if choice == "Home":  # For Navigating to Home Page
-    session_state.__setitem__("new_df" , Home() ) 
+    with stage("Home"):
+        new_df = Home()
+    if new_df is not None and spill_to_disk:
+        with stage("Spill dataset to disk"):
+            # The file is only rewritten when the dataset changed, not on every click of the Home page
+            new_df = spill_dataset(new_df, get_session_id(), previous = session_state.__getitem__("new_df"))
+    session_state.__setitem__("new_df" , new_df ) 
 
 elif choice == "EDA":  # For Navigating to EDA Page only when there's no null values in dataframe
 
@@ -70,20 +85,21 @@ elif choice == "EDA":  # For Navigating to EDA Page only when there's no null va
 
     df = session_state.__getitem__("new_df")
 
-    if type(df) != type(pd.DataFrame()):
+    if not is_dataset(df):
         error("Oops you didn't have uploaded a DataFrame yet!!!")
 
-    elif sum(df.isnull().sum()) != 0:
+    elif sum(dataset_null_counts(df)) != 0:
         subheader(
             "Oops something went wrong , looks like there are Null values in DataFrame")
         text("")
         text("")
-        null_df = df.isnull().sum().sort_values(ascending=False).to_frame(
+        null_df = dataset_null_counts(df).sort_values(ascending=False).to_frame(
         ).reset_index().rename(columns={'index': 'Feature', 0: 'Null val count'})
         dataframe(null_df, width=1000, height=1000)
 
     else:
-        EDA(df)
+        with stage("EDA"):
+            EDA(df)
 
 elif choice == 'Model Building':  # For Navigating to Model Building page only when there's no null values in df
 
@@ -93,23 +109,35 @@ elif choice == 'Model Building':  # For Navigating to Model Building page only w
 
     df = session_state.__getitem__("new_df")
 
-    if type(df) != type(pd.DataFrame()):
+    if not is_dataset(df):
         error("Oops you didn't have uploaded a DataFrame yet!!!")
 
-    elif sum(df.isnull().sum()) != 0:
+    elif sum(dataset_null_counts(df)) != 0:
         subheader(
             "Oops something went wrong , looks like there are Null values in DataFrame")
         text("")
         text("")
-        null_df = df.isnull().sum().sort_values(ascending=False).to_frame(
+        null_df = dataset_null_counts(df).sort_values(ascending=False).to_frame(
         ).reset_index().rename(columns={'index': 'Feature', 0: 'Null val count'})
         dataframe(null_df, width=1000, height=1000)
 
     else:
-        Model_Builder(df)
+        with stage("Model Building"):
+            Model_Builder(df)
 
 elif choice == 'About Us':  # For Navigating to About Us Page
     About_Us()
 
 
-session_state.sync()
+with stage("session_state.sync"):
+    session_state.sync()
+
+if os.environ.get("ML_AUTOMATOR_SHOW_SYNC_TIME", "0") == "1":
+    sync_stats = session_state.sync_stats()
+    sidebar.text("Session sync : {:.1f} ms (mean {:.1f} ms over {} reruns)".format(
+        sync_stats["last"] * 1000, sync_stats["mean"] * 1000, sync_stats["reruns"]))
+
+
+rerun_record = end_rerun(session_sync = session_state.sync_stats(), figure_cache = figure_cache_stats())
+if rerun_record is not None:
+    instrumentation_sidebar(rerun_record)
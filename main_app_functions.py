@@ -1,7 +1,24 @@
 from streamlit import *
+import os
+import time
+import base64
 from modules.Home_Page_Functions import *
 from modules.EDA_Page_Functions import *
 from modules.models import *
+from modules.training_cache import get_training_cache, dataset_fingerprint
+from modules.data_ingestion import read_csv_compact, upload_fingerprint
+from modules.dataset_store import load_dataset
+from modules.dataset_profile import stamp_version, bump_version
+from modules.encoding import fit_encoding_schema, encode_with_schema, matrix_bytes, dense_bytes, to_dense, is_sparse
+from modules.training_jobs import submit_training, get_job, job_signature
+from modules.model_store import save_model
+from modules.tuning import Tuner
+from modules.shared_data import get_data_plane
+from modules.splitting import split_methods, make_split
+from modules.instrumentation import stage, export_json, timeline_figure
+from st_demo_settings import get_state, get_session_id
+
+training_poll_seconds = 0.5
 
 markdown("<link rel='stylesheet' href='https://maxcdn.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css'>\
   <script src='https://ajax.googleapis.com/ajax/libs/jquery/3.5.1/jquery.min.js></script>\
@@ -25,12 +42,21 @@ def model_work_implementer(the_df , target_feature , label_encoder_obj = None):
 
 
 
-    # Getting dummy variables of Categorical features
-    the_df = pd.get_dummies(the_df, drop_first=True)
+    # One hot encoding the Categorical features into a sparse matrix when it saves memory (high cardinality features), a dense array otherwise
+    with stage("Model Building : encoding"):
+        schema = fit_encoding_schema(the_df, target_feature)
+        X = encode_with_schema(the_df, schema)
+    y = the_df[target_feature].values
     info("After converting Categorical Features into Numerical Ones, The current dataset is")
-    dataframe(the_df.head())
+    encoded_head = pd.DataFrame(to_dense(X[:5]), columns = schema['feature_names'])
+    encoded_head.insert(0, target_feature, y[:5])
+    dataframe(encoded_head)
     text("")
-    Markdown_Style("Shape of the Dataframe " + str(the_df.shape), 1)
+    Markdown_Style("Shape of the Dataframe " + str((X.shape[0], X.shape[1] + 1)), 1)
+    if is_sparse(X):
+        info(f"Stored as a sparse matrix taking {matrix_bytes(X) / 1024 ** 2:.1f} MB, a dense one would take {dense_bytes(X) / 1024 ** 2:.1f} MB")
+    else:
+        info(f"Stored as a dense matrix taking {matrix_bytes(X) / 1024 ** 2:.1f} MB, the one hot columns are too few or too dense for a sparse one to be smaller")
 
 
     # Splitting the dataset into training and testing data
@@ -46,25 +72,41 @@ def model_work_implementer(the_df , target_feature , label_encoder_obj = None):
         prcntage = slider('Select percentage', 60, 86)
         write("You selected : ", prcntage, "percent for training Dataset")
         prcntage = prcntage/100
-    train, test = train_test_splitter(the_df, prcntage)
+
+    # The split is a pair of row index arrays over X and y, the data itself is never copied into halves
+    split_options = list(split_methods)
+    if typ == "Regression":
+        split_options.remove("Stratified")
+    split_method = selectbox("How should the rows be split", split_options)
+    split_column = None
+    if split_method in ("Time ordered", "Grouped"):
+        columns = [col for col in the_df.columns if col != target_feature]
+        split_column = selectbox("Time column" if split_method == "Time ordered" else "Group column (a row's group is never in both sets)", columns)
+    with stage("Model Building : split"):
+        train_index, test_index = make_split(split_method, X.shape[0], prcntage, y = y,
+                                             column_values = None if split_column is None else the_df[split_column])
+
+    # Fitted results are cached by content, so reruns with the same data, split and models don't refit anything
+    data_key = dataset_fingerprint(the_df, target_feature, typ, prcntage) + "|split=" + repr((split_method, split_column))
+
+    # The encoded data goes to the session's data plane, parallel workers then map it instead of getting a copy each
+    with stage("Model Building : data plane"):
+        plane = get_data_plane(get_session_id(), owner = get_state())
+        X, y = plane.put("X", X, data_key), plane.put("y", y, data_key)
 
 
     # Updated shape of training and testing data
     text("")
-    Markdown_Style("Shape of the Training Dataset: " + str(train.shape), 1)
+    Markdown_Style("Shape of the Training Dataset: " + str((len(train_index), X.shape[1] + 1)), 1)
     text("")
-    Markdown_Style("Shape of the Test Dataset:-  " + str(test.shape), 1)
+    Markdown_Style("Shape of the Test Dataset:-  " + str((len(test_index), X.shape[1] + 1)), 1)
     text("")
     text("")
 
-    x_train, x_test, y_train, y_test = x_y_maker(
-        target_feature, train, test)
-    info("Now the Train and test dataset are splitted into x_train, x_test, y_train, y_test")
+    info("Now the rows of the dataset are splitted into training and testing rows (" + split_method.lower() + " split)")
 
     text("")
     text("")
-    x_list = [x_train, x_test]
-    y_list = [y_train, y_test]
     mlists = []
 
 
@@ -80,15 +122,67 @@ def model_work_implementer(the_df , target_feature , label_encoder_obj = None):
         mlists = ['LogisticRegression', 'RandomForestClassifier', 'SVC',
                 'MLPClassifier', 'DecisionTreeClassifier', 'XGBClassifier']
     models_lists = multiselect("Select Models", mlists)
-    model_object = Models(x_list, y_list, typ, models_lists)
-    model_object.model_call()
+
+    n_jobs = 1
+    if len(models_lists) > 1 and checkbox("Train the selected models in parallel"):
+        n_jobs = number_input("Number of workers", min_value = 2,
+                              max_value = max(2, os.cpu_count() or 2), value = min(len(models_lists), os.cpu_count() or 2))
+        n_jobs = int(n_jobs)
+
+    model_params = None
+    if models_lists != [] and checkbox("Tune the hyperparameters of the selected models"):
+        with stage("Model Building : tuning"):
+            model_params = hyperparameter_tuner(X, y, train_index, typ, models_lists, data_key)
+
+    model_object = Models([X], [y], typ, models_lists, n_jobs = n_jobs, cache = get_training_cache(),
+                          data_key = data_key, model_params = model_params, split = (train_index, test_index))
+    if models_lists != [] and checkbox("Train in the background (changing a widget won't restart the training)"):
+        with stage("Model Building : background training"):
+            background_training(model_object)
+    else:
+        with stage("Model Building : training"):
+            model_object.model_call()
     extra = ["Select"]
-    extra.extend(models_lists)
+    extra.extend(model_object.dict)  # only the models which have results
+
+
+    # Cross validation, a steadier comparison of the models than the single split above
+    if models_lists != []:
+        text("")
+        text("")
+        Markdown_Style("Cross Validation", 2)
+        text("")
+        if checkbox("Select to compare the models with k-fold cross validation"):
+            n_splits = slider("Number of folds", 3, 10, 5)
+            with spinner("Running " + str(n_splits) + " folds of every model on all the cores"):
+                with stage("Model Building : cross validation"):
+                    cv_results = model_object.cross_validate(X, y, n_splits = n_splits, n_jobs = -1)
+            if typ == "Classification":
+                info("Folds are stratified, every fold keeps the class proportions of the dataset")
+            dataframe(cv_results)
+
 
 
+    # Saving a fitted model, with everything needed to score new data, for modules/batch_score.py
+    if model_object.dict != {}:
+        text("")
+        text("")
+        Markdown_Style("Save a Trained Model", 2)
+        text("")
+        if checkbox("Select to save one of the trained models"):
+            model_to_save = selectbox("Model to save", list(model_object.fitted_models))
+            saved_name = text_input("Name to save it under", value = str(target_feature) + "_" + model_to_save)
+            if button("Save model"):
+                try:
+                    version = save_model(saved_name, model_object.fitted_models[model_to_save], model_to_save, typ, schema,
+                                         model_object.metrics[model_to_save], label_encoder_obj, fills = the_df.attrs.get('fills'))
+                    success("Saved as " + saved_name + " " + version + ". Score new data with : python -m modules.batch_score " + saved_name + " input.csv output.csv")
+                except ValueError as err:
+                    error(str(err))
+
 
     # Predictions Downloader
-    if models_lists != []:  # Y-pred dowloader will show only when there's a model in modelslists[model selected by user are contained in it]
+    if model_object.dict != {}:  # Y-pred dowloader will show only when there's a model in modelslists[model selected by user are contained in it]
         text("")
         text("")
         Markdown_Style("Y_Pred Dataset Downloader", 2)
@@ -104,15 +198,85 @@ def model_work_implementer(the_df , target_feature , label_encoder_obj = None):
 
 
                 y_pred = pd.DataFrame(y_pred).rename(columns = {0 : target_feature})
+                if split_method != "First rows for training":
+                    # Test rows aren't the last rows of the dataset, their positions tell which prediction belongs to which row
+                    y_pred.insert(0, "Row", model_object.test_rows())
                 subheader("Head of y-predictions is shown below :")
                 dataframe( y_pred.head(20) )
                 text("")
 
                 
-                csv = y_pred.to_csv(index=False)
-                b64 = base64.b64encode(csv.encode()).decode()
-                href = f'<a href="data:file/csv;base64,{b64}">Download CSV File</a> (right-click and save as &lt;some_name&gt;.csv)'
-                markdown(href, unsafe_allow_html=True)
+                # The model's parameters are part of the version, so predictions of a tuned model never get the export of an untuned one
+                data_downloader(y_pred, "y_pred_" + selectd_models, version = (data_key, selectd_models, repr(model_object.model_params.get(selectd_models, {}))), key = "y_pred")
+
+
+def background_training(model_object):
+    '''
+    Trains the models of model_object as a background job whose id is kept in the session state, and shows
+    its progress until it finishes. A rerun of the page while the job runs just attaches to it again,
+    results are shown once every model is done, failed or cancelled.
+    '''
+    session_state = get_state()
+    job = get_job(session_state.training_job_id)
+
+    if job is None or job.signature != job_signature(model_object):
+        if not button("Start training"):
+            return
+        job = submit_training(model_object)
+        session_state.training_job_id = job.job_id
+
+    if not job.is_finished() and button("Cancel training"):
+        job.cancel()
+
+    status_area = empty()
+    progress_bar = progress(0)
+    elapsed_area = empty()
+    # The script thread only watches the job, a widget change interrupts this loop but not the fits
+    while True:
+        status_area.table(job.status_frame())
+        progress_bar.progress(int(job.progress() * 100))
+        elapsed_area.text("Elapsed : " + str(round(job.elapsed(), 1)) + " s")
+        if job.is_finished():
+            break
+        time.sleep(training_poll_seconds)
+
+    model_object.show_results(job.results)
+
+
+def hyperparameter_tuner(X, y, train_index, typ, models_lists, data_key):
+    '''
+    Searches hyperparameters of models_lists on the training rows (train_index) of X and y within a time budget and shows the leaderboard.
+    Returns the best parameters per model when the user chooses to train with them, None otherwise.
+    The search only runs when its button is pressed, its leaderboard and best parameters are kept in the session state
+    (for the same data, models, method and draws) so the reruns caused by other widgets only show them again.
+    Trials are cached, so searching again only runs the trials which weren't done yet.
+    '''
+    method = selectbox("Search method", ["Successive halving", "Random search"])
+    budget = slider("Time budget (seconds)", 10, 600, 60)
+    n_trials = int(number_input("Parameter draws per model", min_value = 1, max_value = 200, value = 10))
+
+    session_state = get_state()
+    tuning_key = repr((data_key, list(models_lists), method, n_trials))
+    tuning = session_state.tuning_results
+    if tuning is not None and tuning['key'] != tuning_key:
+        tuning = None
+
+    if button("Start tuning" if tuning is None else "Search again"):
+        tuner = Tuner(X, y, typ, models_lists, method = 'halving' if method == "Successive halving" else 'random',
+                      n_trials = n_trials, budget_seconds = budget, cache = get_training_cache(), data_key = data_key, rows = train_index)
+        with spinner("Tuning for at most " + str(budget) + " seconds"):
+            leaderboard = tuner.search()
+        tuning = {'key': tuning_key, 'leaderboard': leaderboard, 'best_params': tuner.best_params()}
+        session_state.tuning_results = tuning
+    if tuning is None:
+        return None
+
+    subheader("Leaderboard")
+    dataframe(tuning['leaderboard'])
+    best_params = tuning['best_params']
+    if best_params != {} and checkbox("Train the models with the best parameters found"):
+        return best_params
+    return None
 
 
 #############################################################################################################################################################################################
@@ -129,7 +293,21 @@ def Home():
     if data is not None:  # Here if block runs only when user gives dataset
 
         # Loading the dataset using pandas
-        df = pd.read_csv(data)
+        compact_dtypes = checkbox("Load with compact dtypes (recommended for large files)", value=True)
+        with stage("Home : read csv"):
+            if compact_dtypes:
+                # The file is read in chunks with dtypes inferred from a sample, so large uploads need far less memory
+                progress_bar = progress(0)
+                df, load_stats = read_csv_compact(
+                    data, progress_callback=lambda fraction, rows_read: progress_bar.progress(int(fraction * 100)))
+                info("Loaded {:,} rows in {:.1f} s ({:,.0f} rows/sec), memory footprint {:.1f} MB (about {:.1f} MB with default dtypes)".format(
+                    load_stats['rows'], load_stats['seconds'], load_stats['rows_per_second'],
+                    load_stats['memory_bytes'] / 1024 ** 2, load_stats['default_memory_bytes'] / 1024 ** 2))
+            else:
+                df = pd.read_csv(data)
+
+        # Same upload + same loading mode --> same dataset version, so the profile below is computed once and reused on every rerun
+        stamp_version(df, upload_fingerprint(data) + ("-compact" if compact_dtypes else ""))
 
         # Head (Top 5 rows) of the dataset
         markdown_type_2 = "Head of the Dataset :"
@@ -143,24 +321,28 @@ def Home():
         # Features Overview provider --> This function provides a table showing datatype of all features + a pie chart showing %age of numerical and categorical features
         markdown_type_2 = "Categories of Features : "
         Cool_Data_Printer(markdown_type_2=markdown_type_2)
-        plot = features_overview_provider(df)
+        with stage("Home : features overview"):
+            plot = features_overview_provider(df)
         plotly_chart(plot)
 
         # Visualising the missing values
         markdown_type_1 = "Heatmap for null values"
-        plot = heatmap_generator(df)
+        with stage("Home : null value heatmap"):
+            plot = heatmap_generator(df)
         
         if plot is not None:
             # Missing values counter
             markdown_type_2 = "The Missing Values and Strategey :"
-            Cool_Data_Printer(markdown_type_2=markdown_type_2,
-                            write_this=null_value(df))
+            with stage("Home : null value table"):
+                Cool_Data_Printer(markdown_type_2=markdown_type_2,
+                                write_this=null_value(df))
 
             Cool_Plot_Printer(plot, markdown_type_1=markdown_type_1,
                             plot_print_type='plotly_chart')
 
         # Finding imbalanced features
-        imbalanced_features_manager(df)
+        with stage("Home : imbalanced features"):
+            imbalanced_features_manager(df)
 
         # Preparing a lis of categorical feature named categorical and  new_cat[will be used in dropdowns]
         categorical = cat_num(df)
@@ -174,12 +356,13 @@ def Home():
         select_box_text_type_1 = ""
         markdown_type_2 = "Categorical feature value counter"
 
-        Cool_Data_Plotter(df,
-                          checkbox_text,
-                          drop_down_list,
-                          plot_type='pie_chart',
-                          markdown_type_2=markdown_type_2,
-                          select_box_text_type_1=select_box_text_type_1)
+        with stage("Home : value counts"):
+            Cool_Data_Plotter(df,
+                              checkbox_text,
+                              drop_down_list,
+                              plot_type='pie_chart',
+                              markdown_type_2=markdown_type_2,
+                              select_box_text_type_1=select_box_text_type_1)
         # ________________________________________________________________________
 
         # Two categorical features comparator
@@ -189,24 +372,29 @@ def Home():
         select_box_text_lis = ["", ""]
         markdown_type_2 = "2 Categorical Feature Comparator"
 
-        Cool_Data_Plotter(df,
-                          checkbox_text,
-                          drop_down_list,
-                          plot_type='comparison_plot',
-                          markdown_type_2=markdown_type_2,
-                          select_box_text_type_2=select_box_text_lis)
+        with stage("Home : categorical comparison"):
+            Cool_Data_Plotter(df,
+                              checkbox_text,
+                              drop_down_list,
+                              plot_type='comparison_plot',
+                              markdown_type_2=markdown_type_2,
+                              select_box_text_type_2=select_box_text_lis)
 
         # Feature Dropper
-        feature_tracker = feature_dropper(df)
+        with stage("Home : drop features"):
+            feature_tracker = feature_dropper(df)
 
         # Missing values filling system
-        missing_values_filling_system(df, feature_tracker)
+        with stage("Home : fill missing values"):
+            missing_values_filling_system(df, feature_tracker)
 
         # Useless features management system
-        useless_features_manager(df)
+        with stage("Home : useless features"):
+            useless_features_manager(df)
 
         # final summary provider
-        final_summary_provider(df)
+        with stage("Home : final summary"):
+            final_summary_provider(df)
 
         # Return the updated dataframe
         return df
@@ -222,22 +410,26 @@ def EDA(df):
 
     # Heatmap
     Markdown_Style('Correlation Heatmaps', 2)
-    EDA_heatmap(df)
+    with stage("EDA : correlation heatmap"):
+        EDA_heatmap(df)
     text("")
 
     # Boxplot
     Markdown_Style('box type plot', 2)
-    EDA_boxplot(df)
+    with stage("EDA : box plot"):
+        EDA_boxplot(df)
     text("")
 
     # Histogram
     Markdown_Style('histogram plot', 2)
-    EDA_histogram(df)
+    with stage("EDA : histogram"):
+        EDA_histogram(df)
     text("")
 
     # Sunburst
     Markdown_Style('Sun Burst Plot', 2)
-    EDA_sunburst(df)
+    with stage("EDA : sunburst"):
+        EDA_sunburst(df)
 
 
 #############################################################################################################################################################################################
@@ -261,13 +453,19 @@ def Model_Builder(df):
 
     if target_feature != "Feature":
 
-        if df.dtypes[target_feature] == 'object':    # If the target feature is categorical and is of object type we have to apply label encoding first
+        with stage("Model Building : load dataset"):
+            df = load_dataset(df)  # Model building needs every column, a spilled dataset is read back in full here
+
+        if is_categorical(df.dtypes[target_feature]):    # If the target feature is categorical and is of object type we have to apply label encoding first
            
             the_df = pd.DataFrame()
             the_df = pd.concat([the_df, df], axis=1)
             
+            from sklearn.preprocessing import LabelEncoder  # Imported here so sklearn only loads on the Model Building page
             label_encoder_obj = LabelEncoder()
             the_df[target_feature] = label_encoder_obj.fit_transform(the_df[target_feature])
+            the_df.attrs['fills'] = df.attrs.get('fills', {})  # saved with the models, to fill new rows like these ones
+            bump_version(the_df, 'label_encode', target_feature)
 
             model_work_implementer(the_df , target_feature , label_encoder_obj = label_encoder_obj )
         else:
@@ -558,3 +756,28 @@ def About_Us():
     <a href='https://github.com/Aaditya1978' class='btn btn-success'  target='_blank' style='color:black; font-weight:500'>Github Profile</a>\
     </div>\
     </div>", unsafe_allow_html=True)
+
+
+#############################################################################################################################################################################################
+
+
+def instrumentation_sidebar(record):
+    '''
+    Developer panel of the sidebar (only shown with ML_AUTOMATOR_INSTRUMENT=1) : the timeline of the rerun which just
+    finished, the figure cache counters and a json export of the recent reruns of the session.
+    '''
+    if not sidebar.checkbox("Developer : show the rerun timeline"):
+        return
+    sidebar.plotly_chart(timeline_figure(record), use_container_width = True)
+
+    figure_stats = record.get('figure_cache') or {}
+    if figure_stats != {}:
+        sidebar.text("Figure cache : {} hits, {} misses, {} figures ({:.1f} MB)".format(
+            figure_stats['hits'], figure_stats['misses'], figure_stats['entries'], figure_stats['megabytes']))
+
+    stages = pd.DataFrame(record['stages'], columns = ['name', 'seconds', 'rss_delta_mb', 'traced_delta_mb'])
+    sidebar.dataframe(stages.sort_values('seconds', ascending = False))
+
+    b64 = base64.b64encode(export_json(get_session_id()).encode()).decode()
+    sidebar.markdown(f'<a href="data:application/json;base64,{b64}" download="rerun_timeline.json">Download the recent reruns as json</a>',
+                     unsafe_allow_html = True)
@@ -16,6 +16,11 @@ def EDA_heatmap(df):
             fig = correlation_heatmap(df, selected_features)
             plotly_chart(fig)
 
+    if len(numerical_feat) > 2 and checkbox("Select to find the most correlated pairs of features"):
+        # With hundreds of features a heatmap can't be read, the strongest pairs are listed instead
+        k = slider("Number of pairs", 5, 100, 20)
+        dataframe(top_correlated_pairs(df, k))
+
 
 #############################################################################################################################################################################################
 
@@ -1,17 +1,20 @@
 # Importing the necessary libraries
 import pandas as pd
 import numpy as np
-import seaborn as sns
 
-import plotly.offline as py
-py.init_notebook_mode(connected=True)
-import plotly.graph_objs as go
-import plotly.tools as tls
-import plotly.express as px
-import plotly.figure_factory as ff
+from modules.lazy_loader import lazy_import
+from modules.data_preprocessing import is_categorical
+from modules.eda_aggregation import histogram_counts, box_stats, sunburst_sums
+from modules.correlation import correlation_slice, top_correlated_pairs
+from modules.dataset_store import load_dataset
+from modules.figure_cache import cached_figure
 
-import cufflinks as cf
-cf.go_offline()
+# Plotting libraries are heavy to import, so they are only loaded once a figure is actually built
+go = lazy_import("plotly.graph_objects")
+px = lazy_import("plotly.express")
+ff = lazy_import("plotly.figure_factory")
+
+correlation_annotation_max_features = 20   # wider correlation heatmaps are drawn without the value written in every cell
 
 
 #[0]
@@ -22,7 +25,7 @@ def num_num(df):
     numerical_features = []
 
     for val in dic:
-        if dic[val] == 'object':
+        if is_categorical(dic[val]):
             categorical_features.append(val)
         else:
             numerical_features.append(val)
@@ -30,16 +33,22 @@ def num_num(df):
 
 # [1] Correlation heatmap plotting function
 # --> This particular function accepts a list with selected categorical features and returns a correlation heatmap
+@cached_figure
 def correlation_heatmap(df , selected_features):
     # for example selected_features = ['Age' , 'Fare' , 'Survived'] , This will produce a correlation heatmap of 3x3
-    correlation_matrix = np.array( df[ selected_features ].corr() )
+    # The matrix is sliced from the one of every numeric feature, computed once per dataset version (modules/correlation.py)
+    correlation_matrix = correlation_slice(df, selected_features)
+    selected_features, correlation_matrix = list(correlation_matrix.index), correlation_matrix.to_numpy()
+
+    if len(selected_features) > correlation_annotation_max_features:
+        # Too many cells to read annotations anyway, the values are shown on hover
+        return go.Figure(go.Heatmap(z = correlation_matrix, x = selected_features, y = selected_features, colorscale = 'Rainbow', zmin = -1, zmax = 1))
 
     fig = ff.create_annotated_heatmap( z = correlation_matrix , annotation_text =np.around(correlation_matrix , decimals=2) , colorscale='Rainbow',
                                   hoverinfo='z' , x = selected_features , y = selected_features )
 
     # Make text size smaller
-    for i in range(len(fig.layout.annotations)):
-        fig.layout.annotations[i].font.size = 15
+    fig.update_annotations(font_size = 15)
 
 
     return fig
@@ -47,42 +56,68 @@ def correlation_heatmap(df , selected_features):
 
 # [2] Box plot function
 # --> This particular function accepts either a list of two or three feature but one of the feature must be continuous , in order to get useful visualisation
+@cached_figure
 def box_plot(df , selected_features):
 
     # for example selected_features = ['Sex' , 'Age' , 'Embarked'] , It will return a box plot where x-axis => Sex , y-axis => Age  , x-axis feature is further categorised on the bases of different features present in 3rd parameter['Embarked' here]
     # Its always better if you pass 1st and 3rd feature of categorical dtype and 2nd of continuous numerical dtype
     # Its good for observing three different features in a single plot 
+    # The quartiles, whiskers and a sample of the outliers are computed here (modules/eda_aggregation.py), only they are sent to the browser
 
+    x_feature, y_feature = selected_features[0], selected_features[1]
     if len(selected_features) == 3: # In case when three features are passed
-        z = df[selected_features[2]]
+        z = selected_features[2]
     else:
         z = None
 
-    fig = px.box(df, selected_features[0] , selected_features[1] , z )
-    fig.update_traces(quartilemethod="exclusive") # or "inclusive", or "linear" by default
+    # Only the selected columns are loaded, and only when the figure isn't cached already
+    stats = box_stats(load_dataset(df, selected_features), y_feature, [x_feature] if z is None else [x_feature, z])
+    groups = [(None, stats)] if z is None else list(stats.groupby(z, sort = True))
+
+    fig = go.Figure()
+    for name, box in groups:
+        fig.add_trace(go.Box(
+            name = None if name is None else str(name), x = box[x_feature].tolist(), y = box['outliers'].tolist(),
+            q1 = box['q1'].tolist(), median = box['median'].tolist(), q3 = box['q3'].tolist(), mean = box['mean'].tolist(),
+            lowerfence = box['lowerfence'].tolist(), upperfence = box['upperfence'].tolist(),
+            boxpoints = 'outliers', showlegend = name is not None,
+        ))
+    fig.update_layout(boxmode = 'group', xaxis_title = x_feature, yaxis_title = y_feature, legend_title_text = z)
     return fig
 
 
 # [3] Histogram function
 # --> This particular function accepts a lis either of size 1 or 2 in format [continuous numerical feature , categorical feature] and returns histogram plot
+@cached_figure
 def histo_gram(df , selected_features ):
     # for example selected_features = ['Age' , 'Embarked']
+    # Bin counts are computed here (modules/eda_aggregation.py) and drawn as bars, the rows themselves never reach the browser
     if len(selected_features) == 2:
         color = selected_features[1]
     else:
         color = None
 
-    fig = px.histogram(df, x = selected_features[0] , color = color )
+    counts = histogram_counts(load_dataset(df, selected_features), selected_features[0], color)
+    if counts['kind'] == 'bins':
+        edges = counts['x']
+        x, width = ((edges[:-1] + edges[1:]) / 2).tolist(), np.diff(edges).tolist()
+    else:
+        x, width = [str(category) for category in counts['x']], None
+
+    fig = go.Figure()
+    for name, row in zip(counts['colors'], counts['counts']):
+        fig.add_trace(go.Bar(name = None if name is None else str(name), x = x, y = row.tolist(), width = width,
+                             showlegend = name is not None))
+    fig.update_layout(barmode = 'relative', bargap = 0 if counts['kind'] == 'bins' else None,
+                      xaxis_title = selected_features[0], yaxis_title = "count", legend_title_text = color)
     return fig
 
 # [4] Sunburst function
 # --> This particuar function accepts a lis of any number of features and return a sun burst plot 
 # This is one of the best plotly plot to effectively visualise many features in a single plot
+@cached_figure
 def sun_burst(df , lis_of_features , vals):
     # for example selected_features = ['Sex' , 'Embarked'] , vals = 'Survived
-    fig = px.sunburst(df , path = lis_of_features , values = vals)
+    # One row per leaf is handed to plotly instead of one per row of df
+    fig = px.sunburst(sunburst_sums(load_dataset(df, lis_of_features + [vals]), lis_of_features, vals) , path = lis_of_features , values = vals)
     return fig
-
-
-
-
@@ -2,7 +2,8 @@ from streamlit import *
 import pandas as pd
 import numpy as np
 from modules.data_preprocessing import *
-import base64
+from modules.imputation import numerical_strategies, categorical_strategies
+from modules.downloads import download_link, download_formats
 
 #############################################################################################################################################################################################
 
@@ -131,9 +132,10 @@ def Cool_Data_Plotter(df, checkbox_text, drop_down_list, plot_type, sub_header=N
                 select_box_text_type_1, drop_down_list, key=183737487)
 
             if categorical_feature != drop_down_list[0]:
-                unique_len = len(df[categorical_feature].value_counts())
+                profile = get_profile(df)
+                unique_len = profile.cardinality(df, categorical_feature)
                 if unique_len > 15:
-                    dataframe(df[categorical_feature].value_counts())
+                    dataframe(profile.value_counts(df, categorical_feature))
                     Markdown_Style("Total unique values : " +
                                    str(unique_len), 1)
                 elif plot_type == 'pie_chart':
@@ -206,21 +208,35 @@ def missing_values_filling_system(df, feature_tracker):
     Markdown_Style("Select Features to be filled", 2)
     lis_fill = []
     feature_ch = []
+    options = {}
     count = 0
     for feature in feature_tracker:
         if checkbox(feature):
-            if df.dtypes[feature] == 'object':
-                stratigies_lis = ["strategy",  "mode"]
+            if is_categorical(df.dtypes[feature]):
+                stratigies_lis = ["strategy"] + categorical_strategies
             else:
-                stratigies_lis = ["strategy", "mean", "median"]
+                stratigies_lis = ["strategy"] + numerical_strategies
 
             strategy = selectbox("Choose strategy", stratigies_lis, key=count)
+
+            # Options of the strategies which need one
+            if strategy == "constant":
+                if is_categorical(df.dtypes[feature]):
+                    options[feature] = {'value': text_input("Fill with", value = "Missing", key = "constant_" + str(feature))}
+                else:
+                    options[feature] = {'value': number_input("Fill with", value = 0.0, key = "constant_" + str(feature))}
+            elif strategy.startswith("group"):
+                group_features = [col for col in df.columns if col != feature]
+                options[feature] = {'by': selectbox("Group by", group_features, key = "group_" + str(feature))}
+            elif strategy == "knn":
+                options[feature] = {'n_neighbors': slider("Number of neighbours", 1, 50, 5, key = "knn_" + str(feature))}
+
             if strategy != "strategy":
                 lis_fill.append(strategy)
                 feature_ch.append(feature)
                 success("Feature filled Successfully")
             count += 1
-    no_null = fill_feature(df, feature_ch, lis_fill)
+    no_null = fill_feature(df, feature_ch, lis_fill, options)
     text("")
     write(no_null)
 
@@ -302,7 +318,7 @@ def final_summary_provider(df):
     text("")
     dataframe(df.head())
 
-    if sum(df.isnull().sum()) == 0:
+    if get_profile(df).total_nulls() == 0:
         text("")
         success(
             "Congrats Data Preprocessing phase is Done 🎉🎉. Now You can move on to next part, i.e , Doing EDA")
@@ -311,8 +327,24 @@ def final_summary_provider(df):
     # success("Congrats Feature Engineering is Done 🎉🎉. Now You can move to next part, i.e , Doing EDA")
 
     text("")
-    info("To download this updated dataset click the link below")
-    csv = df.to_csv(index=False)
-    b64 = base64.b64encode(csv.encode()).decode()
-    href = f'<a href="data:file/csv;base64,{b64}">Download CSV File</a> (right-click and save as &lt;some_name&gt;.csv)'
-    markdown(href, unsafe_allow_html=True)
+    info("To download this updated dataset choose a format and prepare the file")
+    data_downloader(df, "preprocessed_dataset", key = "final_summary")
+
+
+def data_downloader(df, file_name, version = None, key = None):
+    '''
+    Shows a format choice and, once asked for, a link downloading df. The file is written on the server
+    and streamed to the browser, it is written again only when the dataset or the format changes.
+    version:- identifies the content of df when it doesn't carry a dataset version (see modules/downloads.py).
+    
+    Example
+    =========
+    >>> data_downloader(df, "preprocessed_dataset")
+    '''
+    file_format = selectbox("File format", list(download_formats), key = str(key) + "_format")
+    if checkbox("Prepare the file to download", key = str(key) + "_prepare"):
+        href = download_link(df, file_name, file_format, version)
+        if href is None:
+            error("The file is too big to be embedded in the page and the download route isn't available")
+        else:
+            markdown(href, unsafe_allow_html=True)
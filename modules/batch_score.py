@@ -0,0 +1,157 @@
+''' Batch scoring with a model saved by modules/model_store.py.
+
+    The input is read in chunks (row groups for Parquet), every chunk is scored in a pool of
+    worker processes and written out in order as soon as it is ready. At most --window chunks
+    are in flight at a time, which bounds the memory whatever the size of the input.
+
+    Usage
+    -----
+    python -m modules.batch_score titanic test.csv predictions.csv
+    python -m modules.batch_score titanic test.parquet predictions.parquet --version v2 --workers 8
+    python -m modules.batch_score titanic test.csv predictions.csv --keep PassengerId --chunksize 50000
+'''
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from modules.lazy_loader import lazy_import
+from modules.model_store import load_model
+
+parquet = lazy_import("pyarrow.parquet")
+pyarrow = lazy_import("pyarrow")
+
+
+worker_artifact = None
+
+
+def load_worker_artifact(name, version):
+    # Runs once in every worker process, the model is loaded there instead of being sent with every chunk
+    global worker_artifact
+    worker_artifact = load_model(name, version)
+
+
+def score_chunk(chunk, keep, prediction_column):
+    output = chunk[keep].reset_index(drop = True)
+    output[prediction_column] = worker_artifact.predict(chunk)
+    return output
+
+
+def is_parquet(path):
+    return path.lower().endswith((".parquet", ".pq"))
+
+
+def read_input(path, columns, chunksize):
+    # Yields DataFrames of at most chunksize rows for csv, one per row group for Parquet
+    if is_parquet(path):
+        parquet_file = parquet.ParquetFile(path)
+        for index in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(index, columns = columns).to_pandas()
+    else:
+        for chunk in pd.read_csv(path, usecols = columns, chunksize = chunksize):
+            yield chunk
+
+
+class OutputWriter:
+    def __init__(self, path):
+        # Appends scored chunks to a csv file, or to a Parquet file one row group per chunk
+        self.path = path
+        self.parquet_writer = None
+        self.rows = 0
+
+    def write(self, df):
+        if is_parquet(self.path):
+            table = pyarrow.Table.from_pandas(df, preserve_index = False)
+            if self.parquet_writer is None:
+                self.parquet_writer = parquet.ParquetWriter(self.path, table.schema)
+            self.parquet_writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode = "w" if self.rows == 0 else "a", header = self.rows == 0, index = False)
+        self.rows += len(df)
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+def batch_score(name, input_path, output_path, version = None, chunksize = 100000, workers = None, window = None, keep = None,
+                progress_callback = None):
+    '''
+    Scores the csv or Parquet file at input_path with the saved model name and writes the predictions to output_path.
+    workers:- number of scoring processes, all the cores when None, 1 scores in this process.
+    window:- maximum number of chunks being scored or waiting to be written, twice the workers by default.
+    keep:- input columns copied to the output next to the predictions (an id column for example).
+    Returns the number of rows scored.
+
+    Example
+    =========
+    >>> batch_score("titanic", "test.csv", "predictions.csv", keep = ["PassengerId"])
+    '''
+    artifact = load_model(name, version)
+    version = os.path.basename(artifact.path)
+    keep = list(keep or [])
+    columns = list(dict.fromkeys(keep + artifact.input_columns()))
+    prediction_column = artifact.meta['schema']['target']
+    if prediction_column in keep:
+        prediction_column = "predicted_" + prediction_column
+
+    workers = workers or os.cpu_count() or 1
+    window = window or 2 * workers
+    writer = OutputWriter(output_path)
+    try:
+        if workers == 1:
+            load_worker_artifact(name, version)
+            for chunk in read_input(input_path, columns, chunksize):
+                writer.write(score_chunk(chunk, keep, prediction_column))
+                if progress_callback is not None:
+                    progress_callback(writer.rows)
+            return writer.rows
+
+        with ProcessPoolExecutor(max_workers = workers, initializer = load_worker_artifact, initargs = (name, version)) as executor:
+            pending = deque()
+            for chunk in read_input(input_path, columns, chunksize):
+                pending.append(executor.submit(score_chunk, chunk, keep, prediction_column))
+                del chunk
+                # Chunks are written in input order, reading waits while the window is full
+                while len(pending) >= window or (pending and pending[0].done()):
+                    writer.write(pending.popleft().result())
+                    if progress_callback is not None:
+                        progress_callback(writer.rows)
+            while pending:
+                writer.write(pending.popleft().result())
+                if progress_callback is not None:
+                    progress_callback(writer.rows)
+        return writer.rows
+    finally:
+        writer.close()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Score a csv or Parquet file with a saved model")
+    parser.add_argument("name", help = "name of the saved model")
+    parser.add_argument("input", help = "csv or Parquet file to score")
+    parser.add_argument("output", help = "where the predictions are written, Parquet when it ends with .parquet")
+    parser.add_argument("--version", help = "version of the model, the latest one by default")
+    parser.add_argument("--chunksize", type = int, default = 100000, help = "rows scored at a time (csv input)")
+    parser.add_argument("--workers", type = int, default = None, help = "scoring processes, all the cores by default")
+    parser.add_argument("--window", type = int, default = None, help = "chunks in flight at most, twice the workers by default")
+    parser.add_argument("--keep", action = "append", default = [], help = "input column copied to the output, can be repeated")
+    args = parser.parse_args(argv)
+
+    def progress(rows):
+        sys.stderr.write("\rscored " + str(rows) + " rows   ")
+        sys.stderr.flush()
+
+    start = time.time()
+    rows = batch_score(args.name, args.input, args.output, args.version, args.chunksize, args.workers, args.window, args.keep, progress)
+    seconds = time.time() - start
+    sys.stderr.write("\n")
+    print("Scored " + str(rows) + " rows in " + str(round(seconds, 2)) + " s (" + str(int(rows / seconds) if seconds > 0 else rows) + " rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from modules.dataset_profile import is_categorical, dataset_version
+from modules.dataset_store import load_dataset
+
+
+correlation_cache_size = 8        # number of dataset versions whose correlation matrix is kept, shared by every session
+correlation_block_columns = 256   # columns loaded and multiplied at a time, bounds the memory used on very wide datasets
+
+
+def numeric_features(dataset):
+    # Features df.corr() would use : numbers and booleans
+    return [col for col in dataset.columns
+            if not is_categorical(dataset.dtypes[col]) and pd.api.types.is_numeric_dtype(dataset.dtypes[col])]
+
+
+def centered_block(dataset, columns):
+    # The columns as a float matrix centered on their means, nulls set to 0, and the mask of the values which aren't null
+    values = load_dataset(dataset, columns).to_numpy(dtype = np.float64)
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis = 0)
+    means = np.where(counts > 0, np.where(valid, values, 0).sum(axis = 0) / np.maximum(counts, 1), 0)
+    return np.where(valid, values - means, 0), valid
+
+
+def block_correlation(x, x_valid, y, y_valid):
+    '''
+    Pearson correlation of every column of x with every column of y, each pair computed on the rows where both are
+    not null (what df.corr() does) through a few matrix products instead of one pass per pair.
+    '''
+    if x_valid.all() and y_valid.all():
+        covariance = x.T @ y
+        x_norms, y_norms = np.sqrt((x * x).sum(axis = 0)), np.sqrt((y * y).sum(axis = 0))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return covariance / np.outer(x_norms, y_norms)
+
+    x_valid, y_valid = x_valid.astype(np.float64), y_valid.astype(np.float64)
+    pairs = x_valid.T @ y_valid              # rows where both columns have a value
+    x_sums, y_sums = x.T @ y_valid, x_valid.T @ y
+    x_squares, y_squares = (x * x).T @ y_valid, x_valid.T @ (y * y)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        covariance = x.T @ y - x_sums * y_sums / pairs
+        x_variance = x_squares - x_sums ** 2 / pairs
+        y_variance = y_squares - y_sums ** 2 / pairs
+        return covariance / np.sqrt(x_variance * y_variance)
+
+
+def compute_correlation(dataset, columns = None, block_columns = None):
+    '''
+    Correlation matrix of columns (every numeric feature by default) of dataset, a DataFrame or a SpilledDataset.
+    Columns are processed block_columns at a time, so only two blocks of columns are loaded as floats at once.
+    '''
+    if columns is None:
+        columns = numeric_features(dataset)
+    block_columns = block_columns or correlation_block_columns
+    blocks = [columns[start : start + block_columns] for start in range(0, len(columns), block_columns)]
+
+    matrix = np.empty((len(columns), len(columns)))
+    for i, block_i in enumerate(blocks):
+        x, x_valid = centered_block(dataset, block_i)
+        rows = slice(i * block_columns, i * block_columns + len(block_i))
+        for j in range(i, len(blocks)):
+            block_j = blocks[j]
+            y, y_valid = (x, x_valid) if j == i else centered_block(dataset, block_j)
+            cols = slice(j * block_columns, j * block_columns + len(block_j))
+            matrix[rows, cols] = block_correlation(x, x_valid, y, y_valid)
+            matrix[cols, rows] = matrix[rows, cols].T
+
+    matrix = np.clip(matrix, -1, 1)
+    return pd.DataFrame(matrix, index = columns, columns = columns)
+
+
+correlation_cache = OrderedDict()
+correlation_cache_lock = threading.Lock()
+
+
+def get_correlation(dataset):
+    '''
+    Returns the correlation matrix of every numeric feature of dataset, computed once per dataset version.
+
+    Example
+    =========
+    >>> get_correlation(df).loc[['Age', 'Fare'], ['Age', 'Fare']]
+    '''
+    version = dataset_version(dataset)
+    with correlation_cache_lock:
+        if version in correlation_cache:
+            correlation_cache.move_to_end(version)
+            return correlation_cache[version]
+
+    matrix = compute_correlation(dataset)
+    with correlation_cache_lock:
+        correlation_cache[version] = matrix
+        while len(correlation_cache) > correlation_cache_size:
+            correlation_cache.popitem(last = False)
+    return matrix
+
+
+def correlation_slice(dataset, selected_features):
+    # Correlations of the selected features, taken from the cached matrix, features which aren't numeric are left out like df.corr() does
+    matrix = get_correlation(dataset)
+    selected_features = [feature for feature in selected_features if feature in matrix.index]
+    return matrix.loc[selected_features, selected_features]
+
+
+def top_correlated_pairs(dataset, k = 20, absolute = True):
+    '''
+    Returns the k pairs of numeric features with the highest correlation (highest absolute correlation when absolute)
+    as a DataFrame with the columns Feature 1, Feature 2 and Correlation.
+
+    Example
+    =========
+    >>> top_correlated_pairs(df, k = 3)
+    >>>   Feature 1  Feature 2  Correlation
+    >>> 0    Pclass       Fare    -0.549500
+    '''
+    matrix = get_correlation(dataset)
+    first, second = np.triu_indices(len(matrix), 1)
+    values = matrix.to_numpy()[first, second]
+    scores = np.abs(values) if absolute else values.copy()
+    scores[np.isnan(scores)] = -np.inf
+
+    k = min(k, len(scores))
+    if k <= 0:
+        return pd.DataFrame(columns = ['Feature 1', 'Feature 2', 'Correlation'])
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best], kind = 'stable')]
+    best = best[np.isfinite(scores[best])]
+    return pd.DataFrame({
+        'Feature 1': matrix.index[first[best]],
+        'Feature 2': matrix.columns[second[best]],
+        'Correlation': values[best],
+    })
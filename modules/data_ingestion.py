@@ -0,0 +1,163 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals, is_integer_dtype, is_float_dtype
+
+
+def infer_compact_dtypes(sample_df, category_ratio = 0.5, max_categories = 1000, downcast_floats = True):
+    '''
+    Decides a compact storage kind for every column of a sample of the dataset.
+    Returns a dict of column --> 'integer' / 'float' / 'category', columns which should keep the default dtype are left out.
+    category_ratio:- an object column becomes 'category' only when its unique values are at most this fraction of the sample rows.
+    max_categories:- an object column with more unique values than this always stays object.
+    downcast_floats:- float64 columns are stored as float32 when True, in the chunks where float32 holds every value exactly.
+
+    Example
+    =========
+    >>> infer_compact_dtypes(pd.read_csv(data, nrows = 10000))
+    >>> {'Pclass': 'integer', 'Fare': 'float', 'Sex': 'category', 'Embarked': 'category'}
+    '''
+    compact_dtypes = {}
+    for col in sample_df.columns:
+        dtype = sample_df.dtypes[col]
+        if is_integer_dtype(dtype):
+            compact_dtypes[col] = 'integer'
+        elif is_float_dtype(dtype) and downcast_floats:
+            compact_dtypes[col] = 'float'
+        elif dtype == 'object':
+            n_unique = sample_df[col].nunique()
+            if n_unique <= max_categories and n_unique <= category_ratio * len(sample_df):
+                compact_dtypes[col] = 'category'
+    return compact_dtypes
+
+
+def compact_chunk(chunk, compact_dtypes):
+    # Downcasting is done per chunk after parsing, so a value which doesn't fit the sampled dtype can never break the read
+    for col, kind in compact_dtypes.items():
+        if col not in chunk.columns:
+            continue
+        if kind == 'integer' and is_integer_dtype(chunk.dtypes[col]):
+            chunk[col] = pd.to_numeric(chunk[col], downcast = 'integer')
+        elif kind in ('integer', 'float') and is_float_dtype(chunk.dtypes[col]):
+            narrow = lossless_float32(chunk[col].to_numpy())
+            if narrow is not None:
+                chunk[col] = narrow
+    return chunk
+
+
+def lossless_float32(values):
+    # values as float32 when that keeps every one of them exactly (prices, coordinates or ids with many decimals don't), None otherwise
+    narrow = values.astype(np.float32)
+    if ((narrow.astype(np.float64) == values) | np.isnan(values)).all():
+        return narrow
+    return None
+
+
+def combine_chunks(chunks, category_columns):
+    # pd.concat turns categoricals with different categories into object columns, so those are unioned separately
+    if len(chunks) == 1:
+        return chunks[0]
+
+    columns = chunks[0].columns
+    categories = {}
+    for col in category_columns:
+        if all(str(chunk.dtypes[col]) == 'category' for chunk in chunks):
+            categories[col] = union_categoricals([chunk[col] for chunk in chunks], sort_categories = True)
+            for chunk in chunks:
+                chunk.drop(col, axis = 1, inplace = True)
+
+    df = pd.concat(chunks, axis = 0, ignore_index = True)
+    del chunks[:]
+    for col, values in categories.items():
+        df[col] = values
+    return df[columns]
+
+
+def upload_fingerprint(data):
+    '''
+    Returns a hex digest of the content of an uploaded file, used as the first dataset version of what is loaded from it.
+    '''
+    hasher = hashlib.sha1()
+    position = data.tell()
+    data.seek(0)
+    block = data.read(1024 * 1024)
+    while block:
+        hasher.update(block if isinstance(block, bytes) else block.encode())
+        block = data.read(1024 * 1024)
+    data.seek(position)
+    return hasher.hexdigest()
+
+
+def file_size(data):
+    position = data.tell()
+    data.seek(0, os.SEEK_END)
+    size = data.tell()
+    data.seek(position)
+    return size
+
+
+def read_csv_compact(data, chunksize = 200000, sample_rows = 20000, progress_callback = None, **dtype_options):
+    '''
+    Reads a csv file in chunks using the compact dtypes inferred from its first sample_rows rows.
+    data:- a path or a seekable file object (for example the file returned by streamlit's file_uploader).
+    chunksize:- number of rows parsed at a time.
+    progress_callback:- optional function called as progress_callback(fraction_done, rows_read) after every chunk.
+    dtype_options:- passed on to infer_compact_dtypes.
+    Returns the DataFrame and a dict of load statistics (rows, seconds, rows_per_second, memory_bytes, default_memory_bytes).
+
+    Example
+    =========
+    >>> df, stats = read_csv_compact(data, progress_callback = lambda fraction, rows : bar.progress(int(fraction * 100)))
+    '''
+    if isinstance(data, str):
+        with open(data, "rb") as csv_file:
+            return read_csv_compact(csv_file, chunksize, sample_rows, progress_callback, **dtype_options)
+
+    start = time.time()
+    data.seek(0)
+    total_bytes = file_size(data)
+
+    sample = pd.read_csv(data, nrows = sample_rows)
+    compact_dtypes = infer_compact_dtypes(sample, **dtype_options)
+    category_columns = [col for col, kind in compact_dtypes.items() if kind == 'category']
+
+    # Rough estimate of what a plain pd.read_csv would have used, scaled up from the sample
+    sample_bytes = sample.memory_usage(deep = True).sum()
+    compact_sample_bytes = compact_chunk(sample.astype({col: 'category' for col in category_columns}), compact_dtypes).memory_usage(deep = True).sum()
+    del sample
+
+    data.seek(0)
+
+    chunks = []
+    rows_read = 0
+    reader = pd.read_csv(data, chunksize = chunksize, dtype = {col: 'category' for col in category_columns})
+    for chunk in reader:
+        chunks.append(compact_chunk(chunk, compact_dtypes))
+        rows_read += len(chunk)
+
+        if progress_callback is not None:
+            fraction = min(data.tell() / total_bytes, 1.0) if total_bytes else 0.0
+            progress_callback(fraction, rows_read)
+
+    if chunks == []:  # Only a header line, nothing to combine
+        data.seek(0)
+        df = pd.read_csv(data)
+    else:
+        df = combine_chunks(chunks, category_columns)
+
+    if progress_callback is not None:
+        progress_callback(1.0, rows_read)
+
+    seconds = time.time() - start
+    memory_bytes = df.memory_usage(deep = True).sum()
+    stats = {
+        'rows': len(df),
+        'seconds': seconds,
+        'rows_per_second': len(df) / seconds if seconds > 0 else float(len(df)),
+        'memory_bytes': int(memory_bytes),
+        'default_memory_bytes': int(memory_bytes * sample_bytes / compact_sample_bytes) if compact_sample_bytes else int(memory_bytes),
+    }
+    return df, stats
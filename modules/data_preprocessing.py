@@ -1,17 +1,15 @@
 import pandas as pd
 import numpy as np
 
-import plotly.offline as py
-py.init_notebook_mode(connected=True)
-import plotly.graph_objs as go
-import plotly.tools as tls
-import plotly.express as px
+from modules.lazy_loader import lazy_import
+from modules.dataset_profile import is_categorical, get_profile, register_profile, bump_version
+from modules.imputation import Imputer
+from modules.figure_cache import cached_figure
 
-import cufflinks as cf
-cf.go_offline()
-
-from plotly.subplots import make_subplots
-import plotly.graph_objects as go
+# Plotting libraries are heavy to import, so they are only loaded once a figure is actually built
+go = lazy_import("plotly.graph_objects")
+px = lazy_import("plotly.express")
+plotly_subplots = lazy_import("plotly.subplots")
 
 def type_of_feature(df):
 
@@ -22,7 +20,9 @@ def type_of_feature(df):
 def null_value(df):
     # Null values management system (^_^)
 
-    missing_values_count = df.isnull().sum().sort_values(ascending = False)
+    profile = get_profile(df)  # null counts and dtypes come from the single profiling pass over df
+
+    missing_values_count = profile.null_counts.sort_values(ascending = False)
     missing_values_count = missing_values_count.head( df.shape[1] - list(missing_values_count).count(0) )
     missing_values_count = missing_values_count.to_frame().reset_index().rename( columns = {'index' : 'Column/Feature' , 0 : '%age_Null_val_count'})
 
@@ -32,8 +32,8 @@ def null_value(df):
     Strategy   = []
 
     for feature in missing_values_count['Column/Feature']:
-        Data_Types.append( df.dtypes[feature]  )
-        if df.dtypes[feature] == 'object':
+        Data_Types.append( profile.dtypes[feature]  )
+        if is_categorical(profile.dtypes[feature]):
             Strategy.append('mode')
         else:
             Strategy.append('mean')
@@ -46,96 +46,116 @@ def null_value(df):
 
     return(missing_values_count)
 
+heatmap_max_cells = 200000    # up to this many cells every single cell is drawn, bigger datasets are binned by rows
+heatmap_max_buckets = 1000    # upper bound on the number of row buckets of the binned view
+
+def null_fraction_buckets(df, n_buckets):
+    '''
+    Splits the rows of df into n_buckets consecutive buckets of (almost) equal size and returns a DataFrame
+    of shape n_buckets x n_features holding the fraction of null values of every feature in every bucket.
+    '''
+    n_rows = len(df)
+    bounds = np.linspace(0, n_rows, n_buckets + 1).astype(np.int64)
+    starts, sizes = bounds[:-1], np.diff(bounds)
+    null_counts = get_profile(df).null_counts
+
+    fractions = np.zeros((n_buckets, df.shape[1]), dtype = np.float32)
+    for j, col in enumerate(df.columns):
+        if null_counts[col] == 0:
+            continue
+        # One column at a time, so the full boolean matrix of df.isnull() never has to exist
+        nulls = df[col].isnull().to_numpy()
+        fractions[:, j] = np.add.reduceat(nulls, starts, dtype = np.int64) / sizes
+
+    labels = [str(start) + " - " + str(start + size - 1) for start, size in zip(starts, sizes)]
+    return pd.DataFrame(fractions, index = labels, columns = df.columns)
+
+@cached_figure
 def heatmap_generator(df , coloraxis_val = False ):
     '''
     Generates heatmap plot according to the data received;
     cbar_value:- default is False but can also takes True as input to show cbar of heatmap.
+    Small datasets get one cell per value, bigger ones are binned by rows and every cell shows the fraction of nulls
+    in its bucket, which keeps the size of the figure bounded whatever the number of rows.
     
     Example
     =========
     >>> heatmap_generator(df.isnull())
     >>> plots heatmap to display all null values in the dataset.
     '''
-    if sum(df.isnull().sum()) != 0:
-        fig = px.imshow(df.isnull() , color_continuous_scale = 'ice' , width = 800, height = 600,)
-        fig.layout.coloraxis.showscale = coloraxis_val
-        fig.layout
+    if get_profile(df).total_nulls() != 0:
+        n_rows, n_cols = df.shape
+        if n_rows * n_cols <= heatmap_max_cells:
+            fig = px.imshow(df.isnull() , color_continuous_scale = 'ice' , width = 800, height = 600,)
+            fig.layout.coloraxis.showscale = coloraxis_val
+        else:
+            n_buckets = int(min(n_rows, heatmap_max_buckets, max(20, heatmap_max_cells // n_cols)))
+            fig = px.imshow(null_fraction_buckets(df, n_buckets) , color_continuous_scale = 'ice' , width = 800, height = 600,
+                            zmin = 0, zmax = 1, labels = dict(y = "Rows (" + str(-(-n_rows // n_buckets)) + " per bucket)", color = "Null fraction"))
+            fig.layout.coloraxis.showscale = True  # the colours are fractions here, so the scale is always needed
         return fig
     else:
         return None
 
 def imbalanced_feature(df):
-    dic = dict(df.dtypes)
-
-    categorical_features = []
-
-    for val in dic:
-        if dic[val] == 'object':
-            categorical_features.append(val)
-            
-
-    # print(categorical_features)
-
+    profile = get_profile(df)
 
     imbalanced_features = []
 
+    for feature_name in profile.categorical_features(): # Checking only categorical features , if they are balanced or imbalanced
+        stats = profile.categorical[feature_name]
 
-    for feature_name in categorical_features: # Checking only categorical features , if they are balanced or imbalanced
-        cool = df[feature_name].value_counts()
-        
-        if len( cool.value_counts().index ) <= int(0.05 * len(df)): # Comparing number of categories in a feature with number of rows , this will help us to reduce unnecessary usage of computational power     
-            new_dic = dict(  ( df[feature_name].value_counts() / len(df) ) * 100  )
-            for val in new_dic: # Checking percentage of each categories of a feature , if percentage of a category of a particular feature is above 80 percent , then mark that feature as imbalanced feature
-                if new_dic[val] >= 90:
-                    imbalanced_features.append( feature_name )
+        if stats['distinct_counts'] <= int(0.05 * len(df)): # Comparing number of categories in a feature with number of rows , this will help us to reduce unnecessary usage of computational power     
+            # Checking percentage of the most frequent category of a feature , if it is above 90 percent , then mark that feature as imbalanced feature
+            if stats['top_share'] >= 90:
+                imbalanced_features.append( feature_name )
     return(imbalanced_features)
 def cat_num(df):
-    dic = dict(df.dtypes)
-
-    categorical_features = []
-    numerical_features = []
-
-    for val in dic:
-        if dic[val] == 'object':
-            categorical_features.append(val)
-        else:
-            numerical_features.append(val)
-    return(categorical_features)
+    return(get_profile(df).categorical_features())
 
+@cached_figure
 def prcntage_values( categorical_feature, df):
     feature_df = pd.DataFrame( dict((  df[categorical_feature].value_counts() )).items() , columns = ['Category' , '%age'] )
     return px.pie( feature_df , values='%age', names='Category', title='Category vs %age for ' + categorical_feature + ' ' ,color_discrete_sequence=px.colors.sequential.RdBu)
 
 
+def category_pair_counts(df, type_1, type_2):
+    '''
+    Counts every (type_1 category, type_2 category) pair of df in a single pass over the category codes.
+    Returns (categories_1, categories_2, counts) where counts[i][j] is the number of rows having categories_1[i] and categories_2[j],
+    both category lists are ordered by frequency like value_counts(). Rows with a null in either feature are not counted.
+    '''
+    codes_1, uniques_1 = pd.factorize(df[type_1])
+    codes_2, uniques_2 = pd.factorize(df[type_2])
+    k1, k2 = len(uniques_1), len(uniques_2)
+
+    valid = (codes_1 >= 0) & (codes_2 >= 0)
+    counts = np.bincount(codes_1[valid].astype(np.int64) * k2 + codes_2[valid], minlength = k1 * k2).reshape(k1, k2)
+
+    # Ordering categories by their own frequency, the same order value_counts() gives
+    order_1 = np.argsort(-np.bincount(codes_1[codes_1 >= 0], minlength = k1), kind = 'stable')
+    order_2 = np.argsort(-np.bincount(codes_2[codes_2 >= 0], minlength = k2), kind = 'stable')
+
+    categories_1 = [uniques_1[i] for i in order_1]
+    categories_2 = [uniques_2[i] for i in order_2]
+    return categories_1, categories_2, counts[order_1][:, order_2]
+
+
+@cached_figure
 def two_cat_comparator( lis_of_feat , df ):
     type_1 , type_2  = lis_of_feat[0] , lis_of_feat[1]
-    dic = {}
-    unique_len_1 = len(df[type_1].value_counts())
-    unique_len_2 = len(df[type_2].value_counts())
-    
-    if unique_len_1 > 20 or unique_len_2 > 20:
-        for cat_1 in df[type_1].value_counts().index:
-            sub_dict = {}
-            for cat_2 in df[type_2].value_counts().index:
-
-                new = df[(df[type_1] == cat_1) & (df[type_2] == cat_2)]
-                sub_dict[cat_2] = len(new)
-            dic[cat_1] = sub_dict
+    categories_1, categories_2, counts = category_pair_counts(df, type_1, type_2)
+
+    if len(categories_1) > 20 or len(categories_2) > 20:
+        dic = {}
+        for i, cat_1 in enumerate(categories_1):
+            dic[cat_1] = dict(zip(categories_2, counts[i].tolist()))
         return dic
     else:
-        for cat_1 in df[type_1].value_counts().index: 
-            sub_lis = []
-            for cat_2 in df[type_2].value_counts().index:
-
-                new = df[ ( df[type_1] == cat_1 ) & (df[type_2] == cat_2) ]
-                sub_lis.append( [ cat_2 ,   len(new)  ] )
-            dic[cat_1] = sub_lis
-    
-    
         wow = []
 
-        for key in dic:
-            wow.append(  go.Bar(name = key  , x = np.array(dic[key])[: , 0]  , y = np.array(dic[key])[: , 1] )  )
+        for i, cat_1 in enumerate(categories_1):
+            wow.append(  go.Bar(name = str(cat_1)  , x = categories_2  , y = counts[i] )  )
         fig = go.Figure(data = wow)
 
 
@@ -163,18 +183,22 @@ def two_cat_comparator( lis_of_feat , df ):
         return fig
 
 def missing_value_lis(df):
-    missing_values_count = null_value(df)
-    return (list(missing_values_count['Column/Feature']))
+    return get_profile(df).null_columns()
 
 
 def drop_feat(df, lis_drop):
     # Time to drop or fill the Nan values in given features
-    missing_values_count = null_value(df)
-    feature_tracker = list(missing_values_count['Column/Feature'])
+    profile = get_profile(df)
+    feature_tracker = profile.null_columns()
 
     drop_features = lis_drop
     df.drop( drop_features , axis = 1 , inplace = True)
 
+    if drop_features != []:
+        # The profile of the new version is derived from the old one instead of profiling df again
+        bump_version(df, 'drop', list(drop_features))
+        register_profile(df, profile.drop(drop_features))
+
     for feat in drop_features:
         feature_tracker.remove(feat)
 
@@ -184,35 +208,53 @@ def drop_feat(df, lis_drop):
         return(feature_tracker, "Features were Dropped Successfully")
 
 
-def fill_feature(df, feature_ch, liss_fill): 
-    i = 0   
-    for feature_name in feature_ch :
-        strategy_given_by_user = liss_fill[i]
-        if strategy_given_by_user == 'mean':
-            df[ feature_name ] = df[ feature_name ].fillna( df[ feature_name ].mean())
-        elif strategy_given_by_user == 'mode':
-            df[ feature_name ] = df[ feature_name ].fillna( df[ feature_name ].mode()[0])
-        elif strategy_given_by_user == 'median':
-            df[ feature_name ] = df[ feature_name ].fillna( df[ feature_name ].median())
-        i += 1
-    return pd.DataFrame(df.isnull().sum().sort_values(ascending = False)).reset_index().rename(columns = {'index' : 'Feature' , 0 : 'Null Value Count'})
+def fill_feature(df, feature_ch, liss_fill, options = None):
+    '''
+    Fills the nulls of the features of feature_ch with the strategy at the same position of liss_fill, all of them
+    in one batch (see modules/imputation.py), and returns the null counts of df afterwards.
+    options:- optional dict of feature --> dict of the options of its strategy ('value' for 'constant', 'by' for the group strategies,
+    'n_neighbors' for 'knn').
+
+    Example
+    =========
+    >>> fill_feature(df, ['Age', 'Embarked'], ['group median', 'mode'], {'Age': {'by': 'Pclass'}})
+    '''
+    profile = get_profile(df)  # Profile of the version before filling, the new one is derived from it
+    options = options or dict()
+
+    if feature_ch != []:
+        imputer = Imputer(df)
+        imputer.fill({feature_name: (strategy, options.get(feature_name, {})) for feature_name, strategy in zip(feature_ch, liss_fill)})
+        # Kept with the dataset so a model trained on it can fill new rows the same way (modules/model_store.py)
+        df.attrs['fills'] = {**df.attrs.get('fills', {}), **imputer.record}
+        # Only the filled features are counted again
+        change = ('fill', list(feature_ch), list(liss_fill)) + ((options,) if options != {} else ())
+        bump_version(df, *change)
+        profile = profile.refresh(df, list(feature_ch))
+        register_profile(df, profile)
+    return pd.DataFrame(profile.null_counts.sort_values(ascending = False)).reset_index().rename(columns = {'index' : 'Feature' , 0 : 'Null Value Count'})
 
 
 def useless_feat(df):
+    profile = get_profile(df)
     useless_ls = []
-    for col in df.columns: 
-        if df.dtypes[col] == "O" and df[col].nunique() >= 0.05*df.shape[0]:
+    for col in profile.categorical_features(): 
+        if profile.categorical[col]['nunique'] >= 0.05*df.shape[0]:
             useless_ls.append(col)
     useless_df = pd.DataFrame(useless_ls, columns = ["Feature"]) 
     return(useless_df)
 
 def drop_useless_feat(df, feature):
+    profile = get_profile(df)
     df.drop([feature], axis = 1, inplace = True)
+    bump_version(df, 'drop', [feature])
+    register_profile(df, profile.drop([feature]))
 
 
 
 # subplot makes for table + piechart which will be used in value counter
 
+@cached_figure
 def suplots_maker_for_table_and_piechart(df , type_null , feature = None):
 #-------------------------------------------------------------------------------------------------------
     # Here we are using basically 4 variables , 2 for table and 2 for pie chart
@@ -231,7 +273,7 @@ def suplots_maker_for_table_and_piechart(df , type_null , feature = None):
     rowOddColor = 'white'
 
     if type_null == True:
-        dic = dict(df[feature].value_counts()) 
+        dic = dict(get_profile(df).value_counts(df, feature)) 
 
         
         # Table parameters --> headers , value_lis_for_table
@@ -250,7 +292,7 @@ def suplots_maker_for_table_and_piechart(df , type_null , feature = None):
         type_of_feat_df = type_of_feature(df)
 
         dic = {}
-        for val in type_of_feat_df.groupby('Dtypes'):
+        for val in type_of_feat_df.groupby(type_of_feat_df['Dtypes'].astype(str)):  # dtype objects of different kinds (category / numpy) can't be sorted together
             dic[ str(val[0]) ] =  len(val[1]) 
         
         new_df = type_of_feature(df).reset_index()
@@ -301,7 +343,7 @@ def suplots_maker_for_table_and_piechart(df , type_null , feature = None):
 
 
     # Merging the given traces[trace_table , trace_pie_chart] using make_subplots
-    fig = make_subplots(rows=1, cols=2, specs=[[{"type": "Table"}, {"type": "pie"}]])
+    fig = plotly_subplots.make_subplots(rows=1, cols=2, specs=[[{"type": "Table"}, {"type": "pie"}]])
     fig.add_trace(trace_table, row=1, col=1)
     fig.add_trace(trace_piechart, row=1, col=2)
 
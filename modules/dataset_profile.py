@@ -0,0 +1,181 @@
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+
+
+profile_cache_size = 64      # number of dataset versions whose profile is kept, shared by every session
+value_counts_limit = 1000    # value_counts of categorical features with more categories than this are not kept in the profile
+
+
+def is_categorical(dtype):
+    # Categorical features are either plain object columns or pandas category columns (created by modules/data_ingestion.py)
+    return dtype == 'object' or str(dtype) == 'category'
+
+
+#############################################################################################################################################################################################
+''' Dataset versions : every DataFrame handled by the app carries a version id in df.attrs.
+    The id of a freshly loaded dataset comes from the content of the uploaded file, and every
+    change made through drop_feat / fill_feature / drop_useless_feat derives a new id from the
+    old one and the change itself. The same upload with the same choices therefore gets the
+    same version on every rerun, which is what the caches below are keyed on. '''
+
+
+def stamp_version(df, token):
+    df.attrs['dataset_version'] = str(token)
+
+
+def dataset_version(df):
+    version = df.attrs.get('dataset_version')
+    if version is None:
+        # A DataFrame which didn't come from the upload gets a random id, it is never confused with another one
+        version = uuid.uuid4().hex
+        df.attrs['dataset_version'] = version
+    return version
+
+
+def bump_version(df, *change):
+    '''
+    Derives the version of df after a change from its current version.
+
+    Example
+    =========
+    >>> bump_version(df, 'drop', ['Cabin'])
+    '''
+    hasher = hashlib.sha1()
+    hasher.update(repr((dataset_version(df),) + change).encode())
+    df.attrs['dataset_version'] = hasher.hexdigest()
+    return df.attrs['dataset_version']
+
+
+#############################################################################################################################################################################################
+
+
+def categorical_stats(series, n_rows):
+    counts = series.value_counts()
+    counts = counts[counts > 0]  # category columns also list categories which no longer appear
+    return {
+        'nunique': len(counts),
+        'top_share': (counts.iloc[0] / n_rows) * 100 if len(counts) != 0 and n_rows != 0 else 0.0,
+        'distinct_counts': counts.nunique(),
+        'value_counts': counts if len(counts) <= value_counts_limit else None,
+    }
+
+
+class DatasetProfile:
+    def __init__(self, df = None):
+        '''
+        DatasetProfile holds the statistics the Home page needs, computed in a single pass over df :
+        null counts and dtypes of every feature and, for the categorical features, their cardinality,
+        value counts and the share of their most frequent category.
+        Use get_profile(df) rather than building one directly, so that it is computed once per dataset version.
+        '''
+        if df is None:
+            return
+        self.n_rows = len(df)
+        self.dtypes = df.dtypes
+        self.null_counts = df.isnull().sum()
+        self.categorical = dict()
+        self.numerical_cardinality = dict()
+        for col in df.columns:
+            if is_categorical(self.dtypes[col]):
+                self.categorical[col] = categorical_stats(df[col], self.n_rows)
+
+
+    def copy(self):
+        profile = DatasetProfile()
+        profile.n_rows = self.n_rows
+        profile.dtypes = self.dtypes
+        profile.null_counts = self.null_counts
+        profile.categorical = dict(self.categorical)
+        profile.numerical_cardinality = dict(self.numerical_cardinality)
+        return profile
+
+
+    def drop(self, columns):
+        # Returns the profile of the dataset without columns
+        profile = self.copy()
+        profile.dtypes = self.dtypes.drop(columns)
+        profile.null_counts = self.null_counts.drop(columns)
+        for col in columns:
+            profile.categorical.pop(col, None)
+            profile.numerical_cardinality.pop(col, None)
+        return profile
+
+
+    def refresh(self, df, columns):
+        # Returns the profile with the statistics of columns recomputed from df, every other feature is left as it is
+        profile = self.copy()
+        profile.dtypes = df.dtypes
+        null_counts = self.null_counts.copy()
+        null_counts[columns] = df[columns].isnull().sum()
+        profile.null_counts = null_counts
+        for col in columns:
+            profile.numerical_cardinality.pop(col, None)
+            if is_categorical(profile.dtypes[col]):
+                profile.categorical[col] = categorical_stats(df[col], profile.n_rows)
+        return profile
+
+
+    def total_nulls(self):
+        return int(self.null_counts.sum())
+
+
+    def null_columns(self):
+        # Features having null values, the ones with the most nulls first
+        missing_values_count = self.null_counts.sort_values(ascending = False)
+        return list(missing_values_count[missing_values_count != 0].index)
+
+
+    def categorical_features(self):
+        return [col for col in self.dtypes.index if col in self.categorical]
+
+
+    def numerical_features(self):
+        return [col for col in self.dtypes.index if col not in self.categorical]
+
+
+    def value_counts(self, df, col):
+        if col in self.categorical and self.categorical[col]['value_counts'] is not None:
+            return self.categorical[col]['value_counts']
+        return df[col].value_counts()
+
+
+    def cardinality(self, df, col):
+        if col in self.categorical:
+            return self.categorical[col]['nunique']
+        if col not in self.numerical_cardinality:
+            self.numerical_cardinality[col] = df[col].nunique()
+        return self.numerical_cardinality[col]
+
+
+profile_cache = OrderedDict()
+profile_cache_lock = threading.Lock()
+
+
+def get_profile(df):
+    '''
+    Returns the DatasetProfile of df, computing it only if this version of the dataset wasn't profiled yet.
+
+    Example
+    =========
+    >>> get_profile(df).null_columns()
+    >>> ['Cabin', 'Age', 'Embarked']
+    '''
+    version = dataset_version(df)
+    with profile_cache_lock:
+        if version in profile_cache:
+            profile_cache.move_to_end(version)
+            return profile_cache[version]
+
+    profile = DatasetProfile(df)
+    register_profile(df, profile)
+    return profile
+
+
+def register_profile(df, profile):
+    # Stores profile as the profile of the current version of df
+    with profile_cache_lock:
+        profile_cache[dataset_version(df)] = profile
+        while len(profile_cache) > profile_cache_size:
+            profile_cache.popitem(last = False)
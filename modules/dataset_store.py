@@ -0,0 +1,113 @@
+import os
+import tempfile
+import time
+import uuid
+
+import pandas as pd
+
+from modules.lazy_loader import lazy_import
+from modules.dataset_profile import get_profile, dataset_version
+
+feather = lazy_import("pyarrow.feather")
+
+
+store_directory = os.environ.get("ML_AUTOMATOR_STORE_DIR", os.path.join(tempfile.gettempdir(), "ml_automator_datasets"))
+store_max_age_hours = float(os.environ.get("ML_AUTOMATOR_STORE_MAX_AGE_HOURS", 12))
+
+
+class SpilledDataset:
+    def __init__(self, path, df):
+        '''
+        SpilledDataset is a handle to a DataFrame written to an uncompressed Feather file.
+        It keeps only the schema (columns, dtypes, shape and null counts) in memory,
+        the data itself is read back through a memory map and only for the columns asked for.
+
+        Example
+        =========
+        >>> dataset = spill_dataset(df, session_id)
+        >>> dataset.load(['Age', 'Fare'])    # reads just these two columns
+        '''
+        self.path = path
+        self.columns = df.columns
+        self.dtypes = df.dtypes
+        self.shape = df.shape
+        self.null_counts = get_profile(df).null_counts
+        # caches keyed by dataset_version work the same on the spilled copy, fills are what the Home page filled nulls with
+        self.attrs = {'dataset_version': dataset_version(df), 'fills': df.attrs.get('fills', {})}
+
+    def load(self, columns = None):
+        table = feather.read_table(self.path, columns = columns, memory_map = True)
+        df = table.to_pandas()
+        if columns is None:
+            df.attrs.update(self.attrs)  # the whole dataset, the same version as the one spilled
+        return df
+
+    def head(self, n = 5):
+        table = feather.read_table(self.path, memory_map = True)
+        return table.slice(0, n).to_pandas()
+
+    def __len__(self):
+        return self.shape[0]
+
+
+def spill_dataset(df, session_id, previous = None):
+    '''
+    Writes df to the per session Feather file and returns a SpilledDataset pointing to it.
+    previous:- the SpilledDataset stored on an earlier rerun, returned as it is (nothing is written) when it holds the same dataset version.
+    Files of sessions which haven't written anything for store_max_age_hours are removed on the way.
+    '''
+    os.makedirs(store_directory, exist_ok = True)
+    purge_stale_datasets()
+
+    path = os.path.join(store_directory, str(session_id) + ".feather")
+    if (isinstance(previous, SpilledDataset) and previous.path == path and os.path.exists(path)
+            and previous.attrs['dataset_version'] == dataset_version(df)):
+        os.utime(path)  # still in use, purge_stale_datasets goes by the modification time
+        return previous
+
+    # Written under a temporary name first, so a page reading the previous version never sees a half written file
+    temp_path = path + "." + uuid.uuid4().hex + ".tmp"
+    feather.write_feather(df.reset_index(drop = True), temp_path, compression = "uncompressed")
+    os.replace(temp_path, path)
+    return SpilledDataset(path, df)
+
+
+def purge_stale_datasets(max_age_hours = None):
+    if max_age_hours is None:
+        max_age_hours = store_max_age_hours
+    if not os.path.isdir(store_directory):
+        return
+
+    oldest_allowed = time.time() - max_age_hours * 3600
+    for file_name in os.listdir(store_directory):
+        path = os.path.join(store_directory, file_name)
+        try:
+            if os.path.getmtime(path) < oldest_allowed:
+                os.remove(path)
+        except FileNotFoundError:
+            pass  # Removed by another session in the meantime
+
+
+def is_dataset(obj):
+    # True for a DataFrame and for a SpilledDataset
+    return isinstance(obj, (pd.DataFrame, SpilledDataset))
+
+
+def load_dataset(dataset, columns = None):
+    '''
+    Returns the columns of dataset as a DataFrame, whether dataset is a DataFrame or a SpilledDataset.
+    columns:- list of columns to load, all of them when None.
+    '''
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))  # the same feature can be picked by two widgets
+    if isinstance(dataset, SpilledDataset):
+        return dataset.load(columns)
+    if columns is None:
+        return dataset
+    return dataset[columns]
+
+
+def dataset_null_counts(dataset):
+    if isinstance(dataset, SpilledDataset):
+        return dataset.null_counts
+    return get_profile(dataset).null_counts
@@ -0,0 +1,184 @@
+import base64
+import gc
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+
+from modules.dataset_profile import dataset_version
+
+
+download_directory = os.environ.get("ML_AUTOMATOR_DOWNLOAD_DIR", os.path.join(tempfile.gettempdir(), "ml_automator_downloads"))
+download_ttl_minutes = float(os.environ.get("ML_AUTOMATOR_DOWNLOAD_TTL_MINUTES", 60))  # exports are removed this long after being written
+inline_download_megabytes = float(os.environ.get("ML_AUTOMATOR_INLINE_DOWNLOAD_MB", 50))  # largest export embedded in the page when streaming isn't available
+download_chunk_bytes = 1024 * 1024
+download_route = "ml_automator_download"
+
+# File formats offered for download --> label : (file extension, content type)
+download_formats = {
+    'CSV': ('.csv', 'text/csv'),
+    'Compressed CSV (.csv.gz)': ('.csv.gz', 'application/gzip'),
+    'Parquet': ('.parquet', 'application/octet-stream'),
+}
+
+
+# token --> (path, file name, content type, expiry time)
+exports = dict()
+# (dataset version, format) --> token, so the same export isn't written again on every rerun
+exports_by_version = dict()
+exports_lock = threading.Lock()
+# None until register_download_handler has looked for the server, then whether the route could be added
+handler_registered = None
+handler_lock = threading.Lock()
+
+
+def write_export(df, path, file_format):
+    # Written straight from the DataFrame to the file, never through an in-memory string
+    if file_format == 'Parquet':
+        df.to_parquet(path, index = False)
+    elif file_format == 'Compressed CSV (.csv.gz)':
+        df.to_csv(path, index = False, compression = 'gzip', chunksize = 100000)
+    else:
+        df.to_csv(path, index = False, chunksize = 100000)
+
+
+def export_dataframe(df, file_name, file_format = 'CSV', version = None):
+    '''
+    Writes df to a temporary file in file_format and returns the token it is served under.
+    version:- identifies the content of df, dataset_version(df) by default. An export of the same
+    version and format which is still available is reused instead of being written again.
+    '''
+    if version is None:
+        version = dataset_version(df)
+    extension, content_type = download_formats[file_format]
+
+    with exports_lock:
+        token = exports_by_version.get((version, file_format))
+        if token in exports and os.path.exists(exports[token][0]):
+            return token
+
+    os.makedirs(download_directory, exist_ok = True)
+    purge_expired_exports()
+
+    token = secrets.token_urlsafe(24)
+    path = os.path.join(download_directory, token + extension)
+    temp_path = path + ".tmp"
+    write_export(df, temp_path, file_format)
+    os.replace(temp_path, path)
+
+    with exports_lock:
+        exports[token] = (path, file_name + extension, content_type, time.time() + download_ttl_minutes * 60)
+        exports_by_version[(version, file_format)] = token
+    return token
+
+
+def purge_expired_exports():
+    now = time.time()
+    with exports_lock:
+        expired = [token for token, export in exports.items() if export[3] < now]
+        for token in expired:
+            path = exports.pop(token)[0]
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        for key in [key for key, token in exports_by_version.items() if token not in exports]:
+            del exports_by_version[key]
+
+
+def base_url_path():
+    try:
+        from streamlit import config
+        return config.get_option("server.baseUrlPath").strip("/")
+    except Exception:
+        return ""
+
+
+def download_url(token):
+    base = base_url_path()
+    return ("/" + base if base else "") + "/" + download_route + "/" + token
+
+
+def register_download_handler():
+    '''
+    Adds the route serving the exports to the tornado application of the Streamlit server, once per process.
+    Streamlit doesn't expose the application, it is looked up among the live objects, only on the first call :
+    the result, found or not, is kept. The lookup holds handler_lock, not exports_lock, so exports and downloads
+    in progress never wait for it.
+    Returns False when it isn't found (for example outside of "streamlit run"), downloads then fall back to data URIs.
+    '''
+    global handler_registered
+    if handler_registered is not None:
+        return handler_registered
+    with handler_lock:
+        if handler_registered is None:
+            handler_registered = add_download_route()
+    return handler_registered
+
+
+def add_download_route():
+    try:
+        import tornado.web
+        from tornado.ioloop import IOLoop
+    except ImportError:
+        return False
+
+    applications = [obj for obj in gc.get_objects() if isinstance(obj, tornado.web.Application)]
+    if applications == []:
+        return False
+
+    class DownloadHandler(tornado.web.RequestHandler):
+        async def get(self, token):
+            with exports_lock:
+                export = exports.get(token)
+            if export is None or not os.path.exists(export[0]):
+                raise tornado.web.HTTPError(404)
+
+            path, file_name, content_type, _ = export
+            self.set_header("Content-Type", content_type)
+            self.set_header("Content-Disposition", 'attachment; filename="' + file_name + '"')
+            self.set_header("Content-Length", str(os.path.getsize(path)))
+            # The file is opened and read on the executor, the IOLoop keeps serving the app while the disk is busy
+            loop = IOLoop.current()
+            export_file = await loop.run_in_executor(None, open, path, "rb")
+            try:
+                chunk = await loop.run_in_executor(None, export_file.read, download_chunk_bytes)
+                while chunk:
+                    self.write(chunk)
+                    await self.flush()  # only one chunk is held in memory at a time
+                    chunk = await loop.run_in_executor(None, export_file.read, download_chunk_bytes)
+            finally:
+                export_file.close()
+
+    base = base_url_path()
+    pattern = ("/" + re.escape(base) if base else "") + "/" + download_route + r"/([\w-]+)"
+    for application in applications:
+        # ".*$" handlers are put ahead of the ones given at start up, so Streamlit's catch all static route doesn't shadow this one
+        application.add_handlers(r".*$", [(pattern, DownloadHandler)])
+    return True
+
+
+def download_link(df, file_name, file_format = 'CSV', version = None):
+    '''
+    Returns the html of a link downloading df as file_name in file_format.
+    The file is written on the server and streamed in chunks, when that isn't possible and the export is small enough
+    it is embedded in the link as a base64 data URI instead. Returns None when neither is possible.
+
+    Example
+    =========
+    >>> markdown(download_link(df, "preprocessed_dataset", "Parquet"), unsafe_allow_html = True)
+    '''
+    token = export_dataframe(df, file_name, file_format, version)
+    with exports_lock:
+        path, download_name, content_type, _ = exports[token]
+
+    if register_download_handler():
+        return f'<a href="{download_url(token)}" download="{download_name}">Download {download_name}</a>'
+
+    if os.path.getsize(path) > inline_download_megabytes * 1024 * 1024:
+        return None
+    with open(path, "rb") as export_file:
+        b64 = base64.b64encode(export_file.read()).decode()
+    return f'<a href="data:{content_type};base64,{b64}" download="{download_name}">Download {download_name}</a>'
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+from modules.dataset_profile import is_categorical
+
+
+# The EDA figures are drawn from the summaries below instead of the raw rows, so their size doesn't grow with the dataset
+histogram_max_bins = 200            # numerical features are counted in at most this many bins
+histogram_max_categories = 100      # categorical features show their most frequent categories, up to this many
+box_max_groups = 50                 # boxes of the most frequent x values (and colours) drawn, up to this many
+box_max_outlier_points = 5000       # outliers drawn over all the boxes, a random sample when there are more
+
+
+def group_codes(df, columns):
+    # Code of the group of every row of df (for the given columns) and the values of every group, groups sorted by value
+    if columns == []:
+        return np.zeros(len(df), dtype = np.int64), pd.DataFrame(index = [0])
+    codes = df.groupby(columns, sort = True, observed = True).ngroup().to_numpy()
+    first_rows = np.unique(codes, return_index = True)[1]
+    return codes, df[columns].iloc[first_rows].reset_index(drop = True)
+
+
+def auto_bin_count(values):
+    # Number of bins numpy's bins = 'auto' would use (the narrower of the Freedman-Diaconis and Sturges widths),
+    # computed without building the edges : one extreme outlier can make that many millions of bins
+    span = values.max() - values.min()
+    if span == 0:
+        return 1
+    sturges_width = span / (np.log2(len(values)) + 1)
+    q25, q75 = np.percentile(values, [25, 75])
+    fd_width = 2 * (q75 - q25) * len(values) ** (-1 / 3)
+    width = min(fd_width, sturges_width) if fd_width > 0 else sturges_width
+    return int(np.ceil(span / width))
+
+
+def histogram_counts(df, feature, color = None):
+    '''
+    Counts the values of feature per bin (numerical feature) or per category (categorical feature), for every value of color.
+    Rows where feature or color is null are not counted, like px.histogram does.
+    Returns a dict with 'kind' ('bins' or 'categories'), 'x' (bin edges or categories), 'colors' (values of color, [None] without it)
+    and 'counts', an array of shape (number of colors, number of bins or categories).
+
+    Example
+    =========
+    >>> histogram_counts(df, 'Age', 'Sex')
+    >>> {'kind': 'bins', 'x': array([0.42, 3.6, ...]), 'colors': ['female', 'male'], 'counts': array([[14, 8, ...], [16, 12, ...]])}
+    '''
+    columns = [feature] if color is None else [feature, color]
+    data = df[columns].dropna()
+    if color is None:
+        color_codes, colors = np.zeros(len(data), dtype = np.int64), [None]
+    else:
+        color_codes, color_keys = group_codes(data, [color])
+        colors = color_keys[color].tolist()
+    values = data[feature]
+
+    if is_categorical(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+        codes, categories = pd.factorize(values)
+        totals = np.bincount(codes, minlength = len(categories))
+        kept = np.argsort(-totals, kind = 'stable')[: histogram_max_categories]
+        counts = np.bincount(color_codes * len(categories) + codes, minlength = len(colors) * len(categories)).reshape(len(colors), len(categories))
+        return {'kind': 'categories', 'x': [categories[i] for i in kept], 'colors': colors, 'counts': counts[:, kept]}
+
+    values = values.to_numpy(dtype = np.float64)
+    finite = np.isfinite(values)
+    values, color_codes = values[finite], color_codes[finite]
+    if len(values) == 0:
+        return {'kind': 'bins', 'x': np.array([0.0, 1.0]), 'colors': colors, 'counts': np.zeros((len(colors), 1), dtype = np.int64)}
+    edges = np.histogram_bin_edges(values, bins = min(auto_bin_count(values), histogram_max_bins))
+    n_bins = len(edges) - 1
+    bins = np.clip(np.searchsorted(edges, values, side = 'right') - 1, 0, n_bins - 1)  # the last edge belongs to the last bin
+    counts = np.bincount(color_codes * n_bins + bins, minlength = len(colors) * n_bins).reshape(len(colors), n_bins)
+    return {'kind': 'bins', 'x': edges, 'colors': colors, 'counts': counts}
+
+
+def sorted_median(values, offsets, lengths):
+    # Medians of the slices values[offset : offset + length] of a sorted array, for every (offset, length)
+    return (values[offsets + (lengths - 1) // 2] + values[offsets + lengths // 2]) / 2
+
+
+def box_stats(df, feature, by = None, random_state = 0):
+    '''
+    Box plot statistics of feature for every group of the columns by : quartiles (exclusive method, the one the
+    EDA box plot always used), mean, the whiskers (the furthest values within 1.5 IQR of the box) and a sample of the
+    outliers. Only the box_max_groups biggest groups are kept, and box_max_outlier_points outliers in all.
+    Returns a DataFrame with the by columns and count, q1, median, q3, mean, lowerfence, upperfence, outliers (a list per group).
+
+    Example
+    =========
+    >>> box_stats(df, 'Age', ['Pclass', 'Sex'])
+    '''
+    by = list(by or [])
+    data = df[by + [feature]].dropna()
+    if len(data) == 0:
+        return pd.DataFrame(columns = by + ['count', 'q1', 'median', 'q3', 'mean', 'lowerfence', 'upperfence', 'outliers'])
+    codes, keys = group_codes(data, by)
+    values = data[feature].to_numpy(dtype = np.float64)
+
+    sizes = np.bincount(codes, minlength = len(keys))
+    kept = np.sort(np.argsort(-sizes, kind = 'stable')[: box_max_groups])
+    kept = kept[sizes[kept] > 0]
+    recode = np.full(len(keys), -1, dtype = np.int64)
+    recode[kept] = np.arange(len(kept))
+    codes = recode[codes]
+    keep_rows = codes >= 0
+    codes, values = codes[keep_rows], values[keep_rows]
+    keys, sizes = keys.iloc[kept].reset_index(drop = True), sizes[kept]
+
+    # Sorting once by (group, value) gives every group as a sorted slice
+    order = np.lexsort((values, codes))
+    values, codes = values[order], codes[order]
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+
+    half = sizes // 2
+    single = half == 0  # a group of one value has all its quartiles on it
+    median = sorted_median(values, starts, sizes)
+    q1 = np.where(single, median, sorted_median(values, starts, np.maximum(half, 1)))
+    q3 = np.where(single, median, sorted_median(values, starts + sizes - np.maximum(half, 1), np.maximum(half, 1)))
+
+    iqr = q3 - q1
+    within = (values >= (q1 - 1.5 * iqr)[codes]) & (values <= (q3 + 1.5 * iqr)[codes])
+    stats = keys.copy()
+    stats['count'] = sizes
+    stats['q1'], stats['median'], stats['q3'] = q1, median, q3
+    stats['mean'] = np.add.reduceat(values, starts) / sizes
+    stats['lowerfence'] = np.minimum.reduceat(np.where(within, values, np.inf), starts)
+    stats['upperfence'] = np.maximum.reduceat(np.where(within, values, -np.inf), starts)
+
+    # Outliers : a random sample of at most per_group of every group
+    outlier_rows = np.flatnonzero(~within)
+    per_group = max(20, box_max_outlier_points // max(len(kept), 1))
+    outlier_rows = outlier_rows[np.random.RandomState(random_state).permutation(len(outlier_rows))]
+    outlier_rows = outlier_rows[np.argsort(codes[outlier_rows], kind = 'stable')]
+    outlier_codes = codes[outlier_rows]
+    rank = np.arange(len(outlier_rows)) - np.searchsorted(outlier_codes, outlier_codes)
+    outlier_rows = outlier_rows[rank < per_group]
+    bounds = np.searchsorted(codes[outlier_rows], np.arange(1, len(kept)))
+    stats['outliers'] = [part.tolist() for part in np.split(values[outlier_rows], bounds)]
+    return stats
+
+
+def sunburst_sums(df, path, values):
+    '''
+    Sum of values for every combination of the path features (one row per leaf of the sunburst).
+    Rows with a null in path are left out, px.sunburst can't place them.
+    '''
+    columns = list(dict.fromkeys(path + [values]))
+    sums = df[columns].groupby(path, sort = False, observed = True)[values].sum()
+    return sums.reset_index()
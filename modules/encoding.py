@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+from modules.dataset_profile import is_categorical
+from modules.lazy_loader import lazy_import
+
+sparse = lazy_import("scipy.sparse")
+
+
+def fit_encoding_schema(df, target_feature):
+    '''
+    Records how df is turned into a feature matrix : the numerical features, which are used as they are,
+    and the categories of every categorical feature, which are one hot encoded dropping the first category
+    (the same columns as pd.get_dummies(df, drop_first = True)).
+    The schema only holds lists and strings, so it can be saved as json next to a model and reused to encode new data.
+
+    Example
+    =========
+    >>> fit_encoding_schema(df, 'Survived')
+    >>> {'target': 'Survived', 'numerical': ['Pclass', 'Age', 'Fare'], 'categorical': {'Sex': ['female', 'male'], ...}, 'feature_names': [...]}
+    '''
+    numerical = []
+    categorical = {}
+    for col in df.columns:
+        if col == target_feature:
+            continue
+        if is_categorical(df.dtypes[col]):
+            categories = pd.Categorical(df[col]).remove_unused_categories().categories
+            categorical[col] = categories.tolist()
+        else:
+            numerical.append(col)
+
+    return {
+        'target': target_feature,
+        'numerical': numerical,
+        'categorical': categorical,
+        'feature_names': schema_feature_names(numerical, categorical),
+    }
+
+
+def schema_feature_names(numerical, categorical):
+    # Names of the encoded columns, in the order encode_with_schema lays them out
+    feature_names = list(numerical)
+    for col, categories in categorical.items():
+        feature_names.extend(str(col) + "_" + str(category) for category in categories[1:])
+    return feature_names
+
+
+def numerical_block(df, columns):
+    # Every value is stored explicitly, zeros included, so that xgboost doesn't take a 0 for a missing value
+    values = df[columns].to_numpy(dtype = np.float64)
+    n_rows, n_cols = values.shape
+    indices = np.tile(np.arange(n_cols, dtype = np.int32), n_rows)
+    indptr = np.arange(0, n_rows * n_cols + 1, n_cols, dtype = np.int64) if n_cols else np.zeros(n_rows + 1, dtype = np.int64)
+    return sparse.csr_matrix((values.ravel(), indices, indptr), shape = (n_rows, n_cols))
+
+
+def category_codes(series, categories):
+    # Unseen categories and nulls get the code -1 and, like the dropped first category, a row of zeros
+    return pd.Categorical(series, categories = categories).codes.astype(np.int64)
+
+
+def one_hot_block(codes, categories):
+    rows = np.flatnonzero(codes > 0)
+    data = np.ones(len(rows), dtype = np.float64)
+    return sparse.csr_matrix((data, (rows, codes[rows] - 1)), shape = (len(codes), max(len(categories) - 1, 0)))
+
+
+def encode_with_schema(df, schema):
+    '''
+    Encodes the features of df into a matrix laid out as schema['feature_names'] : a scipy CSR matrix, or a dense
+    float64 array when that takes less memory. A CSR matrix stores 12 bytes per value (8 of data, 4 of column index)
+    against 8 per cell for a dense one, and every numerical value is stored, so it only pays off when the one hot
+    columns are many and mostly zeros.
+    The target feature doesn't need to be in df, so the same schema encodes data which has to be scored.
+
+    Example
+    =========
+    >>> schema = fit_encoding_schema(df, 'Survived')
+    >>> X = encode_with_schema(df, schema)
+    '''
+    n_rows, n_numerical = len(df), len(schema['numerical'])
+    codes = {col: category_codes(df[col], categories) for col, categories in schema['categorical'].items()}
+    one_hot_values = sum(int(np.count_nonzero(col_codes > 0)) for col_codes in codes.values())
+    sparse_size = (n_rows * n_numerical + one_hot_values) * 12 + (n_rows + 1) * 8
+    dense_size = n_rows * len(schema['feature_names']) * 8
+
+    if dense_size <= sparse_size:
+        X = np.zeros((n_rows, len(schema['feature_names'])), dtype = np.float64)
+        X[:, :n_numerical] = df[schema['numerical']].to_numpy(dtype = np.float64)
+        offset = n_numerical
+        for col, categories in schema['categorical'].items():
+            rows = np.flatnonzero(codes[col] > 0)
+            X[rows, offset + codes[col][rows] - 1] = 1.0
+            offset += max(len(categories) - 1, 0)
+        return X
+
+    blocks = [numerical_block(df, schema['numerical'])]
+    for col, categories in schema['categorical'].items():
+        blocks.append(one_hot_block(codes[col], categories))
+    return sparse.hstack(blocks, format = 'csr')
+
+
+def matrix_bytes(X):
+    # Memory taken by X as it is
+    if sparse.issparse(X):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return X.nbytes
+
+
+def dense_bytes(X):
+    # Memory X would take once converted to a dense float64 array
+    return X.shape[0] * X.shape[1] * 8
+
+
+def is_sparse(X):
+    return sparse.issparse(X)
+
+
+def to_dense(X):
+    if sparse.issparse(X):
+        return X.toarray()
+    return X
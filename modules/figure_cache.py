@@ -0,0 +1,114 @@
+import functools
+import inspect
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from modules.lazy_loader import lazy_import
+from modules.dataset_profile import dataset_version
+
+pio = lazy_import("plotly.io")
+
+
+# Figures are kept serialized, so a figure handed out can be changed by its caller without touching the cached one
+figure_cache_max_entries = int(os.environ.get("ML_AUTOMATOR_FIGURE_CACHE_ENTRIES", 256))
+figure_cache_max_megabytes = int(os.environ.get("ML_AUTOMATOR_FIGURE_CACHE_MB", 128))
+
+
+class FigureCache:
+    def __init__(self, max_entries = 256, max_bytes = 128 * 1024 * 1024):
+        '''
+        FigureCache keeps the results of the plotting functions, shared by every session.
+        Plotly figures are stored as their json, anything else (None, the dict two_cat_comparator returns for
+        features with many categories) pickled. Least recently used entries are evicted first.
+        max_entries:- maximum number of results kept.
+        max_bytes:- maximum total size of the stored json / pickles.
+        '''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+    def get(self, key):
+        # Returns (True, result) on a hit, a new figure built from the stored json every time, and (False, None) on a miss
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        kind, blob = entry
+        if kind == 'figure':
+            return True, pio.from_json(blob)
+        return True, pickle.loads(blob)
+
+
+    def put(self, key, result):
+        if hasattr(result, 'to_json'):
+            entry = ('figure', result.to_json())
+        else:
+            entry = ('value', pickle.dumps(result, protocol = pickle.HIGHEST_PROTOCOL))
+        size = len(entry[1])
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= len(self.entries.pop(key)[1])
+            self.entries[key] = entry
+            self.total_bytes += size
+
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                evicted_key, evicted_entry = self.entries.popitem(last = False)
+                self.total_bytes -= len(evicted_entry[1])
+
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'megabytes': self.total_bytes / 1024 ** 2, 'hits': self.hits, 'misses': self.misses}
+
+
+figure_cache = FigureCache(figure_cache_max_entries, figure_cache_max_megabytes * 1024 * 1024)
+
+
+def cached_figure(function):
+    '''
+    Decorator caching the figure a plotting function returns, keyed by the version of its df argument (see
+    modules/dataset_profile.py) and the repr of its other arguments. drop_feat, fill_feature and drop_useless_feat
+    give the dataset a new version, so the figures of the old one are never returned for it again : they are left
+    to age out of the cache, another session (or the same rerun, before its drops) may still show that version.
+
+    Example
+    =========
+    >>> @cached_figure
+    >>> def histo_gram(df, selected_features):
+    '''
+    signature = inspect.signature(function)
+    name = function.__module__ + "." + function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        others = [(argument, value) for argument, value in arguments.arguments.items() if argument != 'df']
+        key = (name, dataset_version(arguments.arguments['df']), repr(others))
+
+        hit, result = figure_cache.get(key)
+        if hit:
+            return result
+        result = function(*args, **kwargs)
+        figure_cache.put(key, result)
+        return result
+
+    return wrapper
+
+
+def figure_cache_stats():
+    return figure_cache.stats()
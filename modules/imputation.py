@@ -0,0 +1,235 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from modules.lazy_loader import lazy_import
+from modules.dataset_profile import is_categorical
+
+neighbors = lazy_import("sklearn.neighbors")
+linear_model = lazy_import("sklearn.linear_model")
+
+
+imputation_workers = int(os.environ.get("ML_AUTOMATOR_IMPUTATION_WORKERS", os.cpu_count() or 1))
+knn_max_reference_rows = 50000   # rows the knn strategy looks for neighbours in, a random sample of the complete rows beyond that
+iterative_rounds = 3             # rounds of the iterative strategy, every round predicts each feature from the others' latest values
+
+# Strategies offered per kind of feature, in the order they are shown on the Home page
+numerical_strategies = ['mean', 'median', 'mode', 'constant', 'group mean', 'group median', 'knn', 'iterative']
+categorical_strategies = ['mode', 'constant', 'group mode']
+
+
+def series_mode(series):
+    '''
+    Most frequent value of series (None when it only holds nulls), counted through the category codes in one hashing
+    pass instead of the sort of series.mode(). Ties go to the smallest value, like series.mode()[0].
+    '''
+    codes, uniques = pd.factorize(series)
+    counts = np.bincount(codes[codes >= 0], minlength = len(uniques))
+    if len(counts) == 0:
+        return None
+    tied = np.flatnonzero(counts == counts.max())
+    try:
+        return min(uniques[tied])
+    except TypeError:
+        return uniques[tied[0]]
+
+
+def group_mode(df, feature, by):
+    # Per row fill value of feature : the most frequent value of its group of by, from one count of the (group, value) pairs
+    group_codes = pd.factorize(df[by])[0]
+    value_codes, values = pd.factorize(df[feature])
+    valid = (group_codes >= 0) & (value_codes >= 0)
+    pairs = pd.DataFrame({'group': group_codes[valid], 'value': value_codes[valid]})
+    counts = pairs.groupby(['group', 'value']).size().sort_values(ascending = False, kind = 'mergesort')
+    best = counts.reset_index().drop_duplicates('group').set_index('group')['value']
+    row_best = pd.Series(group_codes).map(best).to_numpy()
+    has_mode = ~np.isnan(row_best)
+    fill = np.empty(len(df), dtype = object)
+    fill[:] = None
+    fill[has_mode] = values.take(row_best[has_mode].astype(np.int64))
+    return pd.Series(fill, index = df.index)
+
+
+def predictor_matrix(df, feature, predictors):
+    # The other numerical features as a float matrix, their nulls set to the column means
+    values = df[[col for col in predictors if col != feature]].to_numpy(dtype = np.float64)
+    means = np.nanmean(values, axis = 0) if values.size else np.zeros(values.shape[1])
+    means = np.where(np.isnan(means), 0, means)
+    return np.where(np.isnan(values), means, values)
+
+
+def knn_fill(df, feature, predictors, n_neighbors = 5, random_state = 0):
+    # Fill values of the null rows of feature, the mean of the feature over the n_neighbors closest complete rows
+    X = predictor_matrix(df, feature, predictors)
+    scale = X.std(axis = 0)
+    X = (X - X.mean(axis = 0)) / np.where(scale > 0, scale, 1)
+    y = df[feature].to_numpy(dtype = np.float64)
+    missing = np.isnan(y)
+    known = np.flatnonzero(~missing)
+    if len(known) > knn_max_reference_rows:
+        known = np.random.RandomState(random_state).choice(known, knn_max_reference_rows, replace = False)
+    Model = neighbors.KNeighborsRegressor(n_neighbors = min(n_neighbors, len(known)))
+    Model.fit(X[known], y[known])
+    return Model.predict(X[missing])
+
+
+def regression_fill(X, y, missing):
+    # One step of the iterative strategy : a BayesianRidge fitted on the rows where y is known predicts the missing ones
+    Model = linear_model.BayesianRidge()
+    Model.fit(X[~missing], y[~missing])
+    return Model.predict(X[missing])
+
+
+def plain_value(value):
+    # numpy scalars as python ones, so fill records can be written to json
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def fill_record(strategy, value):
+    '''
+    What a feature was filled with, in a form which can be saved with a model and applied to new rows (ModelArtifact.encode) :
+    the strategy and the value filling every null. The group strategies also keep 'by' and the value of every group as
+    [group, value] pairs, value then only fills the rows of unknown groups. knn and iterative keep the mean of the feature,
+    new rows have no reference rows to learn from.
+    '''
+    return {'strategy': strategy, 'value': plain_value(value)}
+
+
+class Imputer:
+    def __init__(self, df, n_jobs = None):
+        '''
+        Imputer fills the nulls of several features of df at once, in place.
+        Plain statistics (mean, median, mode, constant) are computed for all their features in one pass per dtype group
+        and written with a single df.fillna call, group statistics with one groupby per grouping column, and the knn and
+        iterative strategies (numerical features only) fit one model per feature on a pool of n_jobs threads.
+        Features with no value to learn from (only nulls, or only nulls in their group) fall back to their plain statistic,
+        and so do knn and iterative features when they are the only numerical feature of df.
+
+        Example
+        =========
+        >>> Imputer(df).fill({'Age': ('group median', {'by': 'Pclass'}), 'Embarked': ('mode', {}), 'Fare': ('knn', {'n_neighbors': 10})})
+        '''
+        self.df = df
+        self.n_jobs = n_jobs or imputation_workers
+
+
+    def fill(self, plan):
+        '''
+        plan:- dict of feature --> (strategy, options), options being a dict :
+        'value' for 'constant', 'by' (the grouping feature) for the group strategies, 'n_neighbors' for 'knn'.
+        Returns the list of filled features. What each feature was filled with is left in self.record (see fill_record).
+        '''
+        df = self.df
+        self.record = dict()
+        numerical = [col for col in df.columns if not is_categorical(df.dtypes[col]) and pd.api.types.is_numeric_dtype(df.dtypes[col])]
+        by_strategy = dict()
+        for feature, (strategy, options) in plan.items():
+            if strategy in ('knn', 'iterative') and is_categorical(df.dtypes[feature]):
+                raise ValueError(strategy + " can only fill numerical features, " + str(feature) + " is categorical")
+            if strategy in ('knn', 'iterative') and numerical == [feature]:
+                strategy = 'mean'  # no other numerical feature to learn from
+            by_strategy.setdefault(strategy, []).append(feature)
+
+        fill_values = dict()
+
+        # Model based strategies first, they learn from the other features before any of them is filled
+        model_fills = self.model_fills(by_strategy.get('knn', []), by_strategy.get('iterative', []), plan, numerical)
+
+        for statistic in ('mean', 'median'):
+            features = by_strategy.get(statistic, [])
+            if features != []:
+                fill_values.update(getattr(df[features], statistic)().to_dict())  # one reduction over the whole dtype block
+        for feature in by_strategy.get('mode', []):
+            fill_values[feature] = series_mode(df[feature])
+        for feature in by_strategy.get('constant', []):
+            fill_values[feature] = plan[feature][1].get('value')
+
+        group_fills = dict()
+        for strategy in ('group mean', 'group median', 'group mode'):
+            statistic = strategy.split()[1]
+            features_by = dict()
+            for feature in by_strategy.get(strategy, []):
+                features_by.setdefault(plan[feature][1]['by'], []).append(feature)
+            for by, features in features_by.items():
+                if statistic != 'mode':
+                    # All the features grouped by the same feature share one groupby
+                    group_fills.update(df.groupby(by, sort = False, observed = True)[features].transform(statistic).items())
+                else:
+                    for feature in features:
+                        group_fills[feature] = group_mode(df, feature, by)
+
+        for feature, values in model_fills.items():
+            group_fills[feature] = values
+        for feature, values in group_fills.items():
+            # What's left null after the group / model fill (a null group for example) gets the plain statistic
+            strategy = plan[feature][0]
+            if strategy == 'group mode':
+                fallback = series_mode(df[feature])
+            elif strategy == 'group median':
+                fallback = df[feature].median()
+            else:
+                fallback = df[feature].mean()
+            self.record[feature] = fill_record(strategy, fallback)
+            if strategy.startswith('group'):
+                by = plan[feature][1]['by']
+                groups = values.groupby(df[by], sort = False, observed = True).first()
+                self.record[feature].update(by = by, groups = [[plain_value(key), plain_value(value)] for key, value in groups.items()])
+            fill_values[feature] = values if fallback is None else values.fillna(fallback)
+
+        for feature, value in fill_values.items():
+            if feature not in self.record:
+                self.record[feature] = fill_record(plan[feature][0], value)
+        for feature, value in list(fill_values.items()):
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                del fill_values[feature]  # a feature holding only nulls has nothing to be filled with
+            elif str(df.dtypes[feature]) == 'category' and np.isscalar(value) and value not in df[feature].cat.categories:
+                df[feature] = df[feature].cat.add_categories([value])
+        if fill_values != {}:
+            # A single call, every column is filled in place with its scalar or per row Series
+            df.fillna(value = fill_values, inplace = True)
+        return list(plan)
+
+
+    def model_fills(self, knn_features, iterative_features, plan, numerical):
+        # Per row fill values (a Series with the predictions at the null rows) of the knn and iterative features
+        df = self.df
+        fills = dict()
+        if knn_features == [] and iterative_features == []:
+            return fills
+
+        with ThreadPoolExecutor(max_workers = self.n_jobs) as executor:
+            # knn : every feature is independent, they all run at the same time
+            futures = dict()
+            for feature in knn_features:
+                if df[feature].notnull().any():
+                    futures[feature] = executor.submit(knn_fill, df, feature, numerical, plan[feature][1].get('n_neighbors', 5))
+            for feature, future in futures.items():
+                fills[feature] = self.as_series(feature, future.result())
+
+            # iterative : every round fits one model per feature in parallel, on the values predicted by the previous round
+            iterative_features = [feature for feature in iterative_features if df[feature].notnull().any()]
+            if iterative_features != []:
+                missing = {feature: df[feature].isnull().to_numpy() for feature in iterative_features}
+                current = df[numerical].astype(np.float64)
+                for _ in range(iterative_rounds):
+                    futures = dict()
+                    for feature in iterative_features:
+                        X = predictor_matrix(current, feature, numerical)
+                        futures[feature] = executor.submit(regression_fill, X, current[feature].to_numpy(), missing[feature])
+                    for feature, future in futures.items():
+                        values = current[feature].to_numpy().copy()
+                        values[missing[feature]] = future.result()
+                        current[feature] = values
+                for feature in iterative_features:
+                    fills[feature] = self.as_series(feature, current[feature].to_numpy()[missing[feature]])
+        return fills
+
+
+    def as_series(self, feature, predictions):
+        # Predictions for the null rows of feature as a Series over every row (NaN where the feature has a value)
+        missing = self.df[feature].isnull().to_numpy()
+        values = np.full(len(missing), np.nan)
+        values[missing] = predictions
+        return pd.Series(values, index = self.df.index)
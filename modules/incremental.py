@@ -0,0 +1,388 @@
+''' Out-of-core training for csv files which don't fit in memory.
+
+    The file is read in chunks, never as a whole. A first pass builds the encoding schema
+    (categories, scaling statistics and classes), then the model is trained chunk by chunk :
+    SGD and naive bayes models through partial_fit, xgboost from a libsvm copy of the data
+    read through its external memory mode. A holdout made of a fixed share of the rows is
+    left out of training and scored in a last pass.
+
+    This mode is only reached from the command line, the pages of the app don't offer it : streamlit's
+    file_uploader holds the whole upload in memory, so a file which only fits on disk can't come from there,
+    and everything the pages do after the upload works on the loaded DataFrame. Models saved with --save
+    are scored like the ones saved from the Model Building page (modules/batch_score.py).
+
+    Usage
+    -----
+    python -m modules.incremental data.csv --target SalePrice --model SGDRegressor
+    python -m modules.incremental data.csv --target Survived --model XGBClassifier --chunksize 50000 --holdout 0.1
+    python -m modules.incremental data.csv --target Survived --model SGDClassifier --epochs 3 --json result.json
+    python -m modules.incremental data.csv --target Survived --model SGDClassifier --save survived    # for modules/batch_score.py
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from modules.dataset_profile import is_categorical
+from modules.encoding import encode_with_schema, schema_feature_names, to_dense
+from modules.lazy_loader import lazy_import
+from modules.models import model_maker, sparse_input_models, metrics_cls, metrics_reg
+
+xgboost = lazy_import("xgboost")
+sklearn_datasets = lazy_import("sklearn.datasets")
+sklearn_preprocessing = lazy_import("sklearn.preprocessing")
+
+
+# Models which can be trained on a streamed dataset --> model name : problem type
+incremental_models = {
+    'SGDRegressor': 'Regression',
+    'SGDClassifier': 'Classification',
+    'MultinomialNB': 'Classification',
+    'GaussianNB': 'Classification',
+    'XGBRegressor': 'Regression',
+    'XGBClassifier': 'Classification',
+}
+
+
+def plain(values):
+    # numpy scalars --> python ones, so that the schema can be written as json
+    return [value.item() if isinstance(value, np.generic) else value for value in values]
+
+
+def sorted_values(values):
+    try:
+        return sorted(values)
+    except TypeError:  # mixed types in the same column
+        return sorted(values, key = str)
+
+
+def read_chunks(path, chunksize):
+    # Yields (position of the first row of the chunk in the file, chunk)
+    first_row = 0
+    for chunk in pd.read_csv(path, chunksize = chunksize):
+        yield first_row, chunk
+        first_row += len(chunk)
+
+
+def holdout_mask(first_row, n_rows, fraction, seed = 0):
+    # A row goes to the holdout according to a hash of its position, so every pass picks the same rows whatever the chunk size
+    rows = np.arange(first_row, first_row + n_rows, dtype = np.uint64) + np.uint64(seed)
+    hashed = (rows * np.uint64(2654435761)) % np.uint64(2 ** 32)
+    return hashed < np.uint64(int(fraction * 2 ** 32))
+
+
+def split_chunk(first_row, chunk, schema):
+    # Returns the training rows and the holdout rows of chunk, rows without a target are left out of both
+    target = schema['target']
+    if schema['problem'] == 'Regression':
+        chunk[target] = pd.to_numeric(chunk[target], errors = 'coerce')
+    has_target = chunk[target].notnull().to_numpy()
+    holdout = holdout_mask(first_row, len(chunk), schema['holdout'], schema['seed'])
+    return chunk[has_target & ~holdout], chunk[has_target & holdout]
+
+
+def numerical_values(chunk, columns):
+    # Non numeric leftovers in a numerical feature (like "?") become nulls instead of breaking the chunk
+    if columns == []:
+        return np.empty((len(chunk), 0))
+    return np.column_stack([pd.to_numeric(chunk[col], errors = 'coerce').to_numpy(dtype = np.float64) for col in columns])
+
+
+def scan_dataset(path, target_feature, problem, chunksize = 100000, holdout = 0.2, seed = 0, max_categories = 10000, progress_callback = None):
+    '''
+    First pass over the csv file at path, returns the schema used to encode every chunk of it.
+    Whether a feature is categorical is decided on the first chunk. Categorical features with more than
+    max_categories categories are left out of the features (listed under 'dropped'), numerical ones are
+    standardized with the mean and scale of the training rows.
+    holdout:- fraction of the rows kept out of training for evaluation.
+
+    Example
+    =========
+    >>> schema = scan_dataset("train.csv", "SalePrice", "Regression")
+    >>> schema['rows'], schema['holdout_rows']
+    >>> (1000000, 200112)
+    '''
+    schema = {'target': target_feature, 'problem': problem, 'holdout': holdout, 'seed': seed, 'chunksize': chunksize}
+    numerical = None
+    categories = {}
+    dropped = []
+    scaler = sklearn_preprocessing.StandardScaler()
+    minimum = None
+    classes = set()
+    rows = holdout_rows = 0
+
+    for first_row, chunk in read_chunks(path, chunksize):
+        if numerical is None:
+            features = [col for col in chunk.columns if col != target_feature]
+            numerical = [col for col in features if not is_categorical(chunk.dtypes[col])]
+            categories = {col: set() for col in features if is_categorical(chunk.dtypes[col])}
+
+        train, test = split_chunk(first_row, chunk, schema)
+        rows += len(train) + len(test)
+        holdout_rows += len(test)
+        if problem == 'Classification':
+            classes.update(chunk[target_feature].dropna().unique())
+        if len(train) == 0:
+            continue
+
+        for col in list(categories):
+            categories[col].update(train[col].dropna().unique())
+            if len(categories[col]) > max_categories:
+                del categories[col]
+                dropped.append(col)
+
+        values = numerical_values(train, numerical)
+        if values.shape[1] != 0:
+            scaler.partial_fit(values)
+            chunk_minimum = np.where(np.isnan(values), np.inf, values).min(axis = 0)
+            minimum = chunk_minimum if minimum is None else np.minimum(minimum, chunk_minimum)
+
+        if progress_callback is not None:
+            progress_callback('scan', rows)
+
+    if numerical is None:
+        raise ValueError(path + " has no rows")
+
+    categorical = {col: plain(sorted_values(values)) for col, values in categories.items()}
+    schema.update({
+        'numerical': numerical,
+        'categorical': categorical,
+        'feature_names': schema_feature_names(numerical, categorical),
+        'dropped': dropped,
+        'mean': plain(np.nan_to_num(scaler.mean_)) if numerical != [] and minimum is not None else [0.0] * len(numerical),
+        'scale': plain(np.nan_to_num(scaler.scale_, nan = 1.0)) if numerical != [] and minimum is not None else [1.0] * len(numerical),
+        'minimum': plain(np.where(np.isinf(minimum), 0.0, minimum)) if minimum is not None else [0.0] * len(numerical),
+        'classes': plain(sorted_values(classes)),
+        'rows': rows,
+        'holdout_rows': holdout_rows,
+    })
+    return schema
+
+
+def encode_features(chunk, schema, scale = True):
+    '''
+    Encodes the features of chunk with the schema from scan_dataset into a CSR matrix, chunk doesn't need the target.
+    Numerical features are standardized when scale is True, nulls are replaced by 0 (the mean once standardized).
+    '''
+    values = numerical_values(chunk, schema['numerical'])
+    if scale:
+        values = (values - np.asarray(schema['mean'])) / np.asarray(schema['scale'])
+    values[np.isnan(values)] = 0.0
+
+    frame = pd.DataFrame(values, columns = schema['numerical'], index = chunk.index)
+    for col in schema['categorical']:
+        frame[col] = chunk[col]
+    return encode_with_schema(frame, schema)
+
+
+def stream(path, schema, part = 'train', scale = True, shuffle_seed = None):
+    '''
+    Yields the encoded (X, y) of every chunk of the file, only the rows of part ('train' or 'holdout').
+    shuffle_seed:- rows of every chunk are shuffled with it when given, SGD models learn badly from sorted data.
+    '''
+    for first_row, chunk in read_chunks(path, schema['chunksize']):
+        train, test = split_chunk(first_row, chunk, schema)
+        rows = train if part == 'train' else test
+        if len(rows) == 0:
+            continue
+        if shuffle_seed is not None:
+            rows = rows.sample(frac = 1, random_state = (shuffle_seed + first_row) % 2 ** 32)
+        yield encode_features(rows, schema, scale), rows[schema['target']].to_numpy()
+
+
+class BoosterModel:
+    def __init__(self, booster, problem, classes, n_features):
+        '''
+        BoosterModel gives a booster trained from external memory the predict method of the other models.
+        n_features:- number of columns the booster was trained on, libsvm files don't record trailing all zero columns.
+        '''
+        self.booster = booster
+        self.problem = problem
+        self.classes = classes
+        self.n_features = n_features
+
+    def predict(self, X):
+        y_pred = self.booster.predict(xgboost.DMatrix(X[:, :self.n_features]))
+        if self.problem == 'Regression':
+            return y_pred
+        if y_pred.ndim == 2:
+            codes = y_pred.argmax(axis = 1)
+        else:
+            codes = (y_pred > 0.5).astype(np.int64)
+        return np.asarray(self.classes)[codes]
+
+
+def train_xgboost_external(path, schema, model_name, params, progress_callback = None):
+    '''
+    Writes the training rows to a libsvm file chunk by chunk and trains on it with xgboost's external memory mode,
+    where the data is paged from a cache file next to it instead of being loaded in memory.
+    '''
+    problem = incremental_models[model_name]
+    params = dict(params)
+    num_boost_round = params.pop('n_estimators', 100)
+    xgb_params = {'tree_method': 'approx', 'nthread': os.cpu_count() or 1}
+    if problem == 'Regression':
+        xgb_params['objective'] = 'reg:squarederror'
+    elif len(schema['classes']) > 2:
+        xgb_params.update({'objective': 'multi:softprob', 'num_class': len(schema['classes'])})
+    else:
+        xgb_params['objective'] = 'binary:logistic'
+    xgb_params.update(params)
+
+    class_codes = pd.Index(schema['classes'])
+    work_dir = tempfile.mkdtemp(prefix = "ml_automator_xgb_")
+    try:
+        libsvm_path = os.path.join(work_dir, "train.libsvm")
+        rows = 0
+        with open(libsvm_path, "wb") as libsvm_file:
+            for X, y in stream(path, schema, 'train'):
+                if problem == 'Classification':
+                    y = class_codes.get_indexer(y)
+                sklearn_datasets.dump_svmlight_file(X, y, libsvm_file, zero_based = True)
+                rows += X.shape[0]
+                if progress_callback is not None:
+                    progress_callback('libsvm', rows)
+
+        # The "#" suffix turns on external memory, pages of the data are cached in dtrain.cache
+        dtrain = xgboost.DMatrix(libsvm_path + "?format=libsvm#" + os.path.join(work_dir, "dtrain.cache"))
+        booster = xgboost.train(xgb_params, dtrain, num_boost_round = num_boost_round)
+        n_features = dtrain.num_col()
+        del dtrain
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    return BoosterModel(booster, problem, schema['classes'], n_features)
+
+
+def evaluate(Model, path, schema, scale = True, dense = False):
+    # Metrics of Model on the holdout rows, predicted chunk by chunk
+    y_test, y_pred = [], []
+    for X, y in stream(path, schema, 'holdout', scale):
+        y_test.append(y)
+        y_pred.append(Model.predict(to_dense(X) if dense else X))
+    if y_test == []:
+        return {}
+
+    y_test, y_pred = np.concatenate(y_test), np.concatenate(y_pred)
+    if schema['problem'] == 'Regression':
+        return metrics_reg(y_test, y_pred)
+    return metrics_cls(y_test, y_pred)
+
+
+def train_incremental(path, target_feature, model_name, chunksize = 100000, holdout = 0.2, epochs = 1, seed = 0,
+                      model_params = None, schema = None, progress_callback = None):
+    '''
+    Trains model_name on the csv file at path without ever loading the whole file.
+    epochs:- number of passes over the training rows, for the partial_fit models.
+    model_params:- hyperparameters overriding the defaults of models_mapper (for xgboost, the parameters of xgboost.train).
+    schema:- result of an earlier scan_dataset on the same file, to skip the first pass.
+    progress_callback:- optional function called as progress_callback(stage, rows_done) after every chunk.
+    Returns the fitted model, the holdout metrics and the schema.
+
+    Example
+    =========
+    >>> Model, metrics, schema = train_incremental("train.csv", "Survived", "SGDClassifier", epochs = 3)
+    >>> metrics
+    >>> {'Accuracy Score': 0.79, 'F1 Score': 0.79, 'ROC AUC Score': 0.77}
+    '''
+    if model_name not in incremental_models:
+        raise ValueError(model_name + " can't be trained incrementally, choose one of " + ", ".join(incremental_models))
+    problem = incremental_models[model_name]
+    model_params = model_params or dict()
+
+    if schema is None:
+        schema = scan_dataset(path, target_feature, problem, chunksize, holdout, seed, progress_callback = progress_callback)
+
+    # MultinomialNB works on counts, the features are given to it as they are and must not be negative
+    scale = model_name != 'MultinomialNB'
+    if not scale:
+        negative = [col for col, minimum in zip(schema['numerical'], schema['minimum']) if minimum < 0]
+        if negative != []:
+            raise ValueError("MultinomialNB needs non negative features, these have negative values : " + ", ".join(map(str, negative)))
+
+    dense = model_name not in sparse_input_models
+    if model_name.startswith('XGB'):
+        Model = train_xgboost_external(path, schema, model_name, model_params, progress_callback)
+        dense = False
+    else:
+        Model = model_maker(model_name, **model_params)
+        classes = np.asarray(schema['classes'])
+        for epoch in range(epochs):
+            rows = 0
+            for X, y in stream(path, schema, 'train', scale, shuffle_seed = seed + epoch):
+                if dense:
+                    X = to_dense(X)
+                if problem == 'Classification':
+                    Model.partial_fit(X, y, classes = classes)
+                else:
+                    Model.partial_fit(X, y)
+                rows += X.shape[0]
+                if progress_callback is not None:
+                    progress_callback('epoch ' + str(epoch + 1), rows)
+
+    metrics = evaluate(Model, path, schema, scale, dense)
+    return Model, metrics, schema
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Train a model on a csv file read in chunks")
+    parser.add_argument("path", help = "csv file to train on")
+    parser.add_argument("--target", required = True, help = "target feature")
+    parser.add_argument("--model", required = True, choices = list(incremental_models))
+    parser.add_argument("--chunksize", type = int, default = 100000, help = "rows read at a time")
+    parser.add_argument("--holdout", type = float, default = 0.2, help = "fraction of the rows used for evaluation")
+    parser.add_argument("--epochs", type = int, default = 1, help = "passes over the training rows (partial_fit models)")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--param", action = "append", default = [], metavar = "NAME=VALUE",
+                        help = "hyperparameter of the model, VALUE is read as json when possible")
+    parser.add_argument("--json", help = "also write the metrics and the schema to this file")
+    parser.add_argument("--save", metavar = "NAME", help = "save the trained model under NAME, for modules/batch_score.py")
+    args = parser.parse_args(argv)
+
+    model_params = {}
+    for param in args.param:
+        name, value = param.split("=", 1)
+        try:
+            model_params[name] = json.loads(value)
+        except ValueError:
+            model_params[name] = value
+
+    def progress(stage, rows):
+        sys.stderr.write("\r" + stage + " : " + str(rows) + " rows   ")
+        sys.stderr.flush()
+
+    start = time.time()
+    try:
+        Model, metrics, schema = train_incremental(args.path, args.target, args.model, args.chunksize, args.holdout,
+                                                   args.epochs, args.seed, model_params, progress_callback = progress)
+    except ValueError as err:
+        sys.stderr.write("\n")
+        parser.error(str(err))
+    seconds = time.time() - start
+    sys.stderr.write("\n")
+
+    print(args.model + " trained on " + str(schema['rows'] - schema['holdout_rows']) + " rows in " + str(round(seconds, 2)) + " s")
+    if schema['dropped'] != []:
+        print("Left out (too many categories) : " + ", ".join(map(str, schema['dropped'])))
+    for metric_name, value in metrics.items():
+        print(metric_name + " on " + str(schema['holdout_rows']) + " holdout rows : " + str(value))
+
+    if args.save:
+        from modules.model_store import save_model
+        version = save_model(args.save, Model, args.model, incremental_models[args.model], schema, metrics,
+                             encoder = 'incremental', standardize = args.model != 'MultinomialNB')
+        print("Saved as " + args.save + " " + version)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"model": args.model, "seconds": seconds, "metrics": metrics, "schema": schema}, json_file, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
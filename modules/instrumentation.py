@@ -0,0 +1,201 @@
+''' Per-rerun performance instrumentation.
+
+    Every rerun of main_app.py is recorded as a timeline of stages (page, sections of Home / EDA / Model Building,
+    session state sync), each with its duration and the change of the process memory while it ran.
+    Turned on with ML_AUTOMATOR_INSTRUMENT=1, otherwise stage() hands back a shared no-op context manager
+    and nothing is measured or stored.
+
+    ML_AUTOMATOR_INSTRUMENT_MEMORY=1 also traces Python allocations with tracemalloc (slower, and process wide :
+    the allocations of other sessions running at the same time are counted too).
+    ML_AUTOMATOR_INSTRUMENT_FILE=path appends every finished rerun to path as one json line, for offline analysis.
+'''
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+from modules.lazy_loader import lazy_import
+
+go = lazy_import("plotly.graph_objects")
+
+instrumentation_enabled = os.environ.get("ML_AUTOMATOR_INSTRUMENT", "0") == "1"
+trace_allocations = instrumentation_enabled and os.environ.get("ML_AUTOMATOR_INSTRUMENT_MEMORY", "0") == "1"
+instrumentation_file = os.environ.get("ML_AUTOMATOR_INSTRUMENT_FILE")
+reruns_kept = 50  # finished reruns kept per session for the sidebar and the json export
+
+logger = logging.getLogger(__name__)
+
+
+def resident_megabytes():
+    # Resident memory of the process, read from /proc where it is cheap, None elsewhere
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def traced_megabytes():
+    return tracemalloc.get_traced_memory()[0] / 1024 ** 2 if tracemalloc.is_tracing() else None
+
+
+def difference(after, before):
+    return None if after is None or before is None else after - before
+
+
+class DisabledStage:
+    # What stage() returns when instrumentation is off, entering and leaving it does nothing
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+disabled_stage = DisabledStage()
+
+
+class Stage:
+    def __init__(self, timeline, name):
+        self.timeline = timeline
+        self.name = name
+
+    def __enter__(self):
+        self.depth = len(self.timeline.open_stages)
+        self.timeline.open_stages.append(self.name)
+        self.rss = resident_megabytes()
+        self.traced = traced_megabytes()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        self.timeline.open_stages.pop()
+        self.timeline.stages.append({
+            'name': self.name,
+            'depth': self.depth,
+            'start': self.start - self.timeline.started,
+            'seconds': seconds,
+            'rss_delta_mb': difference(resident_megabytes(), self.rss),
+            'traced_delta_mb': difference(traced_megabytes(), self.traced),
+            'interrupted': exc_type is not None,  # Streamlit stops a rerun by raising inside it
+        })
+        return False
+
+
+class RerunTimeline:
+    def __init__(self, session_id, page):
+        '''
+        RerunTimeline holds the stages of one rerun of one session, in the order they finished.
+        Use begin_rerun / stage / end_rerun rather than building one directly.
+        '''
+        self.session_id = str(session_id)
+        self.page = page
+        self.wall_time = time.time()
+        self.started = time.perf_counter()
+        self.open_stages = []
+        self.stages = []
+        self.rss = resident_megabytes()
+        self.seconds = None
+
+
+    def as_dict(self):
+        return {
+            'session_id': self.session_id,
+            'page': self.page,
+            'time': self.wall_time,
+            'seconds': self.seconds,
+            'rss_mb': self.rss,
+            'stages': sorted(self.stages, key = lambda stage: stage['start']),
+        }
+
+
+current = threading.local()  # every session runs its script on its own thread
+session_reruns = dict()
+session_reruns_lock = threading.Lock()
+
+
+def begin_rerun(session_id, page = None):
+    # Starts the timeline of the rerun running on this thread, a rerun stopped before end_rerun is dropped
+    if not instrumentation_enabled:
+        return
+    if trace_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    current.timeline = RerunTimeline(session_id, page)
+
+
+def stage(name):
+    '''
+    Context manager timing the block under it as a stage of the current rerun. Stages can be nested.
+
+    Example
+    =========
+    >>> with stage("Home : heatmap of null values"):
+    >>>     plot = heatmap_generator(df)
+    '''
+    timeline = getattr(current, 'timeline', None) if instrumentation_enabled else None
+    if timeline is None:
+        return disabled_stage
+    return Stage(timeline, name)
+
+
+def set_page(page):
+    timeline = getattr(current, 'timeline', None) if instrumentation_enabled else None
+    if timeline is not None:
+        timeline.page = page
+
+
+def end_rerun(**extra):
+    '''
+    Closes the timeline of the current rerun, keeps it in the history of its session and writes it to the log
+    (and to instrumentation_file when set). Returns its dict, None when instrumentation is off.
+    extra:- more json friendly values stored with the rerun.
+
+    Example
+    =========
+    >>> end_rerun(session_sync = session_state.sync_stats())
+    '''
+    timeline = getattr(current, 'timeline', None) if instrumentation_enabled else None
+    if timeline is None:
+        return None
+    current.timeline = None
+    timeline.seconds = time.perf_counter() - timeline.started
+    record = timeline.as_dict()
+    record.update(extra)
+
+    with session_reruns_lock:
+        session_reruns.setdefault(timeline.session_id, deque(maxlen = reruns_kept)).append(record)
+    line = json.dumps(record)
+    logger.debug("rerun timeline %s", line)
+    if instrumentation_file:
+        with session_reruns_lock:
+            with open(instrumentation_file, "a") as log_file:
+                log_file.write(line + "\n")
+    return record
+
+
+def rerun_history(session_id):
+    # Finished reruns of session_id, oldest first
+    with session_reruns_lock:
+        return list(session_reruns.get(str(session_id), []))
+
+
+def export_json(session_id):
+    return json.dumps({'session_id': str(session_id), 'reruns': rerun_history(session_id)}, indent = 2)
+
+
+def timeline_figure(record):
+    # Horizontal bars, one per stage, starting where the stage started in the rerun
+    stages = record['stages']
+    labels = ["  " * item['depth'] + item['name'] for item in stages]
+    fig = go.Figure(go.Bar(
+        y = labels, x = [item['seconds'] for item in stages], base = [item['start'] for item in stages], orientation = 'h',
+        hovertext = ["{:.1f} ms, memory {:+.1f} MB".format(item['seconds'] * 1000, item['rss_delta_mb'] or 0) for item in stages],
+    ))
+    fig.update_layout(yaxis = dict(autorange = 'reversed'), xaxis_title = "seconds into the rerun",
+                      height = 120 + 22 * len(stages), margin = dict(l = 10, r = 10, t = 30, b = 10),
+                      title = "{} : {:.0f} ms".format(record['page'], record['seconds'] * 1000))
+    return fig
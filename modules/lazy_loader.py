@@ -0,0 +1,37 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    '''
+    LazyModule stands in for a module and only imports it the first time one of its attributes is used.
+    It lets heavy libraries (sklearn, xgboost, plotly) stay out of the startup path of pages which never touch them.
+
+    Example
+    =========
+    >>> px = LazyModule("plotly.express")    # nothing is imported yet
+    >>> px.pie(df, values = 'Count')         # plotly.express gets imported here
+    '''
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        if self.__dict__["_module"] is None:
+            self.__dict__["_module"] = importlib.import_module(self.__name__)
+        return self.__dict__["_module"]
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+def import_object(module_name, object_name):
+    # Imports and returns a single object, for example import_object("sklearn.svm", "SVR")
+    return getattr(importlib.import_module(module_name), object_name)
@@ -0,0 +1,170 @@
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from modules.encoding import encode_with_schema, to_dense
+from modules.lazy_loader import lazy_import
+from modules.models import sparse_input_models
+
+joblib = lazy_import("joblib")
+
+
+model_directory = os.environ.get("ML_AUTOMATOR_MODEL_DIR", "saved_models")
+missing_value_models = ['XGBClassifier', 'XGBRegressor']  # models which take nulls in their numerical input as they are
+
+
+class ModelArtifact:
+    def __init__(self, path):
+        '''
+        ModelArtifact is a saved model loaded back from path : the fitted estimator, the label encoder of the target
+        (None when the target was numerical) and meta, the json part holding the encoding schema, the metrics and
+        the fills (what the nulls of the training data were filled with on the Home page).
+        predict fills and encodes raw rows exactly like the data the model was trained on.
+
+        Example
+        =========
+        >>> artifact = load_model("titanic")
+        >>> artifact.predict(pd.read_csv("test.csv"))
+        '''
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            self.meta = json.load(meta_file)
+        blob = joblib.load(os.path.join(path, "model.joblib"))
+        self.model = blob['model']
+        self.label_encoder = blob['label_encoder']
+
+
+    def input_columns(self):
+        schema = self.meta['schema']
+        return list(schema['numerical']) + list(schema['categorical'])
+
+
+    def fill_missing(self, df):
+        # Fills the nulls of df with the recorded fills, df itself is left untouched
+        filled = None
+        for feature, record in self.meta.get('fills', {}).items():
+            if feature not in df.columns or not df[feature].isnull().any():
+                continue
+            if filled is None:
+                filled = df.copy()
+            series = filled[feature]
+            if str(series.dtype) == 'category':
+                series = series.astype(object)
+            if 'by' in record and record['by'] in filled.columns:
+                series = series.fillna(filled[record['by']].map(dict((key, value) for key, value in record['groups'])))
+            if record['value'] is not None:
+                series = series.fillna(record['value'])
+            filled[feature] = series
+        return df if filled is None else filled
+
+
+    def encode(self, df):
+        schema = self.meta['schema']
+        df = self.fill_missing(df)
+        if self.meta['encoder'] != 'incremental' and self.meta['model_name'] not in missing_value_models:
+            null_columns = [col for col in schema['numerical'] if col in df.columns and df[col].isnull().any()]
+            if null_columns != []:
+                raise ValueError(self.meta['model_name'] + " can't score rows with missing values, and no fill was recorded for "
+                                 + ", ".join(map(str, null_columns)) + " when it was trained : fill them before scoring")
+        if self.meta['encoder'] == 'incremental':
+            from modules.incremental import encode_features
+            X = encode_features(df, schema, self.meta['standardize'])
+        else:
+            X = encode_with_schema(df, schema)
+        if self.meta['model_name'] not in sparse_input_models:
+            X = to_dense(X)
+        return X
+
+
+    def predict(self, df):
+        y_pred = self.model.predict(self.encode(df))
+        if self.label_encoder is not None:
+            y_pred = self.label_encoder.inverse_transform(y_pred.astype(int))
+        return y_pred
+
+
+def model_path(name, version = None):
+    if version is None:
+        return os.path.join(model_directory, name)
+    return os.path.join(model_directory, name, version)
+
+
+def list_versions(name):
+    # Versions of the saved model name, oldest first --> ['v1', 'v2', ...]
+    if not os.path.isdir(model_path(name)):
+        return []
+    versions = [version for version in os.listdir(model_path(name)) if re.fullmatch(r"v\d+", version)]
+    return sorted(versions, key = lambda version: int(version[1:]))
+
+
+def list_models():
+    if not os.path.isdir(model_directory):
+        return []
+    return sorted(name for name in os.listdir(model_directory) if list_versions(name) != [])
+
+
+def save_model(name, Model, model_name, problem, schema, metrics = None, label_encoder = None, encoder = 'one_hot', standardize = False,
+               fills = None):
+    '''
+    Saves a fitted model as the next version of name (v1, v2, ...) and returns the version.
+    The estimator and the label encoder go to model.joblib, everything else to meta.json.
+    schema:- encoding schema the model was trained with (modules/encoding.py or modules/incremental.py).
+    encoder:- 'one_hot' for a schema from fit_encoding_schema, 'incremental' for one from scan_dataset.
+    standardize:- whether the numerical features were standardized (incremental models only).
+    fills:- what the nulls of the training data were filled with, feature --> fill record (modules/imputation.py), df.attrs['fills'] of the dataset.
+
+    Example
+    =========
+    >>> save_model("titanic", model_object.fitted_models['XGBClassifier'], 'XGBClassifier', 'Classification', schema, model_object.metrics['XGBClassifier'], label_encoder_obj)
+    >>> 'v3'
+    '''
+    if not re.fullmatch(r"[\w.-]+", name):
+        raise ValueError("Model names can only use letters, digits, '_', '-' and '.'")
+    os.makedirs(model_path(name), exist_ok = True)
+
+    # Written in a temporary directory renamed at the end, so a version directory is either complete or absent
+    temp_path = model_path(name, "." + uuid.uuid4().hex + ".tmp")
+    os.makedirs(temp_path)
+    try:
+        joblib.dump({'model': Model, 'label_encoder': label_encoder}, os.path.join(temp_path, "model.joblib"))
+        meta = {
+            'name': name,
+            'model_name': model_name,
+            'problem': problem,
+            'schema': schema,
+            'metrics': {metric: (None if value is None else float(value)) for metric, value in (metrics or {}).items()},
+            'classes': None if label_encoder is None else [str(label) for label in label_encoder.classes_],
+            'encoder': encoder,
+            'standardize': standardize,
+            'fills': fills or {},
+            'saved_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+        while True:
+            versions = list_versions(name)
+            version = "v" + str(int(versions[-1][1:]) + 1 if versions != [] else 1)
+            meta['version'] = version
+            with open(os.path.join(temp_path, "meta.json"), "w") as meta_file:
+                json.dump(meta, meta_file, indent = 2, default = str)
+            try:
+                os.rename(temp_path, model_path(name, version))
+                return version
+            except OSError:
+                if not os.path.isdir(model_path(name, version)):
+                    raise
+                # Another session saved the same version in the meantime, trying the next one
+    finally:
+        shutil.rmtree(temp_path, ignore_errors = True)
+
+
+def load_model(name, version = None):
+    # Loads a version of name, the latest one when version is None
+    if version is None:
+        versions = list_versions(name)
+        if versions == []:
+            raise FileNotFoundError("No saved model named " + name + " in " + model_directory)
+        version = versions[-1]
+    return ModelArtifact(model_path(name, version))
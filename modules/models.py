@@ -1,68 +1,166 @@
-from sklearn.naive_bayes import MultinomialNB, GaussianNB
-from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
-from sklearn.linear_model import LinearRegression, LogisticRegression
-from sklearn.svm import SVC, SVR
-from sklearn.neural_network import MLPClassifier, MLPRegressor, multilayer_perceptron
-from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
-from xgboost import XGBClassifier, XGBRegressor
-from sklearn.metrics import accuracy_score, f1_score, roc_auc_score, r2_score, mean_squared_error, mean_squared_log_error
 from streamlit import *
-from sklearn.preprocessing import LabelEncoder
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import os
+import threading
+import numpy as np
+import pandas as pd
+from modules.training_cache import model_fingerprint
+from modules.lazy_loader import lazy_import, import_object
+from modules.encoding import matrix_bytes, dense_bytes, to_dense
+from modules.shared_data import shared_handle, attach
 
+# sklearn and xgboost are only imported when a model is built or scored, not when the app starts
+sklearn_metrics = lazy_import("sklearn.metrics")
+sparse = lazy_import("scipy.sparse")
+model_selection = lazy_import("sklearn.model_selection")
+joblib = lazy_import("joblib")
 
+
+# Registry of the available estimators --> model name : ((module, estimator class name), default hyperparameters)
+# Estimators are never shared, model_maker builds a fresh one for every fit so sessions can train the same model type at the same time
 models_mapper = {
     # Regressors
-    'LinearRegression': LinearRegression(),
-    'RandomForestRegressor': RandomForestRegressor(),
-    'SVR': SVR(),
-    'MLPRegressor': MLPRegressor(),
-    'DecisionTreeRegressor': DecisionTreeRegressor(),
-    'XGBRegressor': XGBRegressor(),
+    'LinearRegression': (('sklearn.linear_model', 'LinearRegression'), {}),
+    'RandomForestRegressor': (('sklearn.ensemble', 'RandomForestRegressor'), {'n_jobs': -1}),
+    'SVR': (('sklearn.svm', 'SVR'), {}),
+    'MLPRegressor': (('sklearn.neural_network', 'MLPRegressor'), {}),
+    'DecisionTreeRegressor': (('sklearn.tree', 'DecisionTreeRegressor'), {}),
+    'XGBRegressor': (('xgboost', 'XGBRegressor'), {'n_jobs': -1}),
 
     #Classifiers
-    'LogisticRegression': LogisticRegression(),
-    'RandomForestClassifier': RandomForestClassifier(),
-    'SVC': SVC(),
-    'MLPClassifier': MLPClassifier(),
-    'DecisionTreeClassifier': DecisionTreeClassifier(),
-    'XGBClassifier': XGBClassifier(),
+    'LogisticRegression': (('sklearn.linear_model', 'LogisticRegression'), {}),
+    'RandomForestClassifier': (('sklearn.ensemble', 'RandomForestClassifier'), {'n_jobs': -1}),
+    'SVC': (('sklearn.svm', 'SVC'), {}),
+    'MLPClassifier': (('sklearn.neural_network', 'MLPClassifier'), {}),
+    'DecisionTreeClassifier': (('sklearn.tree', 'DecisionTreeClassifier'), {}),
+    'XGBClassifier': (('xgboost', 'XGBClassifier'), {'n_jobs': -1}),
+
+    # Incremental models, trained chunk by chunk by modules/incremental.py
+    'SGDRegressor': (('sklearn.linear_model', 'SGDRegressor'), {}),
+    'SGDClassifier': (('sklearn.linear_model', 'SGDClassifier'), {'loss': 'log'}),
+    'MultinomialNB': (('sklearn.naive_bayes', 'MultinomialNB'), {}),
+    'GaussianNB': (('sklearn.naive_bayes', 'GaussianNB'), {}),
 }
+models_mapper_lock = threading.Lock()
 
+# Estimators which are fed the sparse matrix built by modules/encoding.py as it is, any other one gets a dense copy
+sparse_input_models = {
+    'LinearRegression', 'RandomForestRegressor', 'SVR', 'MLPRegressor', 'DecisionTreeRegressor', 'XGBRegressor',
+    'LogisticRegression', 'RandomForestClassifier', 'SVC', 'MLPClassifier', 'DecisionTreeClassifier', 'XGBClassifier',
+    'SGDRegressor', 'SGDClassifier', 'MultinomialNB',
+}
+dense_warning_megabytes = int(os.environ.get("ML_AUTOMATOR_DENSE_WARNING_MB", 512))
 
-def Model_Trainer(Model, model_name, problem, X, y):
+
+def model_maker(model_name, **params):
+    '''
+    Returns a new, unfitted estimator for model_name built with its default hyperparameters,
+    any keyword argument overrides the matching default.
+
+    Example
+    =========
+    >>> model_maker('RandomForestRegressor', n_estimators = 300)
+    '''
+    with models_mapper_lock:
+        Model_path, default_params = models_mapper[model_name]
+        model_params = dict(default_params)
+    model_params.update(params)
+    Model_class = import_object(*Model_path)
+    return Model_class(**model_params)
+
+
+def set_model_defaults(model_name, **params):
+    # Changes the default hyperparameters used by model_maker for every later fit of model_name
+    with models_mapper_lock:
+        Model_path, default_params = models_mapper[model_name]
+        default_params = dict(default_params)
+        default_params.update(params)
+        models_mapper[model_name] = (Model_path, default_params)
+
+
+def fit_predict(Model, problem, X, y, split = None):
+    '''
+    fit_predict fits the Model on the training data and predicts on the test data.
+    It never writes to the page, so it can safely be run inside a worker thread or process.
+    split:- optional (train_index, test_index), X and y then hold the whole data ([X], [y]) and the rows are taken here.
+    Returns the fitted model, y_pred and a dict of metrics.
+    '''
+    if split is not None:
+        train_index, test_index = split
+        X = [X[0][train_index], X[0][test_index]]
+        y = [y[0][train_index], y[0][test_index]]
     X_train, X_test = X[0], X[1]
     y_train, y_test = y[0], y[1]
-    
+
     Model.fit(X_train, y_train)
     y_pred = Model.predict(X_test)
-    info(model_name)
 
     if problem.lower() == 'regression':
-        acc_measure = acc_measure_reg(y_test, y_pred)
+        metrics = metrics_reg(y_test, y_pred)
     else:
-        acc_measure = acc_measure_cls(y_test, y_pred)
+        metrics = metrics_cls(y_test, y_pred)
+    return Model, y_pred, metrics
+
+
+def fit_predict_shared(Model, problem, X, y, split = None):
+    # fit_predict for X and y lists which can hold data plane handles (modules/shared_data.py)
+    return fit_predict(Model, problem, [attach(part) for part in X], [attach(part) for part in y], split)
+
+
+def fit_fold(Model, problem, X, y, train_index, test_index):
+    # Fits one cross validation fold, the rows are taken inside the worker so only the indices are sent
+    Model, y_pred, metrics = fit_predict(Model, problem, [X[train_index], X[test_index]], [y[train_index], y[test_index]])
+    return metrics
+
+
+def Model_Trainer(Model, model_name, problem, X, y):
+    Model, y_pred, metrics = fit_predict(Model, problem, X, y)
+    info(model_name)
+    metrics_printer(metrics)
     return y_pred
 
 
 class Models:
-    def __init__(self, X_list, y_list, problem, model_list = None):
+    def __init__(self, X_list, y_list, problem, model_list = None, n_jobs = 1, backend = 'thread', cache = None, data_key = None, model_params = None, split = None):
         '''
         Models is used to train different models on the given parameters.
         X_list:- list for X_train and X_test, order is important.
         y_list:- list for y_train and y_test, order is important.
         problem:- str object used to describe the problem statement.
         model_list:- takes in different model names, must pass in a list object.
+        n_jobs:- number of models fitted at the same time, 1 trains them one after another and -1 uses all the cores.
+        backend:- 'thread' or 'process', the kind of worker pool used when n_jobs is not 1.
+        cache:- optional TrainingCache, fitted results are reused from it instead of refitting.
+        data_key:- fingerprint of the data behind X_list and y_list, required for the cache to be used.
+        model_params:- optional dict of model name --> dict of hyperparameters overriding the defaults of models_mapper.
+        split:- optional (train_index, test_index) from modules/splitting.py, X_list and y_list are then [X] and [y],
+        the whole encoded data, and every model takes its rows from them instead of getting copied halves.
+        X_list may hold scipy sparse matrices, models which are not in sparse_input_models are then trained on a dense copy.
         
         Examples
         ========
         >>> Models([X_train, X_test], [y_train, y_test], "Regression", ["LinearRegression", "RandomForestRegressor"])
         >>> Models([X_train, X_test], [y_train, y_test], "Classification", ["DecisionTreeClassifier", "RandomForestClassifier"])
+        >>> Models([X_train, X_test], [y_train, y_test], "Regression", ["SVR", "XGBRegressor"], n_jobs = -1)
+        >>> Models([X_train, X_test], [y_train, y_test], "Regression", ["SVR"], cache = get_training_cache(), data_key = key)
+        >>> Models([X_train, X_test], [y_train, y_test], "Regression", ["SVR"], model_params = {"SVR": {"C": 10}})
+        >>> Models([X], [y], "Classification", ["SVC"], split = make_split("Stratified", len(y), 0.82, y = y))
         '''
         self.X = X_list
         self.y = y_list
         self.problem = problem
         self.model_list = model_list
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.cache = cache
+        self.data_key = data_key
+        self.model_params = model_params or dict()
+        self.split = split
+        self.dense_X = None
         self.dict = dict()
+        self.fitted_models = dict()
+        self.metrics = dict()
+        self.cv_results = None
 
 
     def model_call(self):
@@ -81,14 +179,198 @@ class Models:
             # For calling respective functions according to the model_list
             #success("Working On It! Please Wait For a While")
             text("")
-            
-            for model_name in self.model_list:
-                Model = models_mapper[model_name]
-                pred_output = Model_Trainer(
-                    Model, model_name,
-                    self.problem, self.X, self.y
-                )
-                self.dict[model_name] = pred_output
+
+            if self.n_jobs == 1 or len(self.model_list) < 2:
+                for model_name in self.model_list:
+                    result = self.cache_lookup(model_name)
+                    if result is None:
+                        result = fit_predict(self.make_model(model_name), self.problem, self.model_input(model_name), self.y, self.split)
+                        self.cache_store(model_name, result)
+                    self.result_printer(model_name, result)
+                    self.save_result(model_name, result)
+            else:
+                self.parallel_model_call()
+
+
+    def parallel_model_call(self):
+        '''
+        parallel_model_call fits all the models of model_list at the same time on a pool of workers.
+        Results are shown on the page as soon as each model finishes, but self.dict is filled in the order of model_list.
+        '''
+        outputs = {}
+        to_fit = []
+        for model_name in self.model_list:
+            result = self.cache_lookup(model_name)
+            if result is None:
+                to_fit.append(model_name)
+            else:
+                self.result_printer(model_name, result)
+                outputs[model_name] = result
+
+        if to_fit != []:
+            if self.n_jobs is None or self.n_jobs < 1:
+                workers = os.cpu_count() or 1
+            else:
+                workers = self.n_jobs
+            workers = min(workers, len(to_fit))
+
+            if self.backend == 'process':
+                Executor = ProcessPoolExecutor
+            else:
+                Executor = ThreadPoolExecutor
+
+            with Executor(max_workers = workers) as executor:
+                futures = {}
+                for model_name in to_fit:
+                    X, y = self.model_input(model_name), self.y
+                    if self.backend == 'process':
+                        # Arrays of the session's data plane are sent as handles, the worker maps them instead of unpickling a copy
+                        X = [shared_handle(part) or part for part in X]
+                        y = [shared_handle(part) or part for part in y]
+                    future = executor.submit(
+                        fit_predict_shared, self.make_model(model_name),
+                        self.problem, X, y, self.split
+                    )
+                    futures[future] = model_name
+
+                # Streamlit calls must stay on the script thread, so the results are written here as they come in
+                for future in as_completed(futures):
+                    model_name = futures[future]
+                    result = future.result()
+                    self.cache_store(model_name, result)
+                    self.result_printer(model_name, result)
+                    outputs[model_name] = result
+
+        for model_name in self.model_list:
+            self.save_result(model_name, outputs[model_name])
+
+
+    def cross_validate(self, X, y, n_splits = 5, stratified = None, random_state = 0, n_jobs = None):
+        '''
+        cross_validate scores every model of model_list with k-fold cross validation on X and y (the whole
+        dataset, not the split of X_list) and returns a DataFrame with the mean and std of every metric per model.
+        stratified:- use StratifiedKFold, by default it is used for classification problems.
+        n_jobs:- number of folds fitted at the same time, self.n_jobs when None.
+        The folds of every model run at the same time on n_jobs processes. joblib memory maps X and y for the
+        workers, so they all read the same copy instead of receiving one each.
+
+        Example
+        =========
+        >>> Models([X_train, X_test], [y_train, y_test], "Classification", ["SVC", "XGBClassifier"], n_jobs = -1).cross_validate(X, y, n_splits = 5)
+        '''
+        if stratified is None:
+            stratified = self.problem.lower() != 'regression'
+        if stratified:
+            splitter = model_selection.StratifiedKFold(n_splits = n_splits, shuffle = True, random_state = random_state)
+        else:
+            splitter = model_selection.KFold(n_splits = n_splits, shuffle = True, random_state = random_state)
+        folds = list(splitter.split(np.zeros(len(y)), y))
+
+        dense_X = None
+        tasks = []
+        fold_metrics = {model_name: [None] * n_splits for model_name in self.model_list}
+        for model_name in self.model_list:
+            for fold, (train_index, test_index) in enumerate(folds):
+                key = self.fold_key(model_name, n_splits, stratified, random_state, fold)
+                cached = self.cache.get(key) if key is not None else None
+                if cached is not None:
+                    fold_metrics[model_name][fold] = cached
+                    continue
+                model_X = X
+                if model_name not in sparse_input_models and sparse.issparse(X):
+                    if dense_X is None:
+                        dense_X = to_dense(X)
+                    model_X = dense_X
+                tasks.append((model_name, fold, model_X, train_index, test_index))
+
+        # Arrays above 1 MB are dumped once to a memory mapped file shared by every worker
+        n_jobs = self.n_jobs if n_jobs is None else n_jobs
+        outputs = joblib.Parallel(n_jobs = n_jobs, max_nbytes = '1M', mmap_mode = 'r')(
+            joblib.delayed(fit_fold)(self.fold_model(model_name, single_thread = n_jobs != 1), self.problem, model_X, y, train_index, test_index)
+            for model_name, fold, model_X, train_index, test_index in tasks
+        )
+        for (model_name, fold, _, _, _), metrics in zip(tasks, outputs):
+            fold_metrics[model_name][fold] = metrics
+            key = self.fold_key(model_name, n_splits, stratified, random_state, fold)
+            if key is not None:
+                self.cache.put(key, metrics)
+
+        rows = dict()
+        for model_name, metrics_list in fold_metrics.items():
+            scores = pd.DataFrame(metrics_list, dtype = float)
+            row = dict()
+            for metric_name in scores.columns:
+                row[metric_name + " (mean)"] = scores[metric_name].mean()
+                row[metric_name + " (std)"] = scores[metric_name].std()
+            rows[model_name] = row
+        self.cv_results = pd.DataFrame.from_dict(rows, orient = 'index')
+        return self.cv_results
+
+
+    def fold_key(self, model_name, n_splits, stratified, random_state, fold):
+        if self.cache is None or self.data_key is None:
+            return None
+        data_key = self.data_key + "|cv=" + repr((n_splits, stratified, random_state, fold))
+        return model_fingerprint(data_key, model_name, self.make_model(model_name))
+
+
+    def show_results(self, results):
+        # Prints and saves results (model name --> result, as computed by a background TrainingJob) in the order of model_list
+        for model_name in self.model_list:
+            if model_name in results:
+                self.result_printer(model_name, results[model_name])
+                self.save_result(model_name, results[model_name])
+
+
+    def model_input(self, model_name):
+        # The dense copy is made once and shared by every model needing it
+        if model_name in sparse_input_models or not any(sparse.issparse(X) for X in self.X):
+            return self.X
+        if self.dense_X is None:
+            size = sum(dense_bytes(X) for X in self.X)
+            if size > dense_warning_megabytes * 1024 * 1024:
+                warning(f"{model_name} needs dense input, converting the data takes {size / 1024 ** 2:.0f} MB "
+                        f"instead of {sum(matrix_bytes(X) for X in self.X) / 1024 ** 2:.0f} MB")
+            self.dense_X = [to_dense(X) for X in self.X]
+        return self.dense_X
+
+
+    def make_model(self, model_name):
+        return model_maker(model_name, **self.model_params.get(model_name, {}))
+
+
+    def fold_model(self, model_name, single_thread):
+        Model = self.make_model(model_name)
+        if single_thread and 'n_jobs' in Model.get_params():
+            Model.set_params(n_jobs = 1)  # folds already run side by side, one core each
+        return Model
+
+
+    def cache_key(self, model_name):
+        return model_fingerprint(self.data_key, model_name, self.make_model(model_name))
+
+
+    def cache_lookup(self, model_name):
+        if self.cache is None or self.data_key is None:
+            return None
+        return self.cache.get(self.cache_key(model_name))
+
+
+    def cache_store(self, model_name, result):
+        if self.cache is not None and self.data_key is not None:
+            self.cache.put(self.cache_key(model_name), result)
+
+
+    def result_printer(self, model_name, result):
+        info(model_name)
+        metrics_printer(result[2])
+
+
+    def save_result(self, model_name, result):
+        Model, y_pred, metrics = result
+        self.fitted_models[model_name] = Model
+        self.dict[model_name] = y_pred
+        self.metrics[model_name] = metrics
 
 
     def output(self, value):
@@ -96,32 +378,54 @@ class Models:
         return self.dict[value]
 
 
-def acc_measure_cls(y_test, y_pred):
-    acc = accuracy_score(y_test, y_pred)
-    f1 = f1_score(y_test, y_pred , average = 'micro')
+    def test_rows(self):
+        # Row positions (in the whole data) of the predictions, None when X_list already is [X_train, X_test]
+        return None if self.split is None else self.split[1]
+
+
+missing_metric_messages = {
+    'ROC AUC Score': "ROC AUC Score can't be shown because target feature is of multiclass",
+    'Mean Squared Log Error': "MSLE can't be shown as there might be some negative values present in prediction dataset.",
+}
+
+
+def metrics_cls(y_test, y_pred):
+    metrics = dict()
+    metrics['Accuracy Score'] = sklearn_metrics.accuracy_score(y_test, y_pred)
+    metrics['F1 Score'] = sklearn_metrics.f1_score(y_test, y_pred , average = 'micro')
     try:
-        roc_auc = roc_auc_score(y_test, y_pred)
-        write("Accuracy Score:- ", acc)
-        write("F1 Score:- ", f1)
-        write("ROC AUC Score:- ", roc_auc)
-    except:    
-        write("Accuracy Score:- ", acc)
-        write("F1 Score:- ", f1)
-        write("ROC AUC Score can't be shown because target feature is of multiclass")
+        metrics['ROC AUC Score'] = sklearn_metrics.roc_auc_score(y_test, y_pred)
+    except:
+        metrics['ROC AUC Score'] = None
+    return metrics
 
 
-def acc_measure_reg(y_test, y_pred):
-    r2 = r2_score(y_test, y_pred)
-    mse = mean_squared_error(y_test, y_pred)
+def metrics_reg(y_test, y_pred):
+    metrics = dict()
+    metrics['R2 Score'] = sklearn_metrics.r2_score(y_test, y_pred)
+    metrics['Mean Squared Error'] = sklearn_metrics.mean_squared_error(y_test, y_pred)
     try:
-        msle = mean_squared_log_error(y_test, y_pred)
-        write("R2 Score:- ", r2)
-        write("Mean Squared Error:- ", mse)
-        write("Mean Squared Log Error:- ", msle)
+        metrics['Mean Squared Log Error'] = sklearn_metrics.mean_squared_log_error(y_test, y_pred)
     except:
-        write("R2 Score:- ", r2)
-        write("Mean Squared Error:- ", mse)
-        write("MSLE can't be shown as there might be some negative values present in prediction dataset.")
+        metrics['Mean Squared Log Error'] = None
+    return metrics
+
+
+def metrics_printer(metrics):
+    # None marks a metric which couldn't be computed for this target
+    for metric_name in metrics:
+        if metrics[metric_name] is None:
+            write(missing_metric_messages[metric_name])
+        else:
+            write(metric_name + ":- ", metrics[metric_name])
+
+
+def acc_measure_cls(y_test, y_pred):
+    metrics_printer(metrics_cls(y_test, y_pred))
+
+
+def acc_measure_reg(y_test, y_pred):
+    metrics_printer(metrics_reg(y_test, y_pred))
 
 
 # print(Models("x", "y", ["LinearRegression"]).model_call())
@@ -146,6 +450,11 @@ def train_test_splitter(df, prcntage):
 
     return(train, test)
 
+def matrix_splitter(X, y, prcntage):
+    # Same split as train_test_splitter, for a feature matrix (dense or sparse) and its target
+    train_rows = int( X.shape[0] * prcntage )
+    return(X[ : train_rows ], X[ train_rows : ], y[ : train_rows ], y[ train_rows : ])
+
 def x_y_maker(target_feature, train, test):
     y_train = train[target_feature].values
     x_train = train.drop(target_feature , axis = 1)
@@ -0,0 +1,199 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+import numpy as np
+
+from modules.lazy_loader import lazy_import
+
+sparse = lazy_import("scipy.sparse")
+
+
+shared_directory = os.environ.get("ML_AUTOMATOR_SHARED_DIR", os.path.join(tempfile.gettempdir(), "ml_automator_shared"))
+shared_max_age_hours = float(os.environ.get("ML_AUTOMATOR_SHARED_MAX_AGE_HOURS", 12))
+
+
+def write_array(path, array):
+    # Plain .npy file, written under a temporary name first so a reader never sees half of it
+    temp_path = path + "." + uuid.uuid4().hex + ".tmp.npy"
+    np.save(temp_path, np.ascontiguousarray(array))
+    os.replace(temp_path, path)
+
+
+class SharedArray:
+    def __init__(self, path, shape, dtype):
+        '''
+        SharedArray is a small picklable handle to an array saved in the data plane.
+        attach() maps the file read only, every process attaching it shares the same pages of the OS cache.
+        '''
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+
+    def attach(self):
+        return np.load(self.path, mmap_mode = 'r')
+
+
+class SharedCSR:
+    def __init__(self, paths, shape):
+        # Handle to a CSR matrix saved as its three arrays (data, indices, indptr)
+        self.paths = paths
+        self.shape = shape
+
+    def attach(self):
+        data, indices, indptr = (np.load(path, mmap_mode = 'r') for path in self.paths)
+        return sparse.csr_matrix((data, indices, indptr), shape = self.shape, copy = False)
+
+
+class DataPlane:
+    def __init__(self, session_id):
+        '''
+        DataPlane keeps the encoded arrays of one session in memory mapped files, so the workers of the
+        training subsystem (model pool, cross validation folds, tuning trials) attach the same pages read only
+        instead of each getting a pickled copy.
+        Arrays are stored under a name and a version, storing a new version of a name removes the old files.
+        The files are removed when the session goes away (see get_data_plane) or when they are older than
+        shared_max_age_hours.
+
+        Example
+        =========
+        >>> plane = get_data_plane(get_session_id(), owner = get_state())
+        >>> X = plane.put("X", X, data_key)           # X is now a read only memory mapped array
+        >>> handle = shared_handle(X)                  # picklable, handle.attach() in a worker gives back X
+        '''
+        self.session_id = str(session_id)
+        self.directory = os.path.join(shared_directory, self.session_id)
+        self.versions = dict()
+        self.arrays = dict()
+        self.handles = dict()
+        self.lock = threading.Lock()
+
+
+    def put(self, name, array, version):
+        '''
+        Saves array as name and returns the attached (memory mapped) copy to use in its place.
+        version:- identifies the content of array, the files of the same name and version are reused.
+        '''
+        with self.lock:
+            if self.versions.get(name) == version and name in self.arrays:
+                return self.arrays[name]
+
+            os.makedirs(self.directory, exist_ok = True)
+            self.remove(name)
+            prefix = os.path.join(self.directory, name + "-" + uuid.uuid4().hex[:12])
+            if sparse.issparse(array):
+                array = array.tocsr()
+                array.sum_duplicates()  # canonical (sorted) indices, a read only map can't be sorted later
+                paths = [prefix + "-" + part + ".npy" for part in ("data", "indices", "indptr")]
+                for path, part in zip(paths, (array.data, array.indices, array.indptr)):
+                    write_array(path, part)
+                handle = SharedCSR(paths, array.shape)
+            else:
+                array = np.asarray(array)
+                if array.dtype == object:
+                    return array  # object arrays can't be memory mapped, they stay as they are
+                write_array(prefix + ".npy", array)
+                handle = SharedArray(prefix + ".npy", array.shape, array.dtype)
+
+            attached = handle.attach()
+            self.versions[name] = version
+            self.arrays[name] = attached
+            self.handles[id(attached)] = handle
+            return attached
+
+
+    def remove(self, name):
+        # Called with self.lock held
+        attached = self.arrays.pop(name, None)
+        self.versions.pop(name, None)
+        if attached is None:
+            return
+        handle = self.handles.pop(id(attached))
+        for path in getattr(handle, 'paths', [getattr(handle, 'path', None)]):
+            try:
+                os.remove(path)  # an attached map keeps working on Linux until it is closed
+            except (FileNotFoundError, TypeError):
+                pass
+
+
+    def handle(self, array):
+        return self.handles.get(id(array))
+
+
+    def close(self):
+        with self.lock:
+            self.arrays.clear()
+            self.handles.clear()
+            self.versions.clear()
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+
+data_planes = dict()
+data_planes_lock = threading.Lock()
+
+
+def close_data_plane(session_id):
+    with data_planes_lock:
+        plane = data_planes.pop(str(session_id), None)
+    if plane is not None:
+        plane.close()
+
+
+def get_data_plane(session_id, owner = None):
+    '''
+    Returns the DataPlane of session_id, creating it the first time.
+    owner:- object living as long as the session (its session state), the plane is closed and its files removed
+    when owner is garbage collected.
+    '''
+    session_id = str(session_id)
+    with data_planes_lock:
+        plane = data_planes.get(session_id)
+        if plane is None:
+            plane = DataPlane(session_id)
+            data_planes[session_id] = plane
+            if owner is not None:
+                weakref.finalize(owner, close_data_plane, session_id)
+            purge = True
+        else:
+            purge = False
+    if purge:
+        purge_stale_planes()
+    return plane
+
+
+def purge_stale_planes():
+    # Directories of sessions which didn't go through close_data_plane (server killed for example)
+    if not os.path.isdir(shared_directory):
+        return
+    oldest_allowed = time.time() - shared_max_age_hours * 3600
+    with data_planes_lock:
+        live = set(data_planes)
+    for session_id in os.listdir(shared_directory):
+        path = os.path.join(shared_directory, session_id)
+        try:
+            if session_id not in live and os.path.getmtime(path) < oldest_allowed:
+                shutil.rmtree(path, ignore_errors = True)
+        except FileNotFoundError:
+            pass
+
+
+def shared_handle(array):
+    # Handle of an array returned by DataPlane.put, None for any other array
+    with data_planes_lock:
+        planes = list(data_planes.values())
+    for plane in planes:
+        handle = plane.handle(array)
+        if handle is not None:
+            return handle
+    return None
+
+
+def attach(value):
+    # Inverse of shared_handle in a worker, anything which isn't a handle is returned as it is
+    if isinstance(value, (SharedArray, SharedCSR)):
+        return value.attach()
+    return value
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+
+# Split methods offered on the Model Building page
+split_methods = ["Stratified", "Shuffled", "Time ordered", "Grouped", "First rows for training"]
+
+
+def ordered_split(n_rows, train_size):
+    # The old train_test_splitter split : first rows for training, the rest for testing
+    train_rows = int(n_rows * train_size)
+    return np.arange(train_rows), np.arange(train_rows, n_rows)
+
+
+def shuffled_split(n_rows, train_size, random_state = 0):
+    order = np.random.RandomState(random_state).permutation(n_rows)
+    train_rows = int(n_rows * train_size)
+    return np.sort(order[:train_rows]), np.sort(order[train_rows:])
+
+
+def stratified_split(y, train_size, random_state = 0):
+    '''
+    Shuffled split keeping the share of every class of y the same in the train and test rows.
+    '''
+    random_state = np.random.RandomState(random_state)
+    codes = pd.factorize(np.asarray(y))[0]
+    train_index, test_index = [], []
+    for code in range(codes.max() + 1 if len(codes) else 0):
+        rows = random_state.permutation(np.flatnonzero(codes == code))
+        train_rows = int(round(len(rows) * train_size))
+        train_index.append(rows[:train_rows])
+        test_index.append(rows[train_rows:])
+    nulls = np.flatnonzero(codes == -1)  # rows with a null target go to training, like any unknown class would
+    train_index.append(nulls)
+    return np.sort(np.concatenate(train_index)), np.sort(np.concatenate(test_index) if test_index else np.array([], dtype = np.int64))
+
+
+def time_ordered_split(time_values, train_size):
+    '''
+    Rows sorted by time_values (dates, or anything orderable), the earliest ones for training and the latest for testing,
+    so a model is never tested on rows older than the ones it learnt from.
+    '''
+    time_values = pd.Series(time_values).reset_index(drop = True)
+    if time_values.dtype == object:
+        parsed = pd.to_datetime(time_values, errors = 'coerce')
+        if parsed.notnull().mean() > 0.9:
+            time_values = parsed
+    order = np.argsort(time_values.to_numpy(), kind = 'mergesort')
+    train_rows = int(len(order) * train_size)
+    return order[:train_rows], order[train_rows:]
+
+
+def group_split(groups, train_size, random_state = 0):
+    '''
+    Every value of groups (a customer id for example) ends up entirely in training or entirely in testing,
+    groups are shuffled and added to training until it holds train_size of the rows.
+    '''
+    codes, uniques = pd.factorize(pd.Series(groups).reset_index(drop = True))
+    codes = np.where(codes == -1, len(uniques), codes)  # nulls make a group of their own
+    sizes = np.bincount(codes)
+    order = np.random.RandomState(random_state).permutation(len(sizes))
+    n_train_groups = int(np.searchsorted(np.cumsum(sizes[order]), len(codes) * train_size, side = 'right'))
+    in_train = np.zeros(len(sizes), dtype = bool)
+    in_train[order[:n_train_groups]] = True
+    train_mask = in_train[codes]
+    return np.flatnonzero(train_mask), np.flatnonzero(~train_mask)
+
+
+def make_split(method, n_rows, train_size, y = None, column_values = None, random_state = 0):
+    '''
+    Returns (train_index, test_index), arrays of row positions, for the split method (one of split_methods).
+    y:- the target, used by "Stratified".
+    column_values:- the time column for "Time ordered", the group column for "Grouped".
+
+    Example
+    =========
+    >>> train_index, test_index = make_split("Stratified", len(y), 0.82, y = y)
+    >>> X[train_index], y[train_index]
+    '''
+    if method == "Stratified":
+        return stratified_split(y, train_size, random_state)
+    if method == "Shuffled":
+        return shuffled_split(n_rows, train_size, random_state)
+    if method == "Time ordered":
+        return time_ordered_split(column_values, train_size)
+    if method == "Grouped":
+        return group_split(column_values, train_size, random_state)
+    return ordered_split(n_rows, train_size)
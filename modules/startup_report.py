@@ -0,0 +1,86 @@
+''' Startup-time report for the app.
+
+    Imports a module in a fresh interpreter with "python -X importtime" and prints how much
+    of the import time each top level package is responsible for.
+
+    Usage
+    -----
+    python -m modules.startup_report                               # report for main_app_functions
+    python -m modules.startup_report --module modules.models --top 10
+    python -m modules.startup_report --max-seconds 1.5             # exits with 1 when startup got slower than that
+    python -m modules.startup_report --json startup.json           # machine readable copy of the report
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def import_times(module_name, cwd = None):
+    '''
+    Returns a list of (module, self seconds, cumulative seconds) for every module imported
+    while importing module_name in a new interpreter.
+    '''
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module_name],
+        cwd = cwd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError("Importing " + module_name + " failed :\n" + completed.stderr[-2000:])
+
+    timings = []
+    for line in completed.stderr.splitlines():
+        # Lines look like --> import time:       512 |       1830 |   pandas.core
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return timings
+
+
+def startup_report(module_name = "main_app_functions", cwd = None):
+    timings = import_times(module_name, cwd)
+
+    per_package = defaultdict(float)
+    for name, self_seconds, _ in timings:
+        per_package[name.split(".")[0]] += self_seconds
+
+    total = 0.0
+    for name, _, cumulative_seconds in timings:
+        if name == module_name:
+            total = cumulative_seconds
+
+    packages = sorted(per_package.items(), key = lambda item: item[1], reverse = True)
+    return {"module": module_name, "total_seconds": total, "packages": packages}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Import-time breakdown of the app entry point")
+    parser.add_argument("--module", default = "main_app_functions")
+    parser.add_argument("--top", type = int, default = 15)
+    parser.add_argument("--max-seconds", type = float, default = None)
+    parser.add_argument("--json", default = None)
+    args = parser.parse_args(argv)
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    report = startup_report(args.module, cwd = repo_root)
+
+    print("Import time of " + report["module"] + " : %.3f s" % report["total_seconds"])
+    print("%-30s %10s" % ("Package", "Seconds"))
+    for package, seconds in report["packages"][:args.top]:
+        print("%-30s %10.3f" % (package, seconds))
+
+    if args.json is not None:
+        with open(args.json, "w") as json_file:
+            json.dump(report, json_file, indent = 2)
+
+    if args.max_seconds is not None and report["total_seconds"] > args.max_seconds:
+        print("Startup got slower than %.3f s" % args.max_seconds)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
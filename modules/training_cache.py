@@ -0,0 +1,162 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+# Cache limits can be tuned per deployment through environment variables
+cache_max_entries = int(os.environ.get("ML_AUTOMATOR_CACHE_ENTRIES", 64))
+cache_max_megabytes = int(os.environ.get("ML_AUTOMATOR_CACHE_MB", 512))
+cache_directory = os.environ.get("ML_AUTOMATOR_CACHE_DIR")  # on-disk persistence is off unless this is set
+cache_max_disk_megabytes = int(os.environ.get("ML_AUTOMATOR_CACHE_DISK_MB", 4096))
+
+
+def dataset_fingerprint(df, target_feature, problem, prcntage):
+    '''
+    Returns a hex digest which changes whenever the content of df, the target feature,
+    the problem type or the train split percentage changes.
+
+    Example
+    =========
+    >>> dataset_fingerprint(the_df, 'Survived', 'Classification', 0.82)
+    '''
+    hasher = hashlib.sha1()
+    hasher.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    hasher.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    hasher.update(repr((target_feature, problem.lower(), round(prcntage, 4))).encode())
+    return hasher.hexdigest()
+
+
+def model_fingerprint(data_key, model_name, Model):
+    # Estimator parameters are part of the key, so changing a hyperparameter never returns a stale model
+    params = sorted((name, repr(value)) for name, value in Model.get_params().items())
+    hasher = hashlib.sha1()
+    hasher.update(repr((data_key, model_name, params)).encode())
+    return hasher.hexdigest()
+
+
+class TrainingCache:
+    def __init__(self, max_entries = 64, max_bytes = 512 * 1024 * 1024, cache_dir = None, max_disk_bytes = 4 * 1024 ** 3):
+        '''
+        TrainingCache keeps (fitted model, y_pred, metrics) results keyed by model_fingerprint.
+        Entries are stored pickled, so a cached model can never be changed by a later fit.
+        max_entries:- maximum number of results kept in memory.
+        max_bytes:- maximum total pickled size kept in memory, least recently used results are evicted first.
+        cache_dir:- optional directory where results are also persisted, so they survive a server restart.
+        max_disk_bytes:- maximum total size of cache_dir, the least recently used files are removed first.
+        '''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok = True)
+
+
+    def get(self, key):
+        # Returns the cached result for key or None on a miss
+        with self.lock:
+            blob = self.entries.get(key)
+            if blob is not None:
+                self.entries.move_to_end(key)
+
+        if blob is None:
+            blob = self.read_from_disk(key)
+            if blob is None:
+                return None
+            self.store(key, blob)
+
+        return pickle.loads(blob)
+
+
+    def put(self, key, result):
+        blob = pickle.dumps(result, protocol = pickle.HIGHEST_PROTOCOL)
+        self.store(key, blob)
+        self.write_to_disk(key, blob)
+
+
+    def store(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= len(self.entries.pop(key))
+            self.entries[key] = blob
+            self.total_bytes += len(blob)
+
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                evicted_key, evicted_blob = self.entries.popitem(last = False)
+                self.total_bytes -= len(evicted_blob)
+
+
+    def file_path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+
+    def read_from_disk(self, key):
+        if self.cache_dir is None or not os.path.exists(self.file_path(key)):
+            return None
+        with open(self.file_path(key), "rb") as cache_file:
+            blob = cache_file.read()
+        os.utime(self.file_path(key))  # mtime doubles as the last access time for trim_disk
+        return blob
+
+
+    def write_to_disk(self, key, blob):
+        if self.cache_dir is None:
+            return
+        # Writing to a temporary file first so that a crash never leaves a half written entry behind
+        temp_path = self.file_path(key) + ".tmp." + str(os.getpid()) + "." + str(threading.get_ident())
+        with open(temp_path, "wb") as cache_file:
+            cache_file.write(blob)
+        os.replace(temp_path, self.file_path(key))
+        self.trim_disk()
+
+
+    def trim_disk(self):
+        files = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".pkl"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, file_name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_name))
+
+        disk_bytes = sum(size for _, size, _ in files)
+        for _, size, file_name in sorted(files):
+            if disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except FileNotFoundError:
+                pass  # Another process already removed it
+            disk_bytes -= size
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+training_cache = None
+training_cache_lock = threading.Lock()
+
+
+def get_training_cache():
+    # One cache per server process, shared by every session since the keys are content based
+    global training_cache
+    with training_cache_lock:
+        if training_cache is None:
+            training_cache = TrainingCache(cache_max_entries, cache_max_megabytes * 1024 * 1024,
+                                           cache_directory, cache_max_disk_megabytes * 1024 * 1024)
+    return training_cache
@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from modules.models import fit_predict
+
+
+training_workers = int(os.environ.get("ML_AUTOMATOR_TRAINING_WORKERS", os.cpu_count() or 1))
+max_kept_jobs = int(os.environ.get("ML_AUTOMATOR_MAX_JOBS", 32))  # finished jobs kept for their results, oldest dropped first
+
+
+class TrainingJob:
+    def __init__(self, model_object):
+        '''
+        TrainingJob fits the models of a Models object on the shared worker pool, outside of the script thread,
+        so a rerun of the page (any widget change) doesn't stop or restart the fits.
+        Every model goes through 'queued' --> 'running' --> 'done' / 'failed', or 'cancelled' when the job
+        is cancelled before it started. A fit which is already running can't be interrupted, it finishes
+        and its result is kept.
+        Results are also put in the training cache of model_object, so they are reused by any later fit of the same data.
+        '''
+        self.job_id = uuid.uuid4().hex
+        self.signature = job_signature(model_object)
+        self.model_list = list(model_object.model_list)
+        self.submitted_at = time.time()
+        self.status = OrderedDict((model_name, 'queued') for model_name in self.model_list)
+        self.started = dict()
+        self.finished_at = dict()
+        self.errors = dict()
+        self.results = dict()
+        self.futures = dict()
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+
+    def run_model(self, model_object, model_name, Model, X):
+        with self.lock:
+            if self.cancel_event.is_set():
+                self.status[model_name] = 'cancelled'
+                return
+            self.status[model_name] = 'running'
+            self.started[model_name] = time.time()
+
+        try:
+            result = fit_predict(Model, model_object.problem, X, model_object.y, model_object.split)
+            model_object.cache_store(model_name, result)
+        except Exception as err:
+            with self.lock:
+                self.status[model_name] = 'failed'
+                self.errors[model_name] = repr(err)
+                self.finished_at[model_name] = time.time()
+            return
+
+        with self.lock:
+            self.results[model_name] = result
+            self.status[model_name] = 'done'
+            self.finished_at[model_name] = time.time()
+
+
+    def cancel(self):
+        # Models still waiting for a worker are dropped, the running ones finish
+        self.cancel_event.set()
+        with self.lock:
+            for model_name, future in self.futures.items():
+                if future.cancel():
+                    self.status[model_name] = 'cancelled'
+
+
+    def settled(self):
+        # True once no model is waiting or running, to be called with self.lock held
+        return all(status not in ('queued', 'running') for status in self.status.values())
+
+
+    def is_finished(self):
+        with self.lock:
+            return self.settled()
+
+
+    def progress(self):
+        # Share of the models which are not waiting or running any more
+        with self.lock:
+            return sum(status not in ('queued', 'running') for status in self.status.values()) / max(len(self.status), 1)
+
+
+    def elapsed(self):
+        with self.lock:
+            if self.settled():
+                return max(self.finished_at.values(), default = self.submitted_at) - self.submitted_at
+        return time.time() - self.submitted_at
+
+
+    def status_frame(self):
+        # One row per model --> Model, Status, Seconds (time spent fitting so far)
+        now = time.time()
+        rows = []
+        with self.lock:
+            for model_name, status in self.status.items():
+                seconds = None
+                if model_name in self.started:
+                    seconds = round(self.finished_at.get(model_name, now) - self.started[model_name], 1)
+                rows.append((model_name, status, seconds, self.errors.get(model_name, "")))
+        return pd.DataFrame(rows, columns = ['Model', 'Status', 'Seconds', 'Error'])
+
+
+def job_signature(model_object):
+    # Two jobs with the same signature train the same models on the same data
+    return (model_object.data_key, model_object.problem, tuple(model_object.model_list), repr(sorted(model_object.model_params.items())))
+
+
+training_executor = None
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+
+
+def get_training_executor():
+    # One pool per server process, shared by the jobs of every session
+    global training_executor
+    with jobs_lock:
+        if training_executor is None:
+            training_executor = ThreadPoolExecutor(max_workers = training_workers, thread_name_prefix = "training")
+    return training_executor
+
+
+def submit_training(model_object):
+    '''
+    Starts fitting the models of model_object in the background and returns the TrainingJob.
+    Models found in the training cache are done right away. Must be called from the script thread,
+    the inputs (and a possible dense conversion warning) are prepared there.
+
+    Example
+    =========
+    >>> job = submit_training(Models([X_train, X_test], [y_train, y_test], "Regression", ["SVR"], cache = get_training_cache(), data_key = key))
+    >>> session_state.training_job_id = job.job_id
+    '''
+    job = TrainingJob(model_object)
+    executor = get_training_executor()
+
+    for model_name in job.model_list:
+        result = model_object.cache_lookup(model_name)
+        if result is not None:
+            job.results[model_name] = result
+            job.status[model_name] = 'done'
+            continue
+        X = model_object.model_input(model_name)
+        job.futures[model_name] = executor.submit(job.run_model, model_object, model_name, model_object.make_model(model_name), X)
+
+    with jobs_lock:
+        jobs[job.job_id] = job
+        forget_old_jobs()
+    return job
+
+
+def get_job(job_id):
+    if job_id is None:
+        return None
+    with jobs_lock:
+        return jobs.get(job_id)
+
+
+def forget_old_jobs():
+    # Called with jobs_lock held, jobs still training are never dropped
+    finished = [job_id for job_id, job in jobs.items() if job.is_finished()]
+    for job_id in finished[: max(len(jobs) - max_kept_jobs, 0)]:
+        del jobs[job_id]
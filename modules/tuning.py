@@ -0,0 +1,255 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from modules.encoding import to_dense
+from modules.lazy_loader import lazy_import
+from modules.models import model_maker, sparse_input_models, metrics_cls, metrics_reg
+from modules.training_cache import model_fingerprint
+
+joblib = lazy_import("joblib")
+
+
+# Search space of every model --> parameter : ('int', low, high) / ('float', low, high) / ('log', low, high) / ('choice', [values])
+# XGBoost gets a large n_estimators which early stopping cuts down, MLP stops early on its own validation split
+search_spaces = {
+    # Regressors
+    'LinearRegression': {'fit_intercept': ('choice', [True, False])},
+    'RandomForestRegressor': {'n_estimators': ('int', 50, 400), 'max_depth': ('choice', [None, 5, 10, 20]),
+                              'min_samples_leaf': ('int', 1, 10), 'max_features': ('choice', [None, 'sqrt', 'log2'])},
+    'SVR': {'C': ('log', 1e-2, 1e3), 'gamma': ('choice', ['scale', 'auto']), 'epsilon': ('log', 1e-3, 1.0)},
+    'MLPRegressor': {'hidden_layer_sizes': ('choice', [(50,), (100,), (100, 50)]), 'alpha': ('log', 1e-5, 1e-1),
+                     'learning_rate_init': ('log', 1e-4, 1e-2), 'early_stopping': ('choice', [True])},
+    'DecisionTreeRegressor': {'max_depth': ('choice', [None, 3, 5, 10, 20]), 'min_samples_leaf': ('int', 1, 20)},
+    'XGBRegressor': {'n_estimators': ('choice', [1000]), 'learning_rate': ('log', 0.01, 0.3), 'max_depth': ('int', 3, 10),
+                     'subsample': ('float', 0.5, 1.0), 'colsample_bytree': ('float', 0.5, 1.0), 'min_child_weight': ('int', 1, 10)},
+    'SGDRegressor': {'alpha': ('log', 1e-6, 1e-2), 'penalty': ('choice', ['l2', 'l1', 'elasticnet'])},
+
+    #Classifiers
+    'LogisticRegression': {'C': ('log', 1e-3, 1e2), 'class_weight': ('choice', [None, 'balanced']), 'max_iter': ('choice', [1000])},
+    'RandomForestClassifier': {'n_estimators': ('int', 50, 400), 'max_depth': ('choice', [None, 5, 10, 20]),
+                               'min_samples_leaf': ('int', 1, 10), 'max_features': ('choice', [None, 'sqrt', 'log2'])},
+    'SVC': {'C': ('log', 1e-2, 1e3), 'gamma': ('choice', ['scale', 'auto'])},
+    'MLPClassifier': {'hidden_layer_sizes': ('choice', [(50,), (100,), (100, 50)]), 'alpha': ('log', 1e-5, 1e-1),
+                      'learning_rate_init': ('log', 1e-4, 1e-2), 'early_stopping': ('choice', [True])},
+    'DecisionTreeClassifier': {'max_depth': ('choice', [None, 3, 5, 10, 20]), 'min_samples_leaf': ('int', 1, 20)},
+    'XGBClassifier': {'n_estimators': ('choice', [1000]), 'learning_rate': ('log', 0.01, 0.3), 'max_depth': ('int', 3, 10),
+                      'subsample': ('float', 0.5, 1.0), 'colsample_bytree': ('float', 0.5, 1.0), 'min_child_weight': ('int', 1, 10)},
+    'SGDClassifier': {'alpha': ('log', 1e-6, 1e-2), 'penalty': ('choice', ['l2', 'l1', 'elasticnet'])},
+    'MultinomialNB': {'alpha': ('log', 1e-3, 10.0)},
+    'GaussianNB': {'var_smoothing': ('log', 1e-11, 1e-7)},
+}
+early_stopping_rounds = 20
+# The metric trials are ranked on, higher is better for both
+score_metrics = {'regression': 'R2 Score', 'classification': 'Accuracy Score'}
+
+
+def sample_params(model_name, random_state):
+    # One random draw from the search space of model_name
+    params = {}
+    for param, space in search_spaces[model_name].items():
+        kind = space[0]
+        if kind == 'choice':
+            params[param] = space[1][random_state.randint(len(space[1]))]
+        elif kind == 'int':
+            params[param] = int(random_state.randint(space[1], space[2] + 1))
+        elif kind == 'log':
+            params[param] = float(np.exp(random_state.uniform(np.log(space[1]), np.log(space[2]))))
+        else:
+            params[param] = float(random_state.uniform(space[1], space[2]))
+    return params
+
+
+def run_trial(model_name, params, problem, X, y, fit_rows, val_rows, deadline, single_thread):
+    '''
+    Fits model_name with params on the fit_rows of X and y and scores it on their val_rows.
+    The rows are taken here, in the worker, so a memory mapped X is never copied into the pool.
+    Returns None without fitting when the deadline is already past.
+    '''
+    if time.time() > deadline:
+        return None
+    start = time.time()
+    X_fit, y_fit, X_val, y_val = X[fit_rows], y[fit_rows], X[val_rows], y[val_rows]
+    Model = model_maker(model_name, **params)
+    if single_thread and 'n_jobs' in Model.get_params():
+        Model.set_params(n_jobs = 1)  # trials already run side by side, one core each
+    if model_name not in sparse_input_models:
+        X_fit, X_val = to_dense(X_fit), to_dense(X_val)
+
+    best_iteration = None
+    try:
+        if model_name.startswith('XGB'):
+            Model.fit(X_fit, y_fit, eval_set = [(X_val, y_val)], early_stopping_rounds = early_stopping_rounds, verbose = False)
+            best_iteration = getattr(Model, 'best_iteration', None)
+        else:
+            Model.fit(X_fit, y_fit)
+        y_pred = Model.predict(X_val)
+    except Exception as err:
+        # A bad draw (or a subset missing a class) fails only its own trial
+        return {'score': None, 'metrics': {}, 'best_iteration': None, 'seconds': time.time() - start, 'error': repr(err)}
+
+    metrics = metrics_reg(y_val, y_pred) if problem.lower() == 'regression' else metrics_cls(y_val, y_pred)
+    return {
+        'score': metrics[score_metrics[problem.lower()]],
+        'metrics': metrics,
+        'best_iteration': best_iteration,
+        'seconds': time.time() - start,
+        'error': "",
+    }
+
+
+class Tuner:
+    def __init__(self, X_train, y_train, problem, model_list, method = 'random', n_trials = 20, budget_seconds = 60,
+                 n_jobs = -1, validation = 0.2, eta = 3, cache = None, data_key = None, random_state = 0, rows = None):
+        '''
+        Tuner searches the hyperparameters of the models of model_list, scoring every trial on the last
+        validation share of the training rows (the test rows are never looked at).
+        method:- 'random' tries n_trials random draws per model on all the rows, 'halving' starts the same draws
+        on a small share of the rows and keeps only the best 1 / eta of the draws of every model each time the rows are
+        multiplied by eta, the survivors of every model are then ranked together on the leaderboard.
+        budget_seconds:- wall clock budget, no trial starts after it. A trial already running finishes.
+        n_jobs:- trials run at the same time (joblib processes), -1 uses all the cores.
+        cache:- optional TrainingCache, a trial already run on the same data (data_key) is not run again.
+        rows:- optional training row positions, X_train and y_train are then the whole data and only these rows are used.
+
+        Example
+        =========
+        >>> tuner = Tuner(x_train, y_train, "Classification", ["XGBClassifier", "SVC"], method = 'halving', budget_seconds = 120)
+        >>> leaderboard = tuner.search()
+        >>> Tuner(X, y, "Classification", ["SVC"], rows = train_index).search()
+        >>> tuner.best_params()
+        >>> {'XGBClassifier': {'learning_rate': 0.08, 'max_depth': 4, ..., 'n_estimators': 61}, 'SVC': {'C': 12.3, 'gamma': 'scale'}}
+        '''
+        self.X_train = X_train
+        self.y_train = y_train
+        self.problem = problem
+        self.model_list = [model_name for model_name in model_list if model_name in search_spaces]
+        self.method = method
+        self.n_trials = n_trials
+        self.budget_seconds = budget_seconds
+        self.n_jobs = n_jobs
+        self.validation = validation
+        self.eta = eta
+        self.cache = cache
+        self.data_key = data_key
+        self.random_state = random_state
+        self.rows = rows
+        self.trials = []
+
+
+    def candidates(self):
+        # n_trials draws per model, interleaved so that a short budget still covers every model
+        random_state = np.random.RandomState(self.random_state)
+        draws = {model_name: [sample_params(model_name, random_state) for _ in range(self.n_trials)] for model_name in self.model_list}
+        return [(model_name, draws[model_name][i]) for i in range(self.n_trials) for model_name in self.model_list]
+
+
+    def trial_key(self, model_name, params, rows):
+        if self.cache is None or self.data_key is None:
+            return None
+        data_key = self.data_key + "|tuning|rows=" + str(rows) + "|validation=" + str(self.validation)
+        return model_fingerprint(data_key, model_name, model_maker(model_name, **params))
+
+
+    def run_batch(self, parallel, candidates, rows, rung, deadline):
+        # Runs the candidates on the first rows training rows (of a fixed shuffle), in parallel, skipping cached ones
+        n_val = max(int(rows * self.validation), 1)
+        fit_rows, val_rows = self.order[: rows - n_val], self.order[rows - n_val : rows]
+
+        results = [None] * len(candidates)
+        to_run = []
+        for i, (model_name, params) in enumerate(candidates):
+            key = self.trial_key(model_name, params, rows)
+            cached = self.cache.get(key) if key is not None else None
+            if cached is not None:
+                results[i] = dict(cached, cached = True)
+            else:
+                to_run.append(i)
+
+        single_thread = self.n_jobs != 1
+        outputs = parallel(
+            joblib.delayed(run_trial)(candidates[i][0], candidates[i][1], self.problem, self.X_train, self.y_train, fit_rows, val_rows,
+                                      deadline, single_thread)
+            for i in to_run
+        )
+        for i, output in zip(to_run, outputs):
+            if output is not None:
+                key = self.trial_key(candidates[i][0], candidates[i][1], rows)
+                if key is not None:
+                    self.cache.put(key, output)
+                results[i] = dict(output, cached = False)
+
+        done = []
+        for (model_name, params), result in zip(candidates, results):
+            if result is None:
+                continue
+            # params is what the trial was drawn with, sampled is kept for the next rung of halving
+            trial = dict(result, model = model_name, params = params, sampled = params, rows = rows, rung = rung)
+            if trial['best_iteration'] is not None:
+                trial['params'] = dict(params, n_estimators = int(trial['best_iteration']) + 1)
+            self.trials.append(trial)
+            done.append(trial)
+        return done
+
+
+    def search(self):
+        # Runs the search and returns the leaderboard
+        deadline = time.time() + self.budget_seconds
+        n_rows = self.X_train.shape[0] if self.rows is None else len(self.rows)
+        self.order = np.random.RandomState(self.random_state).permutation(n_rows)
+        if self.rows is not None:
+            self.order = np.asarray(self.rows)[self.order]
+        self.trials = []
+        candidates = self.candidates()
+        n_jobs = self.n_jobs if self.n_jobs not in (None, 0) else 1
+
+        with joblib.Parallel(n_jobs = n_jobs) as parallel:
+            if self.method == 'halving':
+                rungs = max(int(np.floor(np.log(max(self.n_trials, 1)) / np.log(self.eta))), 0) + 1  # rungs until one draw per model is left
+                rows = max(n_rows // self.eta ** (rungs - 1), min(n_rows, 100))
+                rung = 0
+                while candidates != [] and time.time() < deadline:
+                    done = [trial for trial in self.run_batch(parallel, candidates, min(rows, n_rows), rung, deadline) if trial['score'] is not None]
+                    if rows >= n_rows:
+                        break
+                    # Every model is cut against its own trials only : on few rows the fast learners score better,
+                    # a shared cut would drop whole families (SVC, MLP) before they see enough data
+                    candidates = []
+                    for model_name in self.model_list:
+                        model_done = sorted([trial for trial in done if trial['model'] == model_name], key = lambda trial: trial['score'], reverse = True)
+                        candidates.extend((trial['model'], trial['sampled']) for trial in model_done[: max(len(model_done) // self.eta, 1)])
+                    rows *= self.eta
+                    rung += 1
+            else:
+                # Batches as big as the pool, so the budget is checked between them
+                batch_size = max(joblib.effective_n_jobs(n_jobs), 1)
+                for start in range(0, len(candidates), batch_size):
+                    if time.time() >= deadline:
+                        break
+                    self.run_batch(parallel, candidates[start : start + batch_size], n_rows, 0, deadline)
+        return self.leaderboard()
+
+
+    def leaderboard(self):
+        '''
+        Returns a DataFrame of the trials, the ones which got the furthest (most rows) and scored best first.
+        '''
+        columns = ['Model', 'Score', 'Rows', 'Seconds', 'Cached', 'Params', 'Error']
+        rows = [(trial['model'], trial['score'], trial['rows'], round(trial['seconds'], 2), trial['cached'], repr(trial['params']), trial['error'])
+                for trial in self.ranked()]
+        return pd.DataFrame(rows, columns = columns)
+
+
+    def ranked(self):
+        # Failed trials last
+        return sorted(self.trials, key = lambda trial: (trial['score'] is not None, trial['rows'], trial['score'] or 0), reverse = True)
+
+
+    def best_params(self):
+        # Best parameters found for every model, only the trials on the most rows count
+        best = {}
+        for trial in self.ranked():
+            if trial['score'] is not None and trial['model'] not in best:
+                best[trial['model']] = trial['params']
+        return best
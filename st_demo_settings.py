@@ -1,3 +1,10 @@
+import hashlib
+import logging
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
 import streamlit as st
 from streamlit.hashing import _CodeHasher
 
@@ -11,6 +18,8 @@ except ModuleNotFoundError:
     from streamlit.server.server import Server
 
 
+logger = logging.getLogger(__name__)
+
 # def main():
 #     state = get_state()
 #     pages = {
@@ -77,6 +86,9 @@ class _SessionState:
             "hasher": _CodeHasher(hash_funcs),
             "is_rerun": False,
             "session": session,
+            "dirty": set(),
+            "value_hashes": {},
+            "sync_times": deque(maxlen=100),
         }
 
     def __call__(self, **kwargs):
@@ -84,6 +96,7 @@ class _SessionState:
         for item, value in kwargs.items():
             if item not in self._state["data"]:
                 self._state["data"][item] = value
+                self._state["dirty"].add(item)
 
     def __getitem__(self, item):
         """Return a saved state value, None if item is undefined."""
@@ -98,18 +111,61 @@ class _SessionState:
     def __setitem__(self, item, value):
         """Set state value."""
         self._state["data"][item] = value
+        self._state["dirty"].add(item)
 
     def __setattr__(self, item, value):
         """Set state value."""
         self._state["data"][item] = value
+        self._state["dirty"].add(item)
     
     def clear(self):
         """Clear session state and request a rerun."""
         self._state["data"].clear()
+        self._state["value_hashes"].clear()
+        self._state["dirty"].clear()
         self._state["session"].request_rerun()
+
+    def _value_hash(self, item, value):
+        """Return the hash of one state value, reusing the previous one for datasets of the same version and large values which weren't reassigned."""
+        cached = self._state["value_hashes"].get(item)
+        version = _dataset_version_fingerprint(value)
+        if version is not None:
+            # A dataset carrying a version (a DataFrame of the app or a SpilledDataset) is hashed by its version alone :
+            # every change of its content gives it a new one, so reassigning the same version on each rerun costs nothing
+            if cached is None or cached[0] != version:
+                self._state["value_hashes"][item] = (version, hashlib.md5(repr(version).encode()).digest())
+            return self._state["value_hashes"][item][1]
+
+        fingerprint = _large_value_fingerprint(value)
+
+        # Large values (DataFrames, arrays) are only rehashed when they were set again since the last sync
+        # or when their identity, shape or dtypes changed, small values are always rehashed to catch in-place edits
+        if (cached is not None and fingerprint is not None and item not in self._state["dirty"]
+                and cached[0] == fingerprint):
+            return cached[1]
+
+        value_hash = self._state["hasher"].to_bytes(value, None)
+        self._state["value_hashes"][item] = (fingerprint, value_hash)
+        return value_hash
+
+    def _data_hash(self):
+        """Return a hash of all the state values."""
+        data = self._state["data"]
+        hasher = hashlib.md5()
+        for item in sorted(data, key=str):
+            hasher.update(str(item).encode())
+            hasher.update(self._value_hash(item, data[item]))
+
+        for item in list(self._state["value_hashes"]):
+            if item not in data:
+                del self._state["value_hashes"][item]
+        self._state["dirty"].clear()
+        return hasher.digest()
     
     def sync(self):
         """Rerun the app with all state values up to date from the beginning to fix rollbacks."""
+        start = time.perf_counter()
+        data_hash = self._data_hash()
 
         # Ensure to rerun only once to avoid infinite loops
         # caused by a constantly changing state value at each run.
@@ -119,11 +175,47 @@ class _SessionState:
             self._state["is_rerun"] = False
         
         elif self._state["hash"] is not None:
-            if self._state["hash"] != self._state["hasher"].to_bytes(self._state["data"], None):
+            if self._state["hash"] != data_hash:
                 self._state["is_rerun"] = True
                 self._state["session"].request_rerun()
 
-        self._state["hash"] = self._state["hasher"].to_bytes(self._state["data"], None)
+        self._state["hash"] = data_hash
+
+        sync_seconds = time.perf_counter() - start
+        self._state["sync_times"].append(sync_seconds)
+        logger.debug("session state sync took %.4f s", sync_seconds)
+
+    def sync_stats(self):
+        """Return how long sync took on the last rerun, and on average over the recent ones, in seconds."""
+        sync_times = self._state["sync_times"]
+        if len(sync_times) == 0:
+            return {"last": None, "mean": None, "max": None, "reruns": 0}
+        return {
+            "last": sync_times[-1],
+            "mean": sum(sync_times) / len(sync_times),
+            "max": max(sync_times),
+            "reruns": len(sync_times),
+        }
+
+
+def _dataset_version_fingerprint(value):
+    """Return (dataset version, shape, columns) of a DataFrame or SpilledDataset stamped with a version, None for other values."""
+    if not (isinstance(value, pd.DataFrame) or type(value).__name__ == "SpilledDataset"):
+        return None
+    version = getattr(value, "attrs", {}).get("dataset_version")
+    if version is None:
+        return None
+    # Shape and columns too, pandas copies attrs to frames derived from a versioned one
+    return ("dataset_version", version, value.shape, tuple(value.columns))
+
+
+def _large_value_fingerprint(value):
+    """Return a cheap fingerprint (identity, shape, dtypes) of a DataFrame, Series or array, None for other values."""
+    if isinstance(value, pd.DataFrame):
+        return (id(value), value.shape, tuple(value.columns), tuple(str(dtype) for dtype in value.dtypes))
+    if isinstance(value, (pd.Series, np.ndarray)):
+        return (id(value), value.shape, str(value.dtype))
+    return None
 
 
 def _get_session():
@@ -136,6 +228,10 @@ def _get_session():
     return session_info.session
 
 
+def get_session_id():
+    return get_report_ctx().session_id
+
+
 def get_state(hash_funcs=None):
     session = _get_session()
 